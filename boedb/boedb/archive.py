@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import zlib
+from pathlib import Path
+
+from boedb.config import DiarioBoeConfig, get_logger
+
+
+def get_document_archive():
+    if hasattr(DocumentArchive, "_archive"):
+        return DocumentArchive._archive
+
+    archive = None
+    if DiarioBoeConfig.ARCHIVE_PATH:
+        archive = DocumentArchive(DiarioBoeConfig.ARCHIVE_PATH)
+    DocumentArchive._archive = archive
+    return archive
+
+
+class DocumentArchive:
+    """
+    On-disk archive of raw documents keyed by their BOE id.
+
+    Documents are stored zlib compressed under `objects/`, addressed by the sha256 of
+    their content, so identical documents are only stored once. An append-only
+    `index.jsonl` file maps every id to the digest of its latest content.
+    """
+
+    def __init__(self, path, compress_level=6):
+        self.path = Path(path)
+        self.compress_level = compress_level
+        self.logger = get_logger("boedb.archive")
+
+        (self.path / "objects").mkdir(parents=True, exist_ok=True)
+        self.index_path = self.path / "index.jsonl"
+        self.index = self.read_index()
+        self.index_file = open(self.index_path, "a", encoding="utf-8")
+
+    def read_index(self):
+        index = {}
+        if not self.index_path.exists():
+            return index
+
+        with open(self.index_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                index[entry["id"]] = entry["digest"]
+        return index
+
+    def get_object_path(self, digest):
+        return self.path / "objects" / digest[:2] / digest[2:]
+
+    def __contains__(self, doc_id):
+        return doc_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def ids(self, prefix=""):
+        return sorted(doc_id for doc_id in self.index if doc_id.startswith(prefix))
+
+    def get(self, doc_id):
+        """Return the raw content stored for `doc_id`, or None if it's not archived."""
+        digest = self.index.get(doc_id)
+        if digest is None:
+            return None
+
+        try:
+            with open(self.get_object_path(digest), "rb") as f:
+                return zlib.decompress(f.read())
+        except FileNotFoundError:
+            self.logger.warning(f"Missing archived object {digest} for {doc_id}")
+            return None
+
+    def put(self, doc_id, data):
+        """Store the raw `data` bytes of `doc_id`, replacing any previous content."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.get_object_path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(data, self.compress_level))
+            os.replace(tmp_path, path)
+
+        if self.index.get(doc_id) != digest:
+            self.index_file.write(json.dumps({"id": doc_id, "digest": digest}) + "\n")
+            self.index_file.flush()
+            self.index[doc_id] = digest
+        return digest
+
+    def close(self):
+        self.index_file.close()
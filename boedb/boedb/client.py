@@ -1,6 +1,9 @@
 import asyncio
+import functools
+import importlib.util
 import re
 import ssl
+import time
 import urllib.parse
 import uuid
 
@@ -8,6 +11,7 @@ import aiohttp
 import certifi
 
 from boedb.config import HttpConfig, get_logger
+from boedb.metrics import get_metrics
 
 
 def get_http_client_session():  # pragma: no cover
@@ -15,10 +19,51 @@ def get_http_client_session():  # pragma: no cover
     ctx.minimum_version = ssl.TLSVersion.TLSv1_3
     ctx.load_verify_locations(certifi.where())
     conn = aiohttp.TCPConnector(ssl=ctx)
-    session = aiohttp.ClientSession(connector=conn)
+    session = aiohttp.ClientSession(connector=conn, json_serialize=get_json_codec().dumps)
     return session
 
 
+def get_json_codec():
+    if hasattr(JsonCodec, "_codec"):
+        return JsonCodec._codec
+
+    codec = JsonCodec(HttpConfig.JSON_CODEC)
+    JsonCodec._codec = codec
+    return codec
+
+
+class JsonCodec:
+    """
+    JSON encoder and decoder backed by `library`, or the fastest library installed with
+    "auto", falling back to the standard library.
+
+    `loads` takes either str or bytes, `dumps` returns str and `dumps_bytes` returns the
+    utf-8 encoded document, as psycopg and the http body take it.
+    """
+
+    LIBRARIES = ("orjson", "ujson", "json")
+
+    def __init__(self, library="auto"):
+        if library == "auto":
+            library = next(name for name in self.LIBRARIES if importlib.util.find_spec(name))
+        elif library not in self.LIBRARIES:
+            raise ValueError(f"Unknown JSON library: {library}")
+
+        self.library = library
+        module = importlib.import_module(library)
+        self.loads = module.loads
+
+        if library == "orjson":
+            self.dumps_bytes = module.dumps
+            self.dumps = lambda obj: module.dumps(obj).decode()
+        else:
+            self.dumps = functools.partial(module.dumps, ensure_ascii=False)
+            self.dumps_bytes = lambda obj: self.dumps(obj).encode()
+
+    def __repr__(self):
+        return f"JsonCodec({self.library})"
+
+
 class HttpRetryManager:
     def __init__(self, max_attempts):
         self.max_attempts = max_attempts
@@ -80,15 +125,30 @@ class HttpClient:
         if retry_manager is None:
             self.retry_manager = HttpRetryManager(HttpConfig.MAX_ATTEMPTS)
         self.logger = get_logger("http")
+        self.metrics = get_metrics()
+        self.json_codec = get_json_codec()
 
     def get_url(self, path):
         if self.base_url:
             return urllib.parse.urljoin(self.base_url, path)
         return path
 
-    async def handle_request(self, req_params, req_id, parse_response=True):
+    def record_response(self, req_params, response, start):
+        method = req_params["method"]
+        self.metrics.inc("boedb_http_requests_total", method=method, status=response.status)
+        self.metrics.observe("boedb_http_request_seconds", time.perf_counter() - start, method=method)
+
+    def record_retry(self, req_params):
+        self.metrics.inc("boedb_http_retries_total", method=req_params["method"])
+
+    async def handle_request(self, req_params, req_id, parse_response=True, response_hook=None):
+        start = time.perf_counter()
         request = self.session.request(**req_params)
         async with request as response:
+            self.record_response(req_params, response, start)
+            if response_hook is not None:
+                response_hook(response)
+
             body = None
             if not response.ok:
                 body = await response.text()
@@ -96,18 +156,20 @@ class HttpClient:
             try:
                 response.raise_for_status()
                 if parse_response:
-                    return await response.json()
+                    # decoded from the body bytes, large responses aren't copied into a str first
+                    return self.json_codec.loads(await response.read())
                 return await response.text()
             except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
                 self.logger.warning(f"Request {req_id} error: ({exc})\n{body}")
                 if self.retry_manager:
                     if await self.retry_manager.retry_wait(request, response, req_id):
-                        return await self.handle_request(req_params, req_id, parse_response)
+                        self.record_retry(req_params)
+                        return await self.handle_request(req_params, req_id, parse_response, response_hook)
 
                 self.logger.error(f"Request {req_id} aborted: max attempts exceeded")
                 raise exc from None
 
-    async def get(self, path, params=None, parse_response=True, req_id=None):
+    async def get(self, path, params=None, parse_response=True, req_id=None, response_hook=None):
         req_id = req_id or uuid.uuid4().hex[:8]
         url = self.get_url(path)
         self.logger.debug(f"Request {req_id}: GET({url})")
@@ -118,9 +180,40 @@ class HttpClient:
             "headers": self.headers,
             "timeout": self.timeout,
         }
-        return await self.handle_request(req_params, req_id, parse_response)
+        return await self.handle_request(req_params, req_id, parse_response, response_hook)
+
+    async def get_stream(self, path, params=None, req_id=None, chunk_size=2**16):
+        """Yield the response body in chunks as it is received. Failed requests are
+        retried as long as no chunk has been yielded."""
+        req_id = req_id or uuid.uuid4().hex[:8]
+        url = self.get_url(path)
+        self.logger.debug(f"Request {req_id}: GET({url}) streaming")
+        req_params = {
+            "method": "get",
+            "url": url,
+            "params": params,
+            "headers": self.headers,
+            "timeout": self.timeout,
+        }
+
+        while True:
+            start = time.perf_counter()
+            request = self.session.request(**req_params)
+            async with request as response:
+                # streamed requests are timed until their headers are received
+                self.record_response(req_params, response, start)
+                if not response.ok and self.retry_manager:
+                    self.logger.warning(f"Request {req_id} error: ({response.status})")
+                    if await self.retry_manager.retry_wait(request, response, req_id):
+                        self.record_retry(req_params)
+                        continue
+
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+                return
 
-    async def post(self, path, json, params=None, parse_response=True, req_id=None):
+    async def post(self, path, json, params=None, parse_response=True, req_id=None, response_hook=None):
         req_id = req_id or uuid.uuid4().hex
         url = self.get_url(path)
         self.logger.debug(f"Request {req_id}: POST({url})")
@@ -132,4 +225,4 @@ class HttpClient:
             "headers": self.headers,
             "timeout": self.timeout,
         }
-        return await self.handle_request(req_params, req_id, parse_response)
+        return await self.handle_request(req_params, req_id, parse_response, response_hook)
@@ -54,6 +54,46 @@ class DiarioBoeConfig:
     # Number of articles to be stored simultaneously
     ARTICLE_LOAD_CONCURRENCY = 25
 
+    # How articles are stored: "insert" one statement per row, "upsert" to update rows
+    # already loaded, completing incomplete summaries and articles in place, "transaction"
+    # to load each article with all its fragments atomically, or "bulk" to buffer rows
+    # and stream them with binary COPY
+    ARTICLE_LOAD_MODE = config.get("ARTICLE_LOAD_MODE", "insert")
+
+    # Max number of rows buffered for a bulk load, and max seconds to wait
+    # for the buffer to fill up before flushing it anyway
+    ARTICLE_LOAD_BULK_SIZE = 500
+    ARTICLE_LOAD_BULK_INTERVAL = 1
+
+    # Loaded articles are looked up by summary. Wide backfills can check a bloom filter
+    # of every loaded article id first, built once per process, to skip most lookups
+    ARTICLE_FILTER_BLOOM = config.get("ARTICLE_FILTER_BLOOM", "0") == "1"
+    ARTICLE_FILTER_BLOOM_ERROR_RATE = 0.001
+
+    # Extract and transform articles with a fixed pool of workers per stage, instead of
+    # a task per item. Items are then loaded out of order, so it requires "transaction" mode
+    ARTICLE_STAGE_WORKERS = config.get("ARTICLE_STAGE_WORKERS", "0") == "1"
+
+    # Number of processes to parse, split and clean articles without blocking
+    # the event loop, or 0 to do it inline
+    ARTICLE_CPU_PROCESSES = int(config.get("ARTICLE_CPU_PROCESSES", 0))
+
+    # Directory to archive raw summary and article documents, disabled if not set.
+    # In offline mode articles are only extracted from the archive, skipping the rest
+    ARCHIVE_PATH = config.get("BOE_ARCHIVE_PATH")
+    ARCHIVE_OFFLINE = config.get("BOE_ARCHIVE_OFFLINE", "0") == "1"
+
+    # Backfills process this many dates at once, sharing a budget of items being
+    # processed at once by all of them, and record their progress in the ledger file
+    BACKFILL_DAYS_CONCURRENCY = 4
+    BACKFILL_CONCURRENCY_BUDGET = 100
+    BACKFILL_LEDGER_PATH = config.get("BOE_BACKFILL_LEDGER_PATH", "backfill-ledger.json")
+
+    # Sharded backfills split dates in shards of this many days, processed by a pool
+    # of worker processes, each one running its own backfill of the shard
+    BACKFILL_PROCESSES = 1
+    BACKFILL_SHARD_DAYS = 7
+
     # We can't exceed LLM's max context tokens, so the original text
     # plus the generated outcome must be controlled
     ARTICLE_FRAGMENT_MAX_LENGTH = 8192
@@ -73,6 +113,10 @@ class HttpConfig:
     # Number of seconds to increase wait time on each retry
     BASE_RETRY_WAIT_TIME = 10
 
+    # JSON library for responses, requests and jsonb columns: "orjson", "ujson", "json",
+    # or "auto" for the fastest one installed
+    JSON_CODEC = config.get("JSON_CODEC", "auto")
+
 
 @dataclass
 class DBConfig:
@@ -81,9 +125,37 @@ class DBConfig:
     DBNAME = config["PG_DBNAME"]
     DSN = f"user={USER} password={PASSWORD} dbname={DBNAME}"
 
+    # Max connections for the asyncio pool, so concurrent loads don't wait on each other
+    POOL_MAX_SIZE = 25
+
 
 @dataclass
 class OpenAiConfig:
     API_KEY = config["OPENAI_API_KEY"]
     REQUEST_TIMEOUT = 300
     REQUEST_MAX_RETRIES = 3
+
+    # Concurrent embeddings requests are sent together in batches of up to
+    # this many inputs and estimated tokens, waiting up to max seconds for a batch to fill
+    EMBEDDINGS_BATCH_SIZE = 256
+    EMBEDDINGS_BATCH_MAX_TOKENS = 50000
+    EMBEDDINGS_BATCH_MAX_WAIT = 0.1
+
+    # Local file to cache completions and embeddings, disabled if not set.
+    # Least recently used entries are evicted past the max size in bytes
+    CACHE_PATH = config.get("OPENAI_CACHE_PATH")
+    CACHE_MAX_SIZE = int(config.get("OPENAI_CACHE_MAX_SIZE", 2 * 1024**3))
+
+
+@dataclass
+class MetricsConfig:
+    # Where pipeline, http and db metrics are recorded: "memory" to keep them in the
+    # process, "prometheus" to also expose them in Prometheus text format, or empty to disable
+    SINK = config.get("METRICS_SINK", "")
+
+    # Prometheus text file, rewritten as every date finishes, eg. for node_exporter's textfile
+    # collector. `{pid}` is replaced by the process id, so sharded backfill workers don't clash
+    PROMETHEUS_PATH = config.get("METRICS_PROMETHEUS_PATH", "boedb-metrics-{pid}.prom")
+
+    # Port to serve metrics on during single process backfills, disabled if not set
+    PROMETHEUS_PORT = int(config.get("METRICS_PROMETHEUS_PORT", 0))
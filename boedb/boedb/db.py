@@ -1,10 +1,19 @@
 import itertools
+import struct
+import sys
+import time
+from array import array
 from collections.abc import Iterable
+from contextlib import asynccontextmanager
 
 import psycopg
-from psycopg_pool import ConnectionPool
+from psycopg.adapt import Dumper
+from psycopg.pq import Format
+from psycopg.types import TypeInfo
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 
 from boedb.config import DBConfig
+from boedb.metrics import get_metrics
 
 
 def get_db_client():
@@ -16,22 +25,113 @@ def get_db_client():
     return client
 
 
+def get_async_db_client():
+    if hasattr(AsyncPostgresClient, "_client"):
+        return AsyncPostgresClient._client
+
+    client = AsyncPostgresClient(DBConfig.DSN, max_size=DBConfig.POOL_MAX_SIZE)
+    AsyncPostgresClient._client = client
+    return client
+
+
+def get_insert_sql(table, row_dicts, columns=None):
+    """Return the parametrized INSERT statement for `table` and the row values
+    for each of the `row_dicts`, in `columns` order."""
+    if columns is None:
+        columns = set(itertools.chain.from_iterable(list(rd.keys()) for rd in row_dicts))
+        columns = list(sorted(columns))
+
+    values = []
+    for row_dict in row_dicts:
+        row_values = tuple(row_dict.get(c) for c in columns)
+        values.append(row_values)
+
+    columns_fmt = ", ".join(columns)
+    values_fmt = ", ".join(r"%s" for c in columns)
+    sql = f"INSERT INTO {table} ({columns_fmt}) VALUES ({values_fmt})"
+
+    return sql, values
+
+
+def get_upsert_sql(table, row_dicts, conflict_columns, update_columns=None, columns=None):
+    """Return the parametrized INSERT statement for `table` that updates `update_columns`
+    of rows conflicting on `conflict_columns`, or skips them if there are no columns to
+    update, and the row values for each of the `row_dicts`."""
+    sql, values = get_insert_sql(table, row_dicts, columns)
+
+    conflict_fmt = ", ".join(conflict_columns)
+    if update_columns:
+        update_fmt = ", ".join(f"{c} = EXCLUDED.{c}" for c in update_columns)
+        sql = f"{sql} ON CONFLICT ({conflict_fmt}) DO UPDATE SET {update_fmt}"
+    else:
+        sql = f"{sql} ON CONFLICT ({conflict_fmt}) DO NOTHING"
+
+    return sql, values
+
+
+def record_query(metrics, operation, rows, start):
+    """Record the rows affected by a statement, unknown for some statements, and its duration."""
+    if not metrics.enabled:
+        return
+    metrics.inc("boedb_db_rows_total", max(rows, 0), operation=operation)
+    metrics.observe("boedb_db_query_seconds", time.perf_counter() - start, operation=operation)
+
+
+class VectorBinaryDumper(Dumper):
+    """Dump a sequence of floats in pgvector's binary format: dimensions and
+    an unused flag as int16, followed by every value as a float32, big endian.
+
+    float32 arrays are dumped from their buffer, without converting every value."""
+
+    format = Format.BINARY
+
+    def dump(self, obj):
+        if not isinstance(obj, array) or obj.typecode != "f":
+            return struct.pack(f">HH{len(obj)}f", len(obj), 0, *obj)
+
+        data = bytearray(struct.pack(">HH", len(obj), 0))
+        if sys.byteorder == "little":
+            obj = array("f", obj)
+            obj.byteswap()
+        data += obj
+        return data
+
+
+async def register_vector(conn):
+    """Register the `vector` type on the connection so it can be used in binary COPY, and
+    float32 arrays are dumped as vectors."""
+    info = await TypeInfo.fetch(conn, "vector")
+    if info is None:
+        return
+
+    info.register(conn)
+    dumper = type("VectorBinaryDumper", (VectorBinaryDumper,), {"oid": info.oid})
+    conn.adapters.register_dumper(None, dumper)
+    # embeddings are float32 arrays, dumped as vectors in any statement
+    conn.adapters.register_dumper(array, dumper)
+
+
 class PostgresClient:
     def __init__(self, dsn):
         self.dsn = dsn
         self.pool = ConnectionPool(dsn)
+        self.metrics = get_metrics()
 
     def execute(self, sql, vars=None):
         with self.pool.connection() as conn:  # pylint: disable-all
             with conn.cursor(row_factory=psycopg.rows.dict_row) as cursor:
+                start = time.perf_counter()
                 cursor.execute(sql, vars)
+                record_query(self.metrics, "execute", cursor.rowcount, start)
                 if cursor.rownumber is not None:
                     return list(cursor)
 
     def execute_many(self, sql, vars=None):
         with self.pool.connection() as conn:  # pylint: disable-all
             with conn.cursor(row_factory=psycopg.rows.dict_row) as cursor:
+                start = time.perf_counter()
                 cursor.executemany(sql, vars)
+                record_query(self.metrics, "execute_many", cursor.rowcount, start)
                 if cursor.rownumber is not None:
                     return list(cursor)
 
@@ -39,17 +139,136 @@ class PostgresClient:
         return self.insert_many(table, [row_dict], columns)
 
     def insert_many(self, table, row_dicts, columns=None):
-        if columns is None:
-            columns = set(itertools.chain.from_iterable(list(rd.keys()) for rd in row_dicts))
-            columns = list(sorted(columns))
+        sql, values = get_insert_sql(table, row_dicts, columns)
+        return self.execute(sql, values)
+
+    def upsert(self, table, row_dict, conflict_columns, update_columns=None, columns=None):
+        return self.upsert_many(table, [row_dict], conflict_columns, update_columns, columns)
+
+    def upsert_many(self, table, row_dicts, conflict_columns, update_columns=None, columns=None):
+        sql, values = get_upsert_sql(table, row_dicts, conflict_columns, update_columns, columns)
+        return self.execute_many(sql, values)
+
+
+class AsyncPostgresClient:
+    """
+    asyncio counterpart of `PostgresClient`, so statements don't block the event loop.
 
-        values = []
-        for row_dict in row_dicts:
-            row_values = tuple(row_dict.get(c) for c in columns)
-            values.append(row_values)
+    The pool is opened lazily on first use, as it must be bound to a running loop,
+    and can be closed and opened again by a later loop.
+    """
 
+    def __init__(self, dsn, max_size=None):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.pool = None
+        self.metrics = get_metrics()
+
+    async def get_pool(self):
+        if self.pool is None:
+            self.pool = AsyncConnectionPool(
+                self.dsn, max_size=self.max_size, configure=register_vector, open=False
+            )
+            await self.pool.open()
+        return self.pool
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def advisory_lock(self, key):
+        """Try to take a session advisory lock on `key` for the duration of the context,
+        yielding whether it was taken. Postgres releases it if the connection is lost."""
+        pool = await self.get_pool()
+        async with pool.connection() as conn:  # pylint: disable-all
+            cursor = await conn.execute("select pg_try_advisory_lock(hashtext(%s))", (key,))
+            (locked,) = await cursor.fetchone()
+            # don't leave the connection idle in transaction while the lock is held
+            await conn.commit()
+            try:
+                yield locked
+            finally:
+                if locked:
+                    await conn.execute("select pg_advisory_unlock(hashtext(%s))", (key,))
+
+    async def execute(self, sql, vars=None):
+        pool = await self.get_pool()
+        async with pool.connection() as conn:  # pylint: disable-all
+            async with conn.cursor(row_factory=psycopg.rows.dict_row) as cursor:
+                start = time.perf_counter()
+                await cursor.execute(sql, vars)
+                record_query(self.metrics, "execute", cursor.rowcount, start)
+                if cursor.rownumber is not None:
+                    return await cursor.fetchall()
+
+    async def iterate(self, sql, vars=None, size=10000):
+        """Yield the rows of `sql` from a server side cursor, fetched `size` rows at a
+        time, so large results don't need to be held in memory."""
+        pool = await self.get_pool()
+        async with pool.connection() as conn:  # pylint: disable-all
+            async with conn.cursor(name="boedb_iterate", row_factory=psycopg.rows.dict_row) as cursor:
+                cursor.itersize = size
+                await cursor.execute(sql, vars)
+                async for row in cursor:
+                    yield row
+
+    async def execute_many(self, sql, vars=None):
+        pool = await self.get_pool()
+        async with pool.connection() as conn:  # pylint: disable-all
+            async with conn.cursor(row_factory=psycopg.rows.dict_row) as cursor:
+                start = time.perf_counter()
+                await cursor.executemany(sql, vars)
+                record_query(self.metrics, "execute_many", cursor.rowcount, start)
+                if cursor.rownumber is not None:
+                    return await cursor.fetchall()
+
+    async def execute_transaction(self, statements):
+        """Execute `statements`, pairs of sql and a list of values to execute it with, in
+        a single transaction. Pipeline mode sends every statement without waiting for the
+        previous ones, so they share round trips and a single commit."""
+        pool = await self.get_pool()
+        async with pool.connection() as conn:  # pylint: disable-all
+            start = time.perf_counter()
+            async with conn.pipeline(), conn.transaction():
+                async with conn.cursor() as cursor:
+                    for sql, values in statements:
+                        await cursor.executemany(sql, values)
+            rows = sum(len(values) for _, values in statements)
+            record_query(self.metrics, "transaction", rows, start)
+
+    async def insert(self, table, row_dict, columns=None):
+        return await self.insert_many(table, [row_dict], columns)
+
+    async def insert_many(self, table, row_dicts, columns=None):
+        sql, values = get_insert_sql(table, row_dicts, columns)
+        return await self.execute_many(sql, values)
+
+    async def upsert(self, table, row_dict, conflict_columns, update_columns=None, columns=None):
+        return await self.upsert_many(table, [row_dict], conflict_columns, update_columns, columns)
+
+    async def upsert_many(self, table, row_dicts, conflict_columns, update_columns=None, columns=None):
+        sql, values = get_upsert_sql(table, row_dicts, conflict_columns, update_columns, columns)
+        return await self.execute_many(sql, values)
+
+    async def copy_many(self, table, row_dicts, columns, types):
+        """Stream `row_dicts` into `table` with a binary COPY.
+
+        Binary values must match the column types exactly, so the postgres type
+        for each of the `columns` is required as `types`.
+        """
         columns_fmt = ", ".join(columns)
-        values_fmt = ", ".join(r"%s" for c in columns)
-        sql = f"INSERT INTO {table} ({columns_fmt}) VALUES ({values_fmt})"
+        sql = f"COPY {table} ({columns_fmt}) FROM STDIN (FORMAT BINARY)"
 
-        return self.execute(sql, values)
+        pool = await self.get_pool()
+        async with pool.connection() as conn:  # pylint: disable-all
+            async with conn.cursor() as cursor:
+                start = time.perf_counter()
+                rows = 0
+                async with cursor.copy(sql) as copy:
+                    copy.set_types(types)
+                    for row_dict in row_dicts:
+                        await copy.write_row(tuple(row_dict.get(c) for c in columns))
+                        rows += 1
+                record_query(self.metrics, "copy", rows, start)
@@ -1,40 +1,117 @@
 from xml.etree import ElementTree
 
+from boedb.archive import get_document_archive
 from boedb.client import HttpClient
 from boedb.config import get_logger
-from boedb.diario_boe.models import Article, DaySummary
+from boedb.diario_boe.models import (
+    Article,
+    DaySummary,
+    DaySummaryParser,
+    DocumentError,
+    get_summary_id,
+)
 from boedb.pipelines.step import BaseStepExtractor
 from boedb.pipelines.stream import StreamPipelineBaseExecutor
+from boedb.processors.html import HTMLFilter
 
 BASE_URL = "https://www.boe.es"
 
 
-async def extract_boe_xml(doc_id, client):
+async def fetch_boe_xml(doc_id, client, archive=None):
+    """Return the raw document for `doc_id`, and whether it was read from the archive."""
+    if archive is not None and (xml := archive.get(doc_id)) is not None:
+        return xml, True
+
     url = f"{BASE_URL}/diario_boe/xml.php?id={doc_id}"
-    xml = await client.get(url, parse_response=False)
-    return ElementTree.fromstring(xml)
+    return await client.get(url, parse_response=False), False
+
+
+async def extract_boe_xml(doc_id, client, archive=None):
+    xml, archived = await fetch_boe_xml(doc_id, client, archive)
+    root = ElementTree.fromstring(xml)
+    if archive is not None and not archived and root.tag != "error":
+        archive.put(doc_id, xml.encode("utf-8"))
+    return root
+
+
+async def archive_chunks(chunks, received):
+    async for chunk in chunks:
+        received.append(chunk)
+        yield chunk
+
+
+async def extract_boe_summary(summary_id, client, archive=None):
+    if archive is not None and (xml := archive.get(summary_id)) is not None:
+        return DaySummary.from_xml(ElementTree.fromstring(xml))
+
+    # the summary is parsed while it's being received
+    url = f"{BASE_URL}/diario_boe/xml.php?id={summary_id}"
+    if archive is None:
+        return await DaySummary.from_chunks(client.get_stream(url))
+
+    received = []
+    summary = await DaySummary.from_chunks(archive_chunks(client.get_stream(url), received))
+    archive.put(summary_id, b"".join(received))
+    return summary
 
 
-async def extract_boe_summary(summary_id, client):
-    xml = await extract_boe_xml(summary_id, client)
-    return DaySummary.from_xml(xml)
+async def extract_boe_summary_entries(summary_id, client, archive=None):
+    """Yield the entries of a summary as soon as they are received."""
+    parser = DaySummaryParser()
+    if archive is not None and (xml := archive.get(summary_id)) is not None:
+        for entry in parser.feed(xml):
+            yield entry
+        for entry in parser.close():
+            yield entry
+        return
 
+    url = f"{BASE_URL}/diario_boe/xml.php?id={summary_id}"
+    received = []
+    async for chunk in client.get_stream(url):
+        received.append(chunk)
+        for entry in parser.feed(chunk):
+            yield entry
 
-async def extract_boe_article(article_id, summary_id, client):
-    xml = await extract_boe_xml(article_id, client)
+    for entry in parser.close():
+        yield entry
+
+    if archive is not None:
+        archive.put(summary_id, b"".join(received))
+
+
+async def extract_boe_article(article_id, summary_id, client, archive=None):
+    xml = await extract_boe_xml(article_id, client, archive)
     return Article.from_xml(xml, summary_id)
 
 
+def parse_boe_article(xml, summary_id):
+    """Parse an article document, split it in fragments and clean their content. This is
+    the CPU-bound part of the extraction, so it's kept picklable to run in a process pool."""
+    doc = Article.from_xml(ElementTree.fromstring(xml), summary_id)
+    fragments = doc.split()
+    clean_contents = HTMLFilter.clean_html_many(fragment.content for fragment in fragments)
+    for fragment, clean_content in zip(fragments, clean_contents):
+        fragment.clean_content = clean_content
+    return doc, fragments
+
+
 class SummaryExtractor(BaseStepExtractor):
-    def __init__(self, date, http_session, should_skip=None):
+    def __init__(self, date, http_session, should_skip=None, offline=False):
         self.date = date
         self.should_skip = should_skip
         self.client = HttpClient(http_session)
+        self.archive = get_document_archive()
+        self.offline = offline
+        if offline and self.archive is None:
+            raise ValueError("Offline extraction requires a document archive")
         self.logger = get_logger("boedb.diario_boe.summary_extractor")
 
     async def __call__(self):
-        summary_id = f"BOE-S-{self.date.strftime('%Y%m%d')}"
-        doc = await extract_boe_summary(summary_id, self.client)
+        summary_id = get_summary_id(self.date)
+        if self.offline and summary_id not in self.archive:
+            raise DocumentError(f"Summary {summary_id} not archived")
+
+        doc = await extract_boe_summary(summary_id, self.client, self.archive)
 
         if self.should_skip is not None and self.should_skip(doc):
             self.logger.info(f"Skipping {doc.summary_id}")
@@ -45,19 +122,33 @@ class SummaryExtractor(BaseStepExtractor):
 
 
 class ArticlesExtractor(StreamPipelineBaseExecutor):
-    def __init__(self, concurrency, http_session, should_skip=None):
+    def __init__(
+        self, concurrency, http_session, should_skip=None, offline=False, cpu_executor=None, workers=False
+    ):
         self.logger = get_logger("boedb.diario_boe.article_extractor")
         self.client = HttpClient(http_session)
         self.should_skip = should_skip
-        super().__init__(concurrency)
+        self.archive = get_document_archive()
+        self.offline = offline
+        if offline and self.archive is None:
+            raise ValueError("Offline extraction requires a document archive")
+        super().__init__(concurrency, cpu_executor, workers)
 
     async def process(self, item):
-        if self.should_skip is not None and self.should_skip(item):
+        if self.should_skip is not None and await self.should_skip(item):
             self.logger.debug(f"Skipping {item}")
             return
 
-        doc = await extract_boe_article(item.entry_id, item.summary_id, self.client)
+        if self.offline and item.entry_id not in self.archive:
+            self.logger.warning(f"Skipping {item}, not archived")
+            return
+
+        xml, archived = await fetch_boe_xml(item.entry_id, self.client, self.archive)
+        doc, fragments = await self.run_cpu_bound(parse_boe_article, xml, item.summary_id)
+
+        # error documents raise when parsed, so only valid documents are archived
+        if self.archive is not None and not archived:
+            self.archive.put(item.entry_id, xml.encode("utf-8"))
 
-        fragments = doc.split()
         self.logger.debug(f"Extracted {doc}")
         return [doc, *fragments]
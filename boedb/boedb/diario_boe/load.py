@@ -1,14 +1,19 @@
-from boedb.config import get_logger
-from boedb.db import get_db_client
+import asyncio
+
+from boedb.config import DiarioBoeConfig, get_logger
+from boedb.db import get_async_db_client, get_insert_sql, get_upsert_sql
 from boedb.diario_boe.models import Article, ArticleFragment
 from boedb.pipelines.step import BaseStepLoader
-from boedb.pipelines.stream import StreamPipelineBaseExecutor
+from boedb.pipelines.stream import BatchingStreamExecutor, StreamPipelineBaseExecutor
 
 
 class SummaryLoader(BaseStepLoader):
-    def __init__(self, should_skip=None):
+    """Loads the summary row. With `upsert`, an existing summary is updated in place."""
+
+    def __init__(self, should_skip=None, upsert=False):
         self.should_skip = should_skip
-        self.db_client = get_db_client()
+        self.upsert = upsert
+        self.db_client = get_async_db_client()
         self.logger = get_logger("boedb.diario_boe.summary_loader")
 
     async def __call__(self, summary):
@@ -16,17 +21,20 @@ class SummaryLoader(BaseStepLoader):
             self.logger.info(f"Skipped loading of {summary}")
             return summary
 
-        columns = ("summary_id", "pubdate", "metadata", "n_articles")
-        self.db_client.insert("es_diario_boe_summary", summary.as_dict(), columns)
+        table, columns = "es_diario_boe_summary", ("summary_id", "pubdate", "metadata", "n_articles")
+        if self.upsert:
+            await self.db_client.upsert(table, summary.as_dict(), ("summary_id",), columns[1:], columns)
+        else:
+            await self.db_client.insert(table, summary.as_dict(), columns)
 
         self.logger.debug(f"Loaded summary {summary.summary_id}")
         return summary
 
 
 class ArticlesLoader(StreamPipelineBaseExecutor):
-    def __init__(self, concurrency=1):
+    def __init__(self, concurrency=1, cpu_executor=None, **kwargs):
         self.logger = get_logger("boedb.diario_boe.summary_loader")
-        super().__init__(concurrency)
+        super().__init__(concurrency, cpu_executor=cpu_executor, **kwargs)
 
         self.article_cols = (
             "article_id",
@@ -43,11 +51,12 @@ class ArticlesLoader(StreamPipelineBaseExecutor):
             "article_id",
             "sequence",
             "content",
+            "clean_content",
             "summary",
             "embedding",
         )
 
-        self.db_client = get_db_client()
+        self.db_client = get_async_db_client()
 
     async def process(self, item):
         if isinstance(item, Article):
@@ -61,7 +70,118 @@ class ArticlesLoader(StreamPipelineBaseExecutor):
         return item
 
     async def load_article(self, row_dict):
-        return self.db_client.insert("es_diario_boe_article", row_dict, self.article_cols)
+        return await self.db_client.insert("es_diario_boe_article", row_dict, self.article_cols)
 
     async def load_fragment(self, row_dict):
-        return self.db_client.insert("es_diario_boe_article_fragment", row_dict, self.fragment_cols)
+        return await self.db_client.insert("es_diario_boe_article_fragment", row_dict, self.fragment_cols)
+
+
+class ArticlesUpsertLoader(ArticlesLoader):
+    """
+    Loads article and fragment rows, updating the ones already loaded, so loads are
+    idempotent and incomplete articles are completed in place.
+
+    An article might be split in fewer fragments than when it was loaded before, so
+    fragments past its new number of fragments are deleted along with its upsert.
+    """
+
+    async def load_article(self, row_dict):
+        table = "es_diario_boe_article"
+        upsert = get_upsert_sql(
+            table, [row_dict], self.article_cols[:1], self.article_cols[1:], self.article_cols
+        )
+        delete_sql = "DELETE FROM es_diario_boe_article_fragment WHERE article_id = %s AND sequence > %s"
+        delete = (delete_sql, [(row_dict["article_id"], row_dict["n_fragments"])])
+        return await self.db_client.execute_transaction([upsert, delete])
+
+    async def load_fragment(self, row_dict):
+        table = "es_diario_boe_article_fragment"
+        return await self.db_client.upsert(
+            table, row_dict, self.fragment_cols[:2], self.fragment_cols[2:], self.fragment_cols
+        )
+
+
+class ArticlesTransactionLoader(ArticlesLoader):
+    """
+    Loads every article together with all its fragments in a single transaction, so
+    articles are never left half written.
+
+    Items are held until the article and all its fragments arrive, in any order, and
+    the item completing the article waits for all of them to be loaded. Articles still
+    incomplete when the pipeline stops, eg. on errors, are not loaded at all.
+    """
+
+    def __init__(self, concurrency=1, cpu_executor=None):
+        super().__init__(concurrency, cpu_executor=cpu_executor)
+        self.pending = {}
+
+    async def process(self, item):
+        if not isinstance(item, (Article, ArticleFragment)):
+            return item
+
+        pending = self.pending.setdefault(item.article_id, {"article": None, "fragments": []})
+        if isinstance(item, Article):
+            pending["article"] = item
+        else:
+            pending["fragments"].append(item)
+
+        article, fragments = pending["article"], pending["fragments"]
+        if article is None or len(fragments) < article.n_fragments:
+            return item
+
+        del self.pending[item.article_id]
+        await self.load_article_with_fragments(article, fragments)
+        self.logger.debug(f"Loaded article {article} with {len(fragments)} fragments")
+        return item
+
+    async def load_article_with_fragments(self, article, fragments):
+        statements = [get_insert_sql("es_diario_boe_article", [article.as_dict()], self.article_cols)]
+        if fragments:
+            table, rows = "es_diario_boe_article_fragment", [fragment.as_dict() for fragment in fragments]
+            statements.append(get_insert_sql(table, rows, self.fragment_cols))
+        await self.db_client.execute_transaction(statements)
+
+
+class ArticlesBulkLoader(BatchingStreamExecutor, ArticlesLoader):
+    """
+    Loads batches of article and fragment rows with binary COPY.
+
+    Batches hold up to `concurrency` items, or whatever arrived within `flush_interval`
+    seconds. Articles always reach the loader before their fragments, and batches are
+    loaded in order with articles first, so fragments never reference a missing article.
+    """
+
+    article_types = ("varchar", "varchar", "date", "jsonb", "text", "text", "vector", "int2")
+    fragment_types = ("varchar", "int2", "text", "text", "text", "vector")
+
+    def __init__(
+        self, concurrency=1, flush_interval=DiarioBoeConfig.ARTICLE_LOAD_BULK_INTERVAL, cpu_executor=None
+    ):
+        super().__init__(concurrency, max_wait=flush_interval, cpu_executor=cpu_executor)
+        self.flush_lock = asyncio.Lock()
+
+    async def process_batch(self, items):
+        article_rows, fragment_rows = [], []
+        for item in items:
+            if isinstance(item, Article):
+                article_rows.append(item.as_dict())
+
+            elif isinstance(item, ArticleFragment):
+                fragment_rows.append(item.as_dict())
+
+        async with self.flush_lock:
+            await self.load_articles(article_rows)
+            await self.load_fragments(fragment_rows)
+
+        self.logger.debug(f"Loaded {len(article_rows)} articles, {len(fragment_rows)} fragments")
+        return items
+
+    async def load_articles(self, row_dicts):
+        if row_dicts:
+            table = "es_diario_boe_article"
+            await self.db_client.copy_many(table, row_dicts, self.article_cols, self.article_types)
+
+    async def load_fragments(self, row_dicts):
+        if row_dicts:
+            table = "es_diario_boe_article_fragment"
+            await self.db_client.copy_many(table, row_dicts, self.fragment_cols, self.fragment_types)
@@ -0,0 +1,69 @@
+"""
+Migrations for databases created before a schema change in `sql/02_boedb_init.sql`,
+which only runs on fresh databases.
+
+    python -m boedb.diario_boe.migrations
+"""
+from pathlib import Path
+
+from boedb.config import get_logger
+from boedb.db import get_db_client
+from boedb.processors.html import HTMLFilter
+
+MIGRATIONS_PATH = Path(__file__).parent / "sql" / "migrations"
+
+
+def migrate_fragment_clean_content(db_client, batch_size=1000):
+    """
+    Add the fragments `clean_content` column, search fragments by it, and backfill it
+    for existing fragments with the same cleaning used on extraction.
+
+    Fragments are backfilled in batches of `batch_size`, and every update regenerates
+    the fragment's search vector. Fragments already backfilled are not selected again,
+    and the search column is only rebuilt once, so the migration can be resumed if it's
+    interrupted.
+    """
+    logger = get_logger("boedb.diario_boe.migrations")
+    db_client.execute((MIGRATIONS_PATH / "001_fragment_clean_content.sql").read_text())
+
+    select_sql = """
+        select
+            article_id, sequence, content
+        from
+            es_diario_boe_article_fragment
+        where
+            clean_content is null
+            and content is not null
+        order by
+            article_id, sequence
+        limit %s
+    """
+    update_sql = """
+        update es_diario_boe_article_fragment
+        set clean_content = %s
+        where article_id = %s and sequence = %s
+    """
+
+    migrated = 0
+    while rows := db_client.execute(select_sql, (batch_size,)):
+        clean_contents = HTMLFilter.clean_html_many([row["content"] for row in rows])
+        db_client.execute_many(
+            update_sql,
+            [(clean, row["article_id"], row["sequence"]) for clean, row in zip(clean_contents, rows)],
+        )
+        migrated += len(rows)
+        logger.info(f"Backfilled clean content of {migrated} fragments")
+
+    # search lexemes are collected from the regenerated search vectors
+    db_client.execute("refresh materialized view es_diario_boe_article_lexemes")
+    return migrated
+
+
+def migrate_article_incomplete_summary(db_client):
+    """Add the summary of incomplete articles, so they can be looked up by summary."""
+    db_client.execute((MIGRATIONS_PATH / "002_article_incomplete_summary.sql").read_text())
+
+
+if __name__ == "__main__":
+    migrate_fragment_clean_content(get_db_client())
+    migrate_article_incomplete_summary(get_db_client())
@@ -1,26 +1,112 @@
 import functools
-import json
+import math
 import re
+from collections.abc import Mapping
 from datetime import datetime
+from xml.etree import ElementTree
 
+from psycopg.types.json import Jsonb
+
+from boedb.client import get_json_codec
 from boedb.config import DiarioBoeConfig
 from boedb.processors.xml import find_node_with_ancestors, node_children_to_dict, node_text_content
 
+# Article text is split preferably on document structure, by ascending cost
+BREAK_COSTS = {
+    "annex": 0,
+    "article": 0.1,
+    "title": 0.2,
+    "parties": 0.3,
+    "law": 0.4,
+    "table": 0.5,
+    "legal": 0.6,
+    "ordinal": 0.7,
+    "paragraph": 1,
+    "forced": 4,
+}
+
+TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9]*)[^>]*>")
+
+BREAK_KEYWORDS_RE = re.compile(
+    r"\s*(?:"
+    r"(?P<annex>ANEXO|ANEJO)"
+    r"|(?P<article>Artículo)"
+    r"|(?P<title>Título)"
+    r"|(?P<parties>Reunidos|Manifiestan|Exponen|Cláusulas)"
+    r"|(?P<law>Fundamentos de Derecho)"
+    r"|(?P<legal>Fundamentos jurídicos)"
+    r"|(?P<ordinal>"
+    r"Primer[oa]|Segund[oa]|Tercer[oa]|Cuart[oa]|Quint[oa]|Sext[oa]|Séptim[oa]"
+    r"|Octav[oa]|Noven[oa]|Décim[oa]|Undécim[oa]|Duodécim[oa]"
+    r"|Decimotercer[oa]|Decimocuart[oa]|Decimoquint[oa]|Decimosext[oa]"
+    r"|Decimoséptim[oa]|Decimoctav[oa]|Decimonoven[oa]|Vigésim[oa]"
+    r"|Único)"
+    r")",
+    re.IGNORECASE,
+)
+
 
 class DocumentError(Exception):
     pass
 
 
+def get_summary_id(date):
+    return f"BOE-S-{date.strftime('%Y%m%d')}"
+
+
+def raise_for_error(root):
+    if root.tag == "error":
+        raise DocumentError(root.find(".//descripcion").text or "unknown error")
+
+
 def check_error(fn):
     @functools.wraps(fn)
     def from_xml(cls, root, *args, **kwargs):
-        if root.tag == "error":
-            raise DocumentError(root.find(".//descripcion").text or "unknown error")
+        raise_for_error(root)
         return fn(cls, root, *args, **kwargs)
 
     return from_xml
 
 
+def get_ancestors_metadata(ancestors, cache):
+    """Return the attributes of `ancestors`, nearest first, by tag. Entries under the same
+    parent share the same dict, cached by parent in `cache`."""
+    parent = ancestors[0] if ancestors else None
+    if parent not in cache:
+        # farthest ancestors take precedence on repeated tags
+        cache[parent] = {a.tag: a.attrib for a in ancestors}
+    return cache[parent]
+
+
+class EntryMetadata(Mapping):
+    """
+    Read-only metadata of a summary entry: its own attributes, over the attributes of
+    its ancestors by tag. Ancestors are shared by every entry in the same section, so
+    they're referenced instead of copied into every entry.
+    """
+
+    __slots__ = ("attrib", "ancestors")
+
+    def __init__(self, attrib, ancestors):
+        self.attrib = attrib
+        self.ancestors = ancestors
+
+    def __getitem__(self, key):
+        if key in self.attrib:
+            return self.attrib[key]
+        return self.ancestors[key]
+
+    def __iter__(self):
+        yield from self.ancestors
+        yield from (key for key in self.attrib if key not in self.ancestors)
+
+    def __len__(self):
+        return len(self.ancestors) + sum(1 for key in self.attrib if key not in self.ancestors)
+
+    def __repr__(self):
+        return f"EntryMetadata({dict(self)})"
+
+
 class DaySummary:
     def __init__(self, summary_id, metadata, items=None):
         self.summary_id = summary_id
@@ -34,20 +120,29 @@ class DaySummary:
         summary_id = root.find("diario/sumario_nbo").attrib.get("id")
         summary_metadata = node_children_to_dict(root.find("meta"))
 
-        items = []
+        items, ancestors_cache = [], {}
         for item, ancestors in find_node_with_ancestors(root, "item"):
-            meta = {a.tag: a.attrib for a in ancestors}
-            meta |= item.attrib
+            meta = EntryMetadata(item.attrib, get_ancestors_metadata(ancestors, ancestors_cache))
             title = item.find(".//titulo").text
             item = DaySummaryEntry(summary_id, item.attrib["id"], meta, title)
             items.append(item)
         return cls(summary_id, summary_metadata, items)
 
+    @classmethod
+    async def from_chunks(cls, chunks):
+        """Parse a summary from an async iterable of document chunks, as they are received."""
+        parser = DaySummaryParser()
+        items = []
+        async for chunk in chunks:
+            items.extend(parser.feed(chunk))
+        items.extend(parser.close())
+        return cls(parser.summary_id, parser.metadata, items)
+
     def as_dict(self):
         return {
             "summary_id": self.summary_id,
             "pubdate": self.publication_date,
-            "metadata": json.dumps(self.metadata),
+            "metadata": Jsonb(self.metadata, get_json_codec().dumps_bytes),
             "n_articles": len(self.items),
         }
 
@@ -55,7 +150,64 @@ class DaySummary:
         return f"DaySummary({self.summary_id})"
 
 
+class DaySummaryParser:
+    """
+    Incremental summary parser, fed with chunks of the document as they are received.
+
+    Entries are yielded as soon as their `<item>` element is closed, and parsed items
+    are discarded from the tree so memory doesn't grow with the summary size.
+    """
+
+    DISCARD_TAGS = {"item", "meta", "sumario_nbo"}
+
+    def __init__(self):
+        self.parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self.ancestors = []
+        self.root = None
+        self.summary_id = None
+        self.metadata = None
+        self.ancestors_cache = {}
+
+    def feed(self, chunk):
+        self.parser.feed(chunk)
+        yield from self.read_events()
+
+    def close(self):
+        self.parser.close()
+        yield from self.read_events()
+        raise_for_error(self.root)
+
+    def read_events(self):
+        for event, elem in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = elem
+                self.ancestors.append(elem)
+                continue
+
+            self.ancestors.pop()
+            parent = self.ancestors[-1] if self.ancestors else None
+
+            if elem.tag == "sumario_nbo" and self.summary_id is None:
+                self.summary_id = elem.attrib.get("id")
+
+            elif elem.tag == "meta" and parent is self.root:
+                self.metadata = node_children_to_dict(elem)
+
+            elif elem.tag == "item":
+                ancestors = self.ancestors[::-1]
+                meta = EntryMetadata(elem.attrib, get_ancestors_metadata(ancestors, self.ancestors_cache))
+                title = elem.find(".//titulo").text
+                yield DaySummaryEntry(self.summary_id, elem.attrib["id"], meta, title)
+
+            # error documents are kept whole to read their description
+            if elem.tag in self.DISCARD_TAGS and parent is not None and self.root.tag != "error":
+                parent.remove(elem)
+
+
 class DaySummaryEntry:
+    __slots__ = ("summary_id", "entry_id", "metadata", "title")
+
     def __init__(self, summary_id, entry_id, metadata=None, title=None):
         self.summary_id = summary_id
         self.entry_id = entry_id
@@ -67,6 +219,18 @@ class DaySummaryEntry:
 
 
 class Article:
+    __slots__ = (
+        "article_id",
+        "summary_id",
+        "publication_date",
+        "metadata",
+        "title",
+        "title_summary",
+        "title_embedding",
+        "content",
+        "n_fragments",
+    )
+
     def __init__(self, article_id, summary_id, metadata, content, n_fragments=None):
         self.article_id = article_id
         self.summary_id = summary_id
@@ -92,57 +256,73 @@ class Article:
         return cls(article_id, summary_id, metadata, content)
 
     @staticmethod
-    def _split_text_smart(text, max_length):
-        re_breaks = (
-            r"<(.*?)>\s*(ANEXO|ANEJO).*?</(.*?)>",
-            r"<(.*?)>\s*Artículo.*?</(.*?)>",
-            r"<(.*?)>\s*Título.*?</(.*?)>",
-            r"<(.*?)>\s*(Reunidos|Manifiestan|Exponen|Cláusulas).*?</(.*?)>",
-            r"<(.*?)>\s*Fundamentos de Derecho.*?</(.*?)>",
-            r"<table(.*?)>(.*?)</table>",
-            r"<(.*?)>\s*Fundamentos jurídicos.*?</(.*?)>",
-            (
-                r"<(.*?)>\s*"
-                r"(Primer[oa]|Segund[oa]|Tercer[oa]|Cuart[oa]|Quint[oa]|Sext[oa]|Séptim[oa]"
-                r"|Octav[oa]|Noven[oa]|Décim[oa]|Undécim[oa]|Duodécim[oa]"
-                r"|Decimotercer[oa]|Decimocuart[oa]|Decimoquint[oa]|Decimosext[oa]"
-                r"|Decimoséptim[oa]|Decimoctav[oa]|Decimonoven[oa]|Vigésim[oa]"
-                r"|Único)"
-                r".*?</(.*?)>"
-            ),
-        )
-
-        # try to split on text structure
-        for break_exp in re_breaks:
-            # in case there's multiple split points, use the middle one
-            # as it will yield the two smallest fragments
-            matches = list(re.finditer(break_exp, text, re.IGNORECASE))
-            while match := matches and matches.pop(len(matches) // 2 - 1):
-                # only split if break point doesn't yield highly unequal chunks
-                if 0.2 < (match.start() / len(text)) < 0.8:
-                    return text[: match.start()], text[match.start() :]
-
-        # try to split naively on middle paragraph to avoid breaking html
-        closing_tags = list(re.finditer("</(.*?)>", text))
-        if len(closing_tags) > 1:
-            match = closing_tags[len(closing_tags) // 2 - 1]
-            return text[: match.end()], text[match.end() :]
-
-        # split desperately
-        if len(text) < (max_length * 2):
-            middle = len(text) // 2
-            return text[:middle], text[middle:]
-        return text[:max_length], text[max_length:]
+    def _find_break_points(text, resolution=1):
+        """Return a dict of positions where `text` can be split, with the cost of
+        splitting there. Document structure breaks are cheaper than paragraph ends.
+        Only the cheapest break point of every `resolution` characters is kept."""
+        break_points, buckets = {}, {}
+        for match in TAG_RE.finditer(text):
+            closing, tag = match.groups()
+            if closing:
+                position, cost = match.end(), BREAK_COSTS["paragraph"]
+            elif tag.lower() == "table":
+                position, cost = match.start(), BREAK_COSTS["table"]
+            elif keyword := BREAK_KEYWORDS_RE.match(text, match.end()):
+                position, cost = match.start(), BREAK_COSTS[keyword.lastgroup]
+            else:
+                continue
+
+            bucket = position // resolution
+            if cost <= break_points.get(buckets.get(bucket), math.inf):
+                break_points.pop(buckets.get(bucket), None)
+                break_points[position], buckets[bucket] = cost, position
+        return break_points
 
     @staticmethod
     def _split_text(text, max_length):
-        fragments = [text]
-        while any(len(fr) > max_length for fr in fragments):
-            idx_max = max(range(len(fragments)), key=lambda i: len(fragments[i]))
-            fragment = fragments.pop(idx_max)
-            sub_fragments = Article._split_text_smart(fragment, max_length)
-            fragments = fragments[:idx_max] + list(sub_fragments) + fragments[idx_max:]
-        return fragments
+        """
+        Split `text` in fragments of up to `max_length`, finding the cheapest set of
+        break points in a single pass. Each fragment costs its break point plus its
+        deviation from an even split, so structure breaks are preferred, then paragraph
+        ends, then balanced fragments. Evenly spaced forced breaks are always available.
+        """
+        if len(text) <= max_length:
+            return [text]
+
+        max_length = int(max_length)
+        n_fragments = math.ceil(len(text) / max_length)
+        target_length = len(text) / n_fragments
+
+        # bounding candidates per window keeps the DP below linear in the text length
+        break_points = Article._find_break_points(text, max(1, max_length // 64))
+        for idx in range(1, n_fragments):
+            position = len(text) * idx // n_fragments
+            break_points[position] = min(break_points.get(position, math.inf), BREAK_COSTS["forced"])
+        break_points[len(text)] = 0
+
+        positions = [0] + sorted(p for p in break_points if 0 < p <= len(text))
+        costs = [0] + [math.inf] * (len(positions) - 1)
+        previous = [None] * len(positions)
+
+        window_start = 0
+        for end in range(1, len(positions)):
+            while positions[end] - positions[window_start] > max_length:
+                window_start += 1
+
+            for start in range(window_start, end):
+                length = positions[end] - positions[start]
+                balance = ((length - target_length) / max_length) ** 2
+                cost = costs[start] + 1 + break_points[positions[end]] + balance
+                if cost < costs[end]:
+                    costs[end], previous[end] = cost, start
+
+        cuts, idx = [], len(positions) - 1
+        while idx:
+            cuts.append(positions[idx])
+            idx = previous[idx]
+        cuts = [0] + cuts[::-1]
+
+        return [text[start:end] for start, end in zip(cuts, cuts[1:])]
 
     def split(self, max_length=DiarioBoeConfig.ARTICLE_FRAGMENT_MAX_LENGTH):
         fragments = Article._split_text(self.content, max_length)
@@ -158,7 +338,7 @@ class Article:
             "article_id": self.article_id,
             "summary_id": self.summary_id,
             "pubdate": self.publication_date,
-            "metadata": json.dumps(self.metadata),
+            "metadata": Jsonb(self.metadata, get_json_codec().dumps_bytes),
             "title": self.title,
             "title_summary": self.title_summary,
             "title_embedding": self.title_embedding,
@@ -170,12 +350,17 @@ class Article:
 
 
 class ArticleFragment:
-    def __init__(self, article_id, content, sequence, total):
+    __slots__ = ("article_id", "content", "sequence", "total", "clean_content", "summary", "embedding")
+
+    def __init__(self, article_id, content, sequence, total, clean_content=None):
         self.article_id = article_id
         self.content = content
         self.sequence = sequence
         self.total = total
 
+        # text of the html content, cleaned once on extraction
+        self.clean_content = clean_content
+
         self.summary = None
         self.embedding = None
 
@@ -184,6 +369,7 @@ class ArticleFragment:
             "article_id": self.article_id,
             "sequence": self.sequence,
             "content": self.content,
+            "clean_content": self.clean_content,
             "summary": self.summary,
             "embedding": self.embedding,
         }
@@ -1,33 +1,61 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
 from boedb.config import DBConfig, DiarioBoeConfig
-from boedb.db import get_db_client
+from boedb.db import get_async_db_client, get_db_client
 from boedb.diario_boe.extract import ArticlesExtractor, SummaryExtractor
-from boedb.diario_boe.load import ArticlesLoader, SummaryLoader
+from boedb.diario_boe.load import (
+    ArticlesBulkLoader,
+    ArticlesLoader,
+    ArticlesTransactionLoader,
+    ArticlesUpsertLoader,
+    SummaryLoader,
+)
+from boedb.diario_boe.models import get_summary_id
 from boedb.diario_boe.transform import ArticlesTransformer
 from boedb.pipelines.step import StepPipeline
 from boedb.pipelines.stream import StreamPipeline
+from boedb.processors.bloom import BloomFilter
+
+
+def get_loaded_summary_query(summary_id):
+    """Return the sql and params selecting `summary_id` if it's loaded with all its
+    articles. The incomplete summaries view is filtered by the summary as well, so only
+    its articles are counted."""
+    sql = """
+        select
+            summary_id
+        from
+            es_diario_boe_summary
+        where
+            summary_id = %(summary_id)s
+            and summary_id not in (
+                select summary_id from es_diario_boe_summary_incomplete where summary_id = %(summary_id)s
+            )
+    """
+    return sql, {"summary_id": summary_id}
 
 
 class DiarioBoeSummaryPipeline(StepPipeline):
-    def __init__(self, date, http_session):
+    def __init__(self, date, http_session, offline=False):
         self.db_client = get_db_client()
+        self.summary_id = get_summary_id(date)
 
-        extractor = SummaryExtractor(date, http_session, should_skip=self.get_extract_filter())
+        extractor = SummaryExtractor(
+            date, http_session, should_skip=self.get_extract_filter(), offline=offline
+        )
         transformer = None
-        loader = SummaryLoader(should_skip=self.get_load_filter())
+        if DiarioBoeConfig.ARTICLE_LOAD_MODE == "upsert":
+            loader = SummaryLoader(upsert=True)
+        else:
+            loader = SummaryLoader(should_skip=self.get_load_filter())
 
         super().__init__(extractor, transformer, loader)
 
     def get_extract_filter(self):
-        sql = """
-            select
-                summary_id
-            from
-                es_diario_boe_summary
-            where
-                summary_id not in (select summary_id from es_diario_boe_summary_incomplete)
-        """
-
-        summary_ids = set([row[0] for row in self.db_client.execute(sql)])
+        rows = self.db_client.execute(*get_loaded_summary_query(self.summary_id))
+        summary_ids = {row["summary_id"] for row in rows}
 
         def should_skip(summary):
             return summary.summary_id in summary_ids
@@ -40,9 +68,11 @@ class DiarioBoeSummaryPipeline(StepPipeline):
                 summary_id
             from
                 es_diario_boe_summary
+            where
+                summary_id = %s
         """
 
-        summary_ids = set([row[0] for row in self.db_client.execute(sql)])
+        summary_ids = {row["summary_id"] for row in self.db_client.execute(sql, (self.summary_id,))}
 
         def should_skip(summary):
             return summary.summary_id in summary_ids
@@ -50,31 +80,129 @@ class DiarioBoeSummaryPipeline(StepPipeline):
         return should_skip
 
 
+def get_cpu_executor():
+    """Return the process pool shared by articles pipelines for CPU-bound work, if enabled."""
+    if hasattr(DiarioBoeArticlesPipeline, "_cpu_executor"):
+        return DiarioBoeArticlesPipeline._cpu_executor
+
+    cpu_executor = None
+    if DiarioBoeConfig.ARTICLE_CPU_PROCESSES:
+        # workers must not inherit the db pools, their threads and sockets, created before
+        mp_context = multiprocessing.get_context("spawn")
+        cpu_executor = ProcessPoolExecutor(DiarioBoeConfig.ARTICLE_CPU_PROCESSES, mp_context=mp_context)
+    DiarioBoeArticlesPipeline._cpu_executor = cpu_executor
+    return cpu_executor
+
+
+async def load_article_ids_bloom():
+    """
+    Build the bloom filter of loaded article ids shared by every articles pipeline in the
+    process, if enabled, and return it. It scans every loaded article id, so it's built
+    once before any pipeline runs, instead of blocking the pipelines running then.
+    """
+    if hasattr(DiarioBoeArticlesPipeline, "_article_ids_bloom"):
+        return DiarioBoeArticlesPipeline._article_ids_bloom
+
+    bloom = None
+    if DiarioBoeConfig.ARTICLE_FILTER_BLOOM:
+        db_client = get_async_db_client()
+        rows = await db_client.execute("select count(*) as count from es_diario_boe_article")
+        bloom = BloomFilter(rows[0]["count"], DiarioBoeConfig.ARTICLE_FILTER_BLOOM_ERROR_RATE)
+        async for row in db_client.iterate("select article_id from es_diario_boe_article"):
+            bloom.add(row["article_id"])
+    DiarioBoeArticlesPipeline._article_ids_bloom = bloom
+    return bloom
+
+
+def get_article_ids_bloom():
+    """Return the bloom filter of loaded article ids, or None if it's disabled or
+    wasn't built with `load_article_ids_bloom`."""
+    return getattr(DiarioBoeArticlesPipeline, "_article_ids_bloom", None)
+
+
 class DiarioBoeArticlesPipeline(StreamPipeline):
-    def __init__(self, http_session):
-        self.db_client = get_db_client()
+    def __init__(self, http_session, offline=False, limiter=None):
+        self.db_client = get_async_db_client()
+        cpu_executor = get_cpu_executor()
+
+        workers = DiarioBoeConfig.ARTICLE_STAGE_WORKERS
+        if workers and DiarioBoeConfig.ARTICLE_LOAD_MODE != "transaction":
+            raise ValueError("Articles stage workers require the transaction load mode")
 
         extractor = ArticlesExtractor(
             DiarioBoeConfig.ARTICLE_EXTRACT_CONCURRENCY,
             http_session,
             should_skip=self.get_extract_filter(),
+            offline=offline,
+            cpu_executor=cpu_executor,
+            workers=workers,
         )
-        transformer = ArticlesTransformer(DiarioBoeConfig.ARTICLE_TRANSFORM_CONCURRENCY, http_session)
-        loader = ArticlesLoader(DiarioBoeConfig.ARTICLE_LOAD_CONCURRENCY)
-
-        super().__init__(extractor, transformer, loader)
-
-    def get_extract_filter(self):
+        transformer = ArticlesTransformer(
+            DiarioBoeConfig.ARTICLE_TRANSFORM_CONCURRENCY,
+            http_session,
+            cpu_executor=cpu_executor,
+            workers=workers,
+        )
+        loader = self.get_loader(cpu_executor)
+
+        super().__init__(extractor, transformer, loader, limiter=limiter)
+
+    def get_loader(self, cpu_executor=None):
+        if DiarioBoeConfig.ARTICLE_LOAD_MODE == "bulk":
+            return ArticlesBulkLoader(DiarioBoeConfig.ARTICLE_LOAD_BULK_SIZE, cpu_executor=cpu_executor)
+        if DiarioBoeConfig.ARTICLE_LOAD_MODE == "upsert":
+            return ArticlesUpsertLoader(DiarioBoeConfig.ARTICLE_LOAD_CONCURRENCY, cpu_executor=cpu_executor)
+        if DiarioBoeConfig.ARTICLE_LOAD_MODE == "transaction":
+            return ArticlesTransactionLoader(
+                DiarioBoeConfig.ARTICLE_LOAD_CONCURRENCY, cpu_executor=cpu_executor
+            )
+        return ArticlesLoader(DiarioBoeConfig.ARTICLE_LOAD_CONCURRENCY, cpu_executor=cpu_executor)
+
+    async def get_article_ids(self, summary_id):
         sql = """
             select
                 article_id
             from
                 es_diario_boe_article
+            where
+                summary_id = %(summary_id)s
+        """
+
+        # upserts complete incomplete articles in place, so they aren't skipped
+        if DiarioBoeConfig.ARTICLE_LOAD_MODE == "upsert":
+            sql += """
+                and article_id not in (
+                    select article_id from es_diario_boe_article_incomplete where summary_id = %(summary_id)s
+                )
+            """
+
+        rows = await self.db_client.execute(sql, {"summary_id": summary_id})
+        return {row["article_id"] for row in rows}
+
+    def get_extract_filter(self):
         """
+        Skip articles that are already loaded. Loaded ids are looked up for each summary
+        the first time one of its articles is checked, instead of every article id.
 
-        article_ids = set([row[0] for row in self.db_client.execute(sql)])
+        With a bloom filter of loaded ids, articles it doesn't contain are known not to
+        be loaded without any lookup, so days that were never loaded are free.
 
-        def should_skip(item):
-            return item.entry_id in article_ids
+        Lookups are awaited, and only one is made per summary even if several of its
+        articles are checked at once.
+        """
+        bloom = get_article_ids_bloom()
+        article_ids_by_summary = {}
+        lookup_lock = asyncio.Lock()
+
+        async def should_skip(item):
+            if bloom is not None and item.entry_id not in bloom:
+                return False
+
+            if item.summary_id not in article_ids_by_summary:
+                async with lookup_lock:
+                    if item.summary_id not in article_ids_by_summary:
+                        article_ids = await self.get_article_ids(item.summary_id)
+                        article_ids_by_summary[item.summary_id] = article_ids
+            return item.entry_id in article_ids_by_summary[item.summary_id]
 
         return should_skip
@@ -35,7 +35,9 @@ create table es_diario_boe_article_fragment (
     article_id varchar(16) references es_diario_boe_article(article_id) on delete cascade,
     sequence smallint,
     content text,
-    content_search tsvector generated always as (to_tsvector('spanish', content)) stored,
+    -- content without markup, so search and the index don't include html tags
+    clean_content text,
+    content_search tsvector generated always as (to_tsvector('spanish', clean_content)) stored,
     summary text,
     -- text-embedding-ada-002
     embedding vector(1536),
@@ -91,12 +93,14 @@ create view es_diario_boe_article_incomplete as
 select
     art.article_id,
     art.n_fragments,
-    count(frag.article_id) as n_fragments_available
+    count(frag.article_id) as n_fragments_available,
+    art.summary_id
 from
     es_diario_boe_article art
     left join es_diario_boe_article_fragment frag on art.article_id = frag.article_id
 group by
-    art.article_id
+    art.article_id,
+    art.summary_id
 having
     count(frag.article_id) < art.n_fragments;
 
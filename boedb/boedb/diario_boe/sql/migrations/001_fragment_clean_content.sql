@@ -0,0 +1,31 @@
+--
+-- BOE DB Fragments clean content
+--
+-- Fragments store their content without markup, and are searched by it. Existing fragments
+-- have no clean content until it's backfilled, see `boedb.diario_boe.migrations`.
+--
+alter table es_diario_boe_article_fragment add column if not exists clean_content text;
+
+-- generated columns can't change their expression, so the search column is rebuilt, only
+-- once: resuming the migration must not rewrite the table again
+do $$
+begin
+    if not exists (
+        select
+        from
+            information_schema.columns
+        where
+            table_schema = current_schema()
+            and table_name = 'es_diario_boe_article_fragment'
+            and column_name = 'content_search'
+            and position('clean_content' in generation_expression) > 0
+    ) then
+        drop index if exists es_diario_boe_content_search_idx;
+        alter table es_diario_boe_article_fragment drop column if exists content_search;
+        alter table es_diario_boe_article_fragment
+            add column content_search tsvector generated always as (to_tsvector('spanish', clean_content)) stored;
+
+        create index es_diario_boe_content_search_idx on es_diario_boe_article_fragment using gin(content_search);
+    end if;
+end
+$$;
@@ -0,0 +1,20 @@
+--
+-- BOE DB Incomplete articles summary
+--
+-- Incomplete articles are listed with their summary, so they can be looked up for a single
+-- summary without counting the fragments of every article.
+--
+create or replace view es_diario_boe_article_incomplete as
+select
+    art.article_id,
+    art.n_fragments,
+    count(frag.article_id) as n_fragments_available,
+    art.summary_id
+from
+    es_diario_boe_article art
+    left join es_diario_boe_article_fragment frag on art.article_id = frag.article_id
+group by
+    art.article_id,
+    art.summary_id
+having
+    count(frag.article_id) < art.n_fragments;
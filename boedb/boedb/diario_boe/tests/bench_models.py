@@ -0,0 +1,64 @@
+"""
+Measure the memory held by every summary entry, compared to the previous models, which
+had an instance dict and copied their ancestors' metadata into a dict per entry.
+
+    python -m boedb.diario_boe.tests.bench_models
+"""
+import tracemalloc
+from pathlib import Path
+
+from boedb.diario_boe.models import DaySummaryEntry, DaySummaryParser, EntryMetadata
+
+FIXTURES_PATH = Path(__file__).parent / "fixtures"
+
+
+class DictDaySummaryEntry:
+    def __init__(self, summary_id, entry_id, metadata=None, title=None):
+        self.summary_id = summary_id
+        self.entry_id = entry_id
+        self.metadata = metadata or {}
+        self.title = title
+
+
+def measure(build):
+    """Return the bytes still allocated by the result of `build`."""
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    for path in sorted(FIXTURES_PATH.glob("BOE-S-*.xml")):
+        parser = DaySummaryParser()
+        entries = [*parser.feed(path.read_bytes()), *parser.close()]
+
+        # both models reference the same element attributes and titles, only what's
+        # built per entry is measured
+        def build_dict_entries():
+            return [
+                DictDaySummaryEntry(
+                    e.summary_id, e.entry_id, {**e.metadata.ancestors, **e.metadata.attrib}, e.title
+                )
+                for e in entries
+            ]
+
+        def build_slots_entries():
+            return [
+                DaySummaryEntry(
+                    e.summary_id, e.entry_id, EntryMetadata(e.metadata.attrib, e.metadata.ancestors), e.title
+                )
+                for e in entries
+            ]
+
+        dict_size = measure(build_dict_entries) / len(entries)
+        slots_size = measure(build_slots_entries) / len(entries)
+        print(f"{path.stem} ({len(entries)} entries)")
+        print(f"  dict entries   {dict_size:8.0f}B per entry")
+        print(f"  slots entries  {slots_size:8.0f}B per entry")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+import os.path
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from unittest import mock
 from xml.etree import ElementTree
@@ -5,13 +8,16 @@ from xml.etree import ElementTree
 import pytest
 from aioresponses import aioresponses
 
+from boedb.archive import DocumentArchive
 from boedb.client import get_http_client_session
 from boedb.diario_boe.extract import (
     ArticlesExtractor,
     SummaryExtractor,
     extract_boe_article,
     extract_boe_summary,
+    extract_boe_summary_entries,
     extract_boe_xml,
+    parse_boe_article,
 )
 from boedb.diario_boe.models import Article, ArticleFragment, DaySummary, DaySummaryEntry
 
@@ -31,20 +37,101 @@ async def test_extract_boe_xml_makes_request_and_returns_root():
 
 
 @pytest.mark.asyncio
-async def test_extract_boe_summary_extracts_and_creates_daysummary():
-    summary_id = "summary_id"
-    root = mock.Mock()
+async def test_extract_boe_xml_reads_from_archive():
     client_mock = mock.Mock()
+    client_mock.get = mock.AsyncMock()
+    archive_mock = mock.Mock()
+    archive_mock.get.return_value = b"<xml><test /></xml>"
+
+    root = await extract_boe_xml("doc_id", client_mock, archive_mock)
+
+    archive_mock.get.assert_called_once_with("doc_id")
+    client_mock.get.assert_not_awaited()
+    assert ElementTree.tostring(root) == b"<xml><test /></xml>"
+
+
+@pytest.mark.asyncio
+async def test_extract_boe_xml_stores_missing_documents_in_archive():
+    client_mock = mock.Mock()
+    client_mock.get = mock.AsyncMock(return_value="<xml><test>ñ</test></xml>")
+    archive_mock = mock.Mock()
+    archive_mock.get.return_value = None
+
+    await extract_boe_xml("doc_id", client_mock, archive_mock)
+
+    archive_mock.put.assert_called_once_with("doc_id", "<xml><test>ñ</test></xml>".encode())
+
+
+@pytest.mark.asyncio
+async def test_extract_boe_xml_does_not_archive_errors():
+    client_mock = mock.Mock()
+    client_mock.get = mock.AsyncMock(return_value="<error><descripcion>nope</descripcion></error>")
+    archive_mock = mock.Mock()
+    archive_mock.get.return_value = None
+
+    await extract_boe_xml("doc_id", client_mock, archive_mock)
+
+    archive_mock.put.assert_not_called()
+
+
+async def aiter_chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+@pytest.mark.asyncio
+async def test_extract_boe_summary_streams_and_creates_daysummary():
+    url = "https://www.boe.es/diario_boe/xml.php?id=summary_id"
+    summary_mock = mock.Mock()
+    client_mock = mock.Mock()
+    client_mock.get_stream.return_value = aiter_chunks(b"<xml />", 1)
+
+    with mock.patch("boedb.diario_boe.extract.DaySummary") as DaySummaryMock:
+        DaySummaryMock.from_chunks = mock.AsyncMock(return_value=summary_mock)
+        summary = await extract_boe_summary("summary_id", client_mock)
+
+    assert summary is summary_mock
+    client_mock.get_stream.assert_called_once_with(url)
+    DaySummaryMock.from_chunks.assert_awaited_once_with(client_mock.get_stream.return_value)
+
+
+@pytest.mark.asyncio
+async def test_extract_boe_summary_entries_yields_entries():
+    path = os.path.join(os.path.dirname(__file__), "fixtures/BOE-S-20230614.xml")
+    with open(path, "rb") as f:
+        xml = f.read()
+
+    client_mock = mock.Mock()
+    client_mock.get_stream.return_value = aiter_chunks(xml, 4096)
+    entries = [entry async for entry in extract_boe_summary_entries("BOE-S-20230614", client_mock)]
+
+    assert len(entries) == 247
+    assert entries[0].entry_id == "BOE-A-2023-14043"
+    assert entries[-1].entry_id == "BOE-B-2023-18135"
 
-    with mock.patch(
-        "boedb.diario_boe.extract.extract_boe_xml", return_value=mock.AsyncMock()
-    ) as extract_mock, mock.patch("boedb.diario_boe.extract.DaySummary") as DaySummaryMock:
-        extract_mock.return_value = root
 
-        await extract_boe_summary(summary_id, client_mock)
+@pytest.mark.asyncio
+async def test_extract_boe_summary_archives_and_replays_summary(tmp_path):
+    path = os.path.join(os.path.dirname(__file__), "fixtures/BOE-S-20230614.xml")
+    with open(path, "rb") as f:
+        xml = f.read()
+
+    archive = DocumentArchive(tmp_path / "archive")
+    client_mock = mock.Mock()
+    client_mock.get_stream.return_value = aiter_chunks(xml, 4096)
+    summary = await extract_boe_summary("BOE-S-20230614", client_mock, archive)
+
+    assert archive.get("BOE-S-20230614") == xml
 
-    extract_mock.assert_awaited_once_with(summary_id, client_mock)
-    DaySummaryMock.from_xml.assert_called_once_with(root)
+    client_mock.get_stream.reset_mock()
+    replayed = await extract_boe_summary("BOE-S-20230614", client_mock, archive)
+    entries = [entry async for entry in extract_boe_summary_entries("BOE-S-20230614", client_mock, archive)]
+    archive.close()
+
+    client_mock.get_stream.assert_not_called()
+    assert replayed.summary_id == summary.summary_id
+    assert [item.entry_id for item in replayed.items] == [item.entry_id for item in summary.items]
+    assert [entry.entry_id for entry in entries] == [item.entry_id for item in summary.items]
 
 
 @pytest.mark.asyncio
@@ -60,7 +147,7 @@ async def test_extract_boe_article_extracts_and_creates_article():
 
         await extract_boe_article(article_id, summary_id, client_mock)
 
-    extract_mock.assert_awaited_once_with(article_id, client_mock)
+    extract_mock.assert_awaited_once_with(article_id, client_mock, None)
     ArticleMock.from_xml.assert_called_once_with(root, summary_id)
 
 
@@ -80,7 +167,7 @@ async def test_summary_extractor_extracts_doc_for_date():
         result = await extractor()
         assert result is extracted
 
-        extract_mock.assert_awaited_once_with(summary_id, client_mock)
+        extract_mock.assert_awaited_once_with(summary_id, client_mock, None)
         HttpClientMock.assert_called_once_with(session_mock)
 
 
@@ -100,6 +187,20 @@ async def test_summary_extractor_skips_item_when_should_skip():
     assert extracted is None
 
 
+def test_parse_boe_article_parses_and_splits_article():
+    path = os.path.join(os.path.dirname(__file__), "fixtures/BOE-A-2023-18664.xml")
+    with open(path, encoding="utf-8") as f:
+        xml = f.read()
+
+    doc, fragments = parse_boe_article(xml, "summary_id")
+
+    assert doc.article_id == "BOE-A-2023-18664"
+    assert doc.summary_id == "summary_id"
+    assert len(fragments) == doc.n_fragments
+    assert fragments[0].clean_content.startswith("Por Resolución de")
+    assert all("<p" not in fragment.clean_content for fragment in fragments)
+
+
 @pytest.mark.asyncio
 async def test_articles_extractor_process_extracts_items_from_entry():
     session_mock = mock.Mock()
@@ -110,21 +211,63 @@ async def test_articles_extractor_process_extracts_items_from_entry():
 
     article_mock = mock.Mock(spec=Article)
     fragment_mock = mock.Mock(spec=ArticleFragment)
-    article_mock.split.return_value = [fragment_mock]
 
-    with mock.patch("boedb.diario_boe.extract.extract_boe_article") as extract_mock, mock.patch(
+    with mock.patch(
+        "boedb.diario_boe.extract.fetch_boe_xml", return_value=("<xml />", False)
+    ) as fetch_mock, mock.patch(
+        "boedb.diario_boe.extract.parse_boe_article", return_value=(article_mock, [fragment_mock])
+    ) as parse_mock, mock.patch(
         "boedb.diario_boe.extract.HttpClient"
     ) as HttpClientMock:
-        extract_mock.return_value = article_mock
         HttpClientMock.return_value = client_mock
 
         extractor = ArticlesExtractor(1, session_mock)
         result = await extractor.process(entry)
 
-    extract_mock.assert_awaited_once_with(entry.entry_id, entry.summary_id, client_mock)
+    fetch_mock.assert_awaited_once_with(entry.entry_id, client_mock, None)
+    parse_mock.assert_called_once_with("<xml />", entry.summary_id)
     assert result == [article_mock, fragment_mock]
 
 
+@pytest.mark.asyncio
+async def test_articles_extractor_archives_parsed_documents():
+    archive_mock = mock.MagicMock()
+    archive_mock.get.return_value = None
+    client_mock = mock.Mock()
+    client_mock.get = mock.AsyncMock(return_value="<xml>ñ</xml>")
+    entry = DaySummaryEntry("summary_id", "entry_id")
+
+    with mock.patch("boedb.diario_boe.extract.get_document_archive", return_value=archive_mock), mock.patch(
+        "boedb.diario_boe.extract.HttpClient", return_value=client_mock
+    ), mock.patch("boedb.diario_boe.extract.parse_boe_article", return_value=(mock.Mock(), [])):
+        extractor = ArticlesExtractor(1, mock.Mock())
+        await extractor.process(entry)
+
+    archive_mock.put.assert_called_once_with("entry_id", "<xml>ñ</xml>".encode())
+
+
+@pytest.mark.asyncio
+async def test_articles_extractor_parses_in_cpu_executor():
+    entry = DaySummaryEntry("summary_id", "entry_id")
+    article_mock = mock.Mock(spec=Article)
+    parse_threads = []
+
+    def parse(xml, summary_id):
+        parse_threads.append(threading.get_ident())
+        return article_mock, []
+
+    with ThreadPoolExecutor(1) as cpu_executor, mock.patch(
+        "boedb.diario_boe.extract.fetch_boe_xml", return_value=("<xml />", True)
+    ), mock.patch("boedb.diario_boe.extract.parse_boe_article", parse), mock.patch(
+        "boedb.diario_boe.extract.HttpClient"
+    ):
+        extractor = ArticlesExtractor(1, mock.Mock(), cpu_executor=cpu_executor)
+        result = await extractor.process(entry)
+
+    assert result == [article_mock]
+    assert parse_threads and parse_threads[0] != threading.get_ident()
+
+
 @pytest.mark.asyncio
 async def test_article_extractor_skips_item_when_should_skip():
     session_mock = mock.Mock()
@@ -132,10 +275,33 @@ async def test_article_extractor_skips_item_when_should_skip():
 
     summary_id, entry_id = "summary_id", "entry_id"
     entry = DaySummaryEntry(summary_id, entry_id)
-    should_skip = mock.Mock(return_value=True)
+    should_skip = mock.AsyncMock(return_value=True)
 
     extractor = ArticlesExtractor(1, session_mock, should_skip)
     extracted = await extractor.process(entry)
 
-    should_skip.assert_called_once_with(entry)
+    should_skip.assert_awaited_once_with(entry)
+    assert extracted is None
+
+
+@pytest.mark.asyncio
+async def test_article_extractor_offline_skips_items_not_archived():
+    entry = DaySummaryEntry("summary_id", "entry_id")
+    archive_mock = mock.MagicMock()
+    archive_mock.__contains__.return_value = False
+
+    with mock.patch("boedb.diario_boe.extract.get_document_archive", return_value=archive_mock), mock.patch(
+        "boedb.diario_boe.extract.extract_boe_article"
+    ) as extract_mock:
+        extractor = ArticlesExtractor(1, mock.Mock(), offline=True)
+        extracted = await extractor.process(entry)
+
+    archive_mock.__contains__.assert_called_once_with("entry_id")
+    extract_mock.assert_not_called()
     assert extracted is None
+
+
+def test_article_extractor_offline_requires_archive():
+    with mock.patch("boedb.diario_boe.extract.get_document_archive", return_value=None):
+        with pytest.raises(ValueError):
+            ArticlesExtractor(1, mock.Mock(), offline=True)
@@ -1,15 +1,22 @@
+import asyncio
 from unittest import mock
 
 import pytest
 
-from boedb.diario_boe.load import ArticlesLoader, SummaryLoader
+from boedb.diario_boe.load import (
+    ArticlesBulkLoader,
+    ArticlesLoader,
+    ArticlesTransactionLoader,
+    ArticlesUpsertLoader,
+    SummaryLoader,
+)
 from boedb.diario_boe.models import Article, ArticleFragment, DaySummary
 
 
 @pytest.mark.asyncio
-@mock.patch("boedb.diario_boe.load.get_db_client")
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
 async def test_summary_loader_loads_summary(get_db_client_mock):
-    db_client_mock = mock.Mock()
+    db_client_mock = mock.AsyncMock()
     get_db_client_mock.return_value = db_client_mock
     serialized = mock.Mock()
     columns = ("summary_id", "pubdate", "metadata", "n_articles")
@@ -18,13 +25,31 @@ async def test_summary_loader_loads_summary(get_db_client_mock):
         loader = SummaryLoader()
         await loader(summary)
 
-    db_client_mock.insert.assert_called_once_with("es_diario_boe_summary", serialized, columns)
+    db_client_mock.insert.assert_awaited_once_with("es_diario_boe_summary", serialized, columns)
 
 
 @pytest.mark.asyncio
-@mock.patch("boedb.diario_boe.load.get_db_client")
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
+async def test_summary_loader_upserts_summary(get_db_client_mock):
+    db_client_mock = mock.AsyncMock()
+    get_db_client_mock.return_value = db_client_mock
+    serialized = mock.Mock()
+    columns = ("summary_id", "pubdate", "metadata", "n_articles")
+    with mock.patch.object(DaySummary, "as_dict", return_value=serialized):
+        summary = DaySummary("BOE-S-20231023", {"fecha": "23/10/2023"})
+        loader = SummaryLoader(upsert=True)
+        await loader(summary)
+
+    db_client_mock.upsert.assert_awaited_once_with(
+        "es_diario_boe_summary", serialized, ("summary_id",), columns[1:], columns
+    )
+    db_client_mock.insert.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
 async def test_summary_loader_skips_summary(get_db_client_mock):
-    db_client_mock = mock.Mock()
+    db_client_mock = mock.AsyncMock()
     get_db_client_mock.return_value = db_client_mock
 
     should_skip = mock.Mock(return_value=True)
@@ -34,11 +59,11 @@ async def test_summary_loader_skips_summary(get_db_client_mock):
 
     assert result is summary
     should_skip.assert_called_once_with(summary)
-    db_client_mock.insert.assert_not_called()
+    db_client_mock.insert.assert_not_awaited()
 
 
 @pytest.mark.asyncio
-@mock.patch("boedb.diario_boe.load.get_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.load.get_async_db_client", mock.Mock())
 async def test_articles_loader_processes_article_item():
     serialized = mock.Mock()
     article = Article("article-id", "summary-id", {"fecha_publicacion": "20231101"}, "content")
@@ -49,7 +74,7 @@ async def test_articles_loader_processes_article_item():
     ) as load_article_mock, mock.patch.object(
         loader, "load_fragment", return_value=mock.AsyncMock()
     ) as load_fragment_mock, mock.patch.object(
-        article, "as_dict", return_value=serialized
+        Article, "as_dict", return_value=serialized
     ):
         await loader.process(article)
 
@@ -58,7 +83,7 @@ async def test_articles_loader_processes_article_item():
 
 
 @pytest.mark.asyncio
-@mock.patch("boedb.diario_boe.load.get_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.load.get_async_db_client", mock.Mock())
 async def test_articles_loader_processes_fragment_item():
     serialized = mock.Mock()
     fragment = ArticleFragment("article-id", "content", 1, 10)
@@ -69,7 +94,7 @@ async def test_articles_loader_processes_fragment_item():
     ) as load_article_mock, mock.patch.object(
         loader, "load_fragment", return_value=mock.AsyncMock()
     ) as load_fragment_mock, mock.patch.object(
-        fragment, "as_dict", return_value=serialized
+        ArticleFragment, "as_dict", return_value=serialized
     ):
         await loader.process(fragment)
 
@@ -78,9 +103,9 @@ async def test_articles_loader_processes_fragment_item():
 
 
 @pytest.mark.asyncio
-@mock.patch("boedb.diario_boe.load.get_db_client")
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
 async def test_articles_loader_loads_article(get_db_client_mock):
-    db_client_mock = mock.Mock()
+    db_client_mock = mock.AsyncMock()
     get_db_client_mock.return_value = db_client_mock
     serialized = mock.Mock()
     columns = (
@@ -98,19 +123,20 @@ async def test_articles_loader_loads_article(get_db_client_mock):
         loader = ArticlesLoader()
         await loader.load_article(article.as_dict())
 
-    db_client_mock.insert.assert_called_once_with("es_diario_boe_article", serialized, columns)
+    db_client_mock.insert.assert_awaited_once_with("es_diario_boe_article", serialized, columns)
 
 
 @pytest.mark.asyncio
-@mock.patch("boedb.diario_boe.load.get_db_client")
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
 async def test_articles_loader_loads_article_fragment(get_db_client_mock):
-    db_client_mock = mock.Mock()
+    db_client_mock = mock.AsyncMock()
     get_db_client_mock.return_value = db_client_mock
     serialized = mock.Mock()
     columns = (
         "article_id",
         "sequence",
         "content",
+        "clean_content",
         "summary",
         "embedding",
     )
@@ -119,4 +145,120 @@ async def test_articles_loader_loads_article_fragment(get_db_client_mock):
         loader = ArticlesLoader()
         await loader.load_fragment(fragment.as_dict())
 
-    db_client_mock.insert.assert_called_once_with("es_diario_boe_article_fragment", serialized, columns)
+    db_client_mock.insert.assert_awaited_once_with("es_diario_boe_article_fragment", serialized, columns)
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
+async def test_articles_upsert_loader_upserts_article_and_deletes_stale_fragments(get_db_client_mock):
+    db_client_mock = mock.AsyncMock()
+    get_db_client_mock.return_value = db_client_mock
+    row_dict = {"article_id": "article-id", "summary_id": "summary-id", "n_fragments": 2}
+
+    loader = ArticlesUpsertLoader()
+    await loader.load_article(row_dict)
+
+    (statements,) = db_client_mock.execute_transaction.await_args.args
+    (upsert_sql, upsert_values), (delete_sql, delete_values) = statements
+    assert upsert_sql.startswith("INSERT INTO es_diario_boe_article (")
+    assert "ON CONFLICT (article_id) DO UPDATE SET summary_id = EXCLUDED.summary_id" in upsert_sql
+    assert upsert_values == [tuple(row_dict.get(c) for c in loader.article_cols)]
+    assert delete_sql.startswith("DELETE FROM es_diario_boe_article_fragment")
+    assert "sequence > %s" in delete_sql
+    assert delete_values == [("article-id", 2)]
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
+async def test_articles_upsert_loader_upserts_fragment(get_db_client_mock):
+    db_client_mock = mock.AsyncMock()
+    get_db_client_mock.return_value = db_client_mock
+    row_dict = mock.Mock()
+
+    loader = ArticlesUpsertLoader()
+    await loader.load_fragment(row_dict)
+
+    db_client_mock.upsert.assert_awaited_once_with(
+        "es_diario_boe_article_fragment",
+        row_dict,
+        ("article_id", "sequence"),
+        ("content", "clean_content", "summary", "embedding"),
+        loader.fragment_cols,
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
+async def test_articles_transaction_loader_loads_complete_articles(get_db_client_mock):
+    db_client_mock = mock.AsyncMock()
+    get_db_client_mock.return_value = db_client_mock
+
+    article = Article("article-id", "summary-id", {"fecha_publicacion": "20231101"}, "content", 2)
+    fragments = [ArticleFragment("article-id", "one", 1, 2), ArticleFragment("article-id", "two", 2, 2)]
+
+    loader = ArticlesTransactionLoader()
+    # fragments may be transformed before their article
+    assert await loader.process(fragments[0]) is fragments[0]
+    assert await loader.process(article) is article
+    db_client_mock.execute_transaction.assert_not_awaited()
+
+    assert await loader.process(fragments[1]) is fragments[1]
+    db_client_mock.execute_transaction.assert_awaited_once()
+    statements = db_client_mock.execute_transaction.call_args.args[0]
+    (article_sql, article_values), (fragment_sql, fragment_values) = statements
+    assert article_sql.startswith("INSERT INTO es_diario_boe_article (")
+    assert len(article_values) == 1
+    assert fragment_sql.startswith("INSERT INTO es_diario_boe_article_fragment (")
+    assert [values[2] for values in fragment_values] == ["one", "two"]
+    assert loader.pending == {}
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
+async def test_articles_transaction_loader_holds_incomplete_articles(get_db_client_mock):
+    db_client_mock = mock.AsyncMock()
+    get_db_client_mock.return_value = db_client_mock
+
+    article = Article("article-id", "summary-id", {"fecha_publicacion": "20231101"}, "content", 2)
+    loader = ArticlesTransactionLoader()
+    await loader.process(article)
+    await loader.process(ArticleFragment("article-id", "one", 1, 2))
+
+    db_client_mock.execute_transaction.assert_not_awaited()
+    assert list(loader.pending) == ["article-id"]
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
+async def test_articles_bulk_loader_copies_articles_before_fragments(get_db_client_mock):
+    db_client_mock = mock.AsyncMock()
+    get_db_client_mock.return_value = db_client_mock
+    metadata = {"fecha_publicacion": "20231101"}
+    article = Article("article-id", "summary-id", metadata, "content")
+    fragment = ArticleFragment("article-id", "content", 1, 1)
+
+    loader = ArticlesBulkLoader(2)
+    loaded = await loader.process_batch([fragment, article])
+
+    assert loaded == [fragment, article]
+    assert [c.args[0] for c in db_client_mock.copy_many.await_args_list] == [
+        "es_diario_boe_article",
+        "es_diario_boe_article_fragment",
+    ]
+    article_rows = db_client_mock.copy_many.await_args_list[0].args[1]
+    assert article_rows[0]["metadata"].obj is metadata
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.load.get_async_db_client")
+async def test_articles_bulk_loader_skips_empty_copies(get_db_client_mock):
+    db_client_mock = mock.AsyncMock()
+    get_db_client_mock.return_value = db_client_mock
+    fragment = ArticleFragment("article-id", "content", 1, 1)
+
+    loader = ArticlesBulkLoader(100)
+    await loader.process_batch([fragment])
+
+    db_client_mock.copy_many.assert_awaited_once_with(
+        "es_diario_boe_article_fragment", [fragment.as_dict()], loader.fragment_cols, loader.fragment_types
+    )
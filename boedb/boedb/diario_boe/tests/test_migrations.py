@@ -0,0 +1,43 @@
+from unittest import mock
+
+from boedb.diario_boe.migrations import (
+    migrate_article_incomplete_summary,
+    migrate_fragment_clean_content,
+)
+
+
+def test_migrate_fragment_clean_content_backfills_in_batches():
+    db_client = mock.Mock()
+    batches = [
+        [
+            {"article_id": "article-1", "sequence": 1, "content": "<p>one</p>"},
+            {"article_id": "article-1", "sequence": 2, "content": "<p>two &amp; three</p>"},
+        ],
+        [{"article_id": "article-2", "sequence": 1, "content": "four"}],
+    ]
+    db_client.execute.side_effect = [None, *batches, [], None]
+
+    migrated = migrate_fragment_clean_content(db_client, batch_size=2)
+
+    assert migrated == 3
+    schema_sql = db_client.execute.call_args_list[0].args[0]
+    assert "add column if not exists clean_content" in schema_sql
+    assert "to_tsvector('spanish', clean_content)" in schema_sql
+    # resumed migrations don't rebuild the search column again
+    assert "position('clean_content' in generation_expression) > 0" in schema_sql
+    assert db_client.execute.call_args_list[1].args[1] == (2,)
+    assert db_client.execute_many.call_args_list == [
+        mock.call(mock.ANY, [("one", "article-1", 1), ("two & three", "article-1", 2)]),
+        mock.call(mock.ANY, [("four", "article-2", 1)]),
+    ]
+    assert "refresh materialized view" in db_client.execute.call_args.args[0]
+
+
+def test_migrate_article_incomplete_summary_replaces_view():
+    db_client = mock.Mock()
+
+    migrate_article_incomplete_summary(db_client)
+
+    sql = db_client.execute.call_args.args[0]
+    assert "create or replace view es_diario_boe_article_incomplete" in sql
+    assert "art.summary_id" in sql
@@ -1,5 +1,5 @@
-import json
 import os.path
+import pickle
 import textwrap
 from datetime import datetime
 from unittest import mock
@@ -8,11 +8,14 @@ from xml.etree import ElementTree
 import pytest
 
 from boedb.diario_boe.models import (
+    BREAK_COSTS,
     Article,
     ArticleFragment,
     DaySummary,
     DaySummaryEntry,
+    DaySummaryParser,
     DocumentError,
+    EntryMetadata,
     check_error,
 )
 
@@ -80,15 +83,78 @@ def test_day_summary_from_xml_inits_ok(summary_xml):
     assert summary.metadata == {"fecha": "14/09/2023"}
 
 
+def read_fixture(path):
+    path = os.path.join(os.path.dirname(__file__), path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def aiter_chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+@pytest.mark.parametrize("fixture", ["BOE-S-19991225.xml", "BOE-S-20230614.xml", "BOE-S-20230904.xml"])
+def test_day_summary_parser_matches_from_xml(fixture):
+    xml = read_fixture(f"fixtures/{fixture}")
+    expected = DaySummary.from_xml(ElementTree.fromstring(xml))
+
+    parser = DaySummaryParser()
+    items = []
+    for i in range(0, len(xml), 1000):
+        items.extend(parser.feed(xml[i : i + 1000]))
+    items.extend(parser.close())
+
+    assert parser.summary_id == expected.summary_id
+    assert parser.metadata == expected.metadata
+    assert [(i.summary_id, i.entry_id, i.metadata, i.title) for i in items] == [
+        (i.summary_id, i.entry_id, i.metadata, i.title) for i in expected.items
+    ]
+
+
+def test_day_summary_parser_yields_items_as_they_close(summary_xml):
+    parser = DaySummaryParser()
+    head, tail = summary_xml.split("</item>")
+
+    assert list(parser.feed(head)) == []
+    items = list(parser.feed("</item>"))
+    assert [item.entry_id for item in items] == ["article_id"]
+    assert list(parser.feed(tail)) == []
+    assert list(parser.close()) == []
+
+
+def test_day_summary_parser_discards_parsed_items(summary_xml):
+    parser = DaySummaryParser()
+    list(parser.feed(summary_xml))
+    list(parser.close())
+    assert parser.root.find(".//item") is None
+
+
+def test_day_summary_parser_raises_document_error():
+    parser = DaySummaryParser()
+    list(parser.feed("<error><descripcion>test error</descripcion></error>"))
+    with pytest.raises(DocumentError):
+        list(parser.close())
+
+
+@pytest.mark.asyncio
+async def test_day_summary_from_chunks(summary_xml):
+    summary = await DaySummary.from_chunks(aiter_chunks(summary_xml.encode(), 16))
+    assert summary.summary_id == "summary_id"
+    assert summary.publication_date == datetime(2023, 9, 14)
+    assert [item.entry_id for item in summary.items] == ["article_id"]
+
+
 def test_day_summary_serializes_to_dict():
     entry_mock = mock.Mock(spec=DaySummaryEntry)
     metadata = {"fecha": "14/09/2023"}
     summary = DaySummary("summary_id", metadata, [entry_mock])
 
-    assert summary.as_dict() == {
+    row_dict = summary.as_dict()
+    assert row_dict.pop("metadata").obj is metadata
+    assert row_dict == {
         "summary_id": "summary_id",
         "pubdate": datetime(2023, 9, 14),
-        "metadata": '{"fecha": "14/09/2023"}',
         "n_articles": 1,
     }
 
@@ -105,6 +171,28 @@ def test_day_summary_entry_inits_ok():
     assert entry.title == title
 
 
+def test_entry_metadata_overrides_ancestors():
+    metadata = EntryMetadata({"id": "entry_id", "seccion": "own"}, {"seccion": {"num": "1"}, "diario": {}})
+    assert metadata["id"] == "entry_id"
+    assert metadata["seccion"] == "own"
+    assert metadata == {"seccion": "own", "diario": {}, "id": "entry_id"}
+    assert list(metadata) == ["seccion", "diario", "id"]
+    assert len(metadata) == 3
+
+
+def test_day_summary_entries_share_ancestors_metadata():
+    xml = read_fixture("fixtures/BOE-S-20230614.xml")
+    items = DaySummary.from_xml(ElementTree.fromstring(xml)).items
+
+    # entries under the same ancestors reference the same ancestors metadata
+    ancestors = {}
+    for item in items:
+        key = tuple(id(attrib) for attrib in item.metadata.ancestors.values())
+        assert ancestors.setdefault(key, item.metadata.ancestors) is item.metadata.ancestors
+    assert len(ancestors) < len(items)
+    assert not hasattr(items[0], "__dict__")
+
+
 def test_article_inits_ok(article_data):
     article = Article.from_xml(article_data, "BOE-S-2023-08-26")
     assert article.article_id == "BOE-A-2023-18664"
@@ -129,11 +217,12 @@ def test_article_as_dict():
     article.title_summary = title_summary
     article.title_embedding = title_embedding
 
-    assert article.as_dict() == {
+    row_dict = article.as_dict()
+    assert row_dict.pop("metadata").obj is metadata
+    assert row_dict == {
         "article_id": article_id,
         "summary_id": summary_id,
         "pubdate": datetime(2023, 11, 2),
-        "metadata": json.dumps(metadata),
         "title": metadata["titulo"],
         "title_summary": title_summary,
         "title_embedding": title_embedding,
@@ -164,6 +253,17 @@ def test_article_splits_produces_articles(article_data):
     assert (fragments[1].sequence, fragments[1].total) == (2, 2)
 
 
+def test_article_and_fragments_are_picklable(article_data):
+    article = Article.from_xml(article_data, "summary-id")
+    fragments = article.split()
+
+    unpickled, unpickled_fragments = pickle.loads(pickle.dumps((article, fragments)))
+    row_dict, unpickled_row_dict = article.as_dict(), unpickled.as_dict()
+    assert unpickled_row_dict.pop("metadata").obj == row_dict.pop("metadata").obj
+    assert unpickled_row_dict == row_dict
+    assert [f.as_dict() for f in unpickled_fragments] == [f.as_dict() for f in fragments]
+
+
 def test_article_splits_doesnt_split_below_max(article_data):
     article = Article.from_xml(article_data, "summary-id")
     fragments = article.split(max_length=1e6)
@@ -274,6 +374,68 @@ def test_article_splits_content_desperately():
     assert fragments[1].content.startswith("###")
 
 
+def test_article_splits_without_structure_on_forced_breaks():
+    text = "x" * 1000
+    assert Article._find_break_points(text) == {}
+
+    fragments = Article._split_text(text, 300)
+    assert [len(fragment) for fragment in fragments] == [250, 250, 250, 250]
+
+
+def test_article_splits_fragments_of_exactly_max_length():
+    assert Article._split_text("x" * 300, 300) == ["x" * 300]
+    assert Article._split_text("x" * 600, 300) == ["x" * 300, "x" * 300]
+
+
+def test_article_keeps_cheapest_break_point_per_resolution():
+    paragraph = "<p>" + "x" * 10 + "</p>"
+    text = paragraph * 3 + "<p>Artículo 1.</p>" + paragraph * 3
+
+    break_points = Article._find_break_points(text, resolution=len(text) + 1)
+    assert break_points == {len(paragraph) * 3: BREAK_COSTS["article"]}
+
+    # every paragraph end is closer than the resolution, the split still finds them
+    fragments = Article._split_text(text * 10, 200)
+    assert "".join(fragments) == text * 10
+    assert max(len(fragment) for fragment in fragments) <= 200
+
+
+def test_article_prefers_structure_breaks_to_balanced_paragraphs():
+    paragraph = "<p>" + "x" * 40 + "</p>\n"
+    # the even split is on a paragraph end, the article starts two paragraphs later
+    text = paragraph * 8 + "<p>Artículo 1.</p>\n" + paragraph * 4
+    fragments = Article._split_text(text, 400)
+
+    assert len(fragments) == 2
+    assert fragments[1].startswith("<p>Artículo 1.</p>")
+
+
+def test_article_prefers_annex_to_article_breaks():
+    paragraph = "<p>" + "x" * 40 + "</p>\n"
+    text = paragraph * 5 + "<p>Artículo 1.</p>\n" + paragraph + "<p>ANEXO I</p>\n" + paragraph * 4
+    fragments = Article._split_text(text, 400)
+
+    assert len(fragments) == 2
+    assert fragments[1].startswith("<p>ANEXO I</p>")
+
+
+def test_article_splits_large_document_within_max_length():
+    parts = []
+    for idx in range(5000):
+        if idx % 500 == 0:
+            parts.append(f"<p>ANEXO {idx}</p>")
+        elif idx % 50 == 0:
+            parts.append(f"<p>Artículo {idx}.</p>")
+        elif idx % 70 == 0:
+            parts.append("<table><tr><td>" + "y" * (idx % 300) + "</td></tr></table>")
+        parts.append("<p>" + "x" * (idx * 37 % 700) + "</p>\n")
+    text = "".join(parts)
+
+    fragments = Article._split_text(text, 2000)
+    assert "".join(fragments) == text
+    assert max(len(fragment) for fragment in fragments) <= 2000
+
+
 def test_fragment_as_dict():
     article_id = "article_id"
     summary_id = "summary_id"
@@ -283,7 +445,7 @@ def test_fragment_as_dict():
     summary = "content summary"
     embedding = [0.1, 0.2]
 
-    fragment = ArticleFragment(article_id, content, sequence, total)
+    fragment = ArticleFragment(article_id, content, sequence, total, "clean content")
     fragment.summary = summary
     fragment.embedding = embedding
 
@@ -291,6 +453,7 @@ def test_fragment_as_dict():
         "article_id": article_id,
         "sequence": sequence,
         "content": content,
+        "clean_content": "clean content",
         "summary": summary,
         "embedding": embedding,
     }
@@ -1,8 +1,25 @@
+import asyncio
 from datetime import datetime
 from unittest import mock
 
+import pytest
+
+from boedb.diario_boe.load import (
+    ArticlesBulkLoader,
+    ArticlesLoader,
+    ArticlesTransactionLoader,
+    ArticlesUpsertLoader,
+)
 from boedb.diario_boe.models import DaySummary, DaySummaryEntry
-from boedb.diario_boe.pipelines import DiarioBoeArticlesPipeline, DiarioBoeSummaryPipeline
+from boedb.diario_boe.pipelines import (
+    DiarioBoeArticlesPipeline,
+    DiarioBoeSummaryPipeline,
+    get_article_ids_bloom,
+    get_cpu_executor,
+    get_loaded_summary_query,
+    load_article_ids_bloom,
+)
+from boedb.processors.bloom import BloomFilter
 
 
 @mock.patch("boedb.diario_boe.pipelines.get_db_client")
@@ -18,7 +35,7 @@ def test_summary_pipeline_inits_ok(extractor_mock, loader_mock, get_db_mock):
         pipeline = DiarioBoeSummaryPipeline(date, session)
 
     assert pipeline.db_client == get_db_mock.return_value
-    extractor_mock.assert_called_once_with(date, session, should_skip=ef_mock.return_value)
+    extractor_mock.assert_called_once_with(date, session, should_skip=ef_mock.return_value, offline=False)
     loader_mock.assert_called_once_with(should_skip=lf_mock.return_value)
 
 
@@ -28,15 +45,22 @@ def test_summary_pipeline_inits_ok(extractor_mock, loader_mock, get_db_mock):
 def test_summary_pipeline_extract_should_skip(get_db_mock):
     date = datetime(2023, 11, 10)
     session = mock.Mock()
-    summary_rows = [["summary-1"], ["summary-2"]]
+    summary_rows = [{"summary_id": "BOE-S-20231110"}]
 
     get_db_mock.return_value.execute.return_value = summary_rows
     pipeline = DiarioBoeSummaryPipeline(date, session)
     should_skip = pipeline.get_extract_filter()
 
-    assert should_skip(DaySummary("summary-1", {"fecha": "10/11/2023"})) is True
-    assert should_skip(DaySummary("summary-2", {"fecha": "10/11/2023"})) is True
-    assert should_skip(DaySummary("summary-3", {"fecha": "10/11/2023"})) is False
+    get_db_mock.return_value.execute.assert_called_with(mock.ANY, {"summary_id": "BOE-S-20231110"})
+    assert should_skip(DaySummary("BOE-S-20231110", {"fecha": "10/11/2023"})) is True
+    assert should_skip(DaySummary("BOE-S-20231111", {"fecha": "11/11/2023"})) is False
+
+
+def test_loaded_summary_query_scopes_incomplete_summaries():
+    sql, params = get_loaded_summary_query("BOE-S-20231110")
+
+    assert params == {"summary_id": "BOE-S-20231110"}
+    assert "from es_diario_boe_summary_incomplete where summary_id = %(summary_id)s" in sql
 
 
 @mock.patch("boedb.diario_boe.pipelines.get_db_client")
@@ -44,18 +68,18 @@ def test_summary_pipeline_extract_should_skip(get_db_mock):
 def test_summary_pipeline_load_should_skip(get_db_mock):
     date = datetime(2023, 11, 10)
     session = mock.Mock()
-    summary_rows = [["summary-1"], ["summary-2"]]
+    summary_rows = [{"summary_id": "BOE-S-20231110"}]
 
     get_db_mock.return_value.execute.return_value = summary_rows
     pipeline = DiarioBoeSummaryPipeline(date, session)
     should_skip = pipeline.get_load_filter()
 
-    assert should_skip(DaySummary("summary-1", {"fecha": "10/11/2023"})) is True
-    assert should_skip(DaySummary("summary-2", {"fecha": "10/11/2023"})) is True
-    assert should_skip(DaySummary("summary-3", {"fecha": "10/11/2023"})) is False
+    get_db_mock.return_value.execute.assert_called_with(mock.ANY, ("BOE-S-20231110",))
+    assert should_skip(DaySummary("BOE-S-20231110", {"fecha": "10/11/2023"})) is True
+    assert should_skip(DaySummary("BOE-S-20231111", {"fecha": "11/11/2023"})) is False
 
 
-@mock.patch("boedb.diario_boe.pipelines.get_db_client")
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client")
 @mock.patch("boedb.diario_boe.pipelines.ArticlesLoader")
 @mock.patch("boedb.diario_boe.pipelines.ArticlesTransformer")
 @mock.patch("boedb.diario_boe.pipelines.ArticlesExtractor")
@@ -69,21 +93,225 @@ def test_articles_pipeline_inits_ok(extractor_mock, transformer_mock, loader_moc
         pipeline = DiarioBoeArticlesPipeline(session)
 
     assert pipeline.db_client == get_db_mock.return_value
-    extractor_mock.assert_called_once_with(10, session, should_skip=ef_mock.return_value)
-    transformer_mock.assert_called_once_with(20, session)
-    loader_mock.assert_called_once_with(30)
+    extractor_mock.assert_called_once_with(
+        10, session, should_skip=ef_mock.return_value, offline=False, cpu_executor=None, workers=False
+    )
+    transformer_mock.assert_called_once_with(20, session, cpu_executor=None, workers=False)
+    loader_mock.assert_called_once_with(30, cpu_executor=None)
 
 
-@mock.patch("boedb.diario_boe.pipelines.get_db_client")
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client")
+@mock.patch("boedb.diario_boe.pipelines.get_article_ids_bloom", mock.Mock(return_value=None))
 @mock.patch("boedb.diario_boe.pipelines.ArticlesLoader", mock.Mock())
-def test_articles_pipeline_extract_should_skip(get_db_mock):
+async def test_articles_pipeline_extract_should_skip(get_db_mock):
     session = mock.Mock()
-    summary_rows = [["article-1"], ["article-2"]]
+    article_rows = [{"article_id": "article-1"}, {"article_id": "article-2"}]
 
-    get_db_mock.return_value.execute.return_value = summary_rows
+    get_db_mock.return_value.execute = mock.AsyncMock(return_value=article_rows)
     pipeline = DiarioBoeArticlesPipeline(session)
     should_skip = pipeline.get_extract_filter()
 
-    assert should_skip(DaySummaryEntry("summary-id", "article-1", {}, "title")) is True
-    assert should_skip(DaySummaryEntry("summary-id", "article-2", {}, "title")) is True
-    assert should_skip(DaySummaryEntry("summary-id", "article-3", {}, "title")) is False
+    # entries checked at once share the lookup of their summary
+    skipped = await asyncio.gather(
+        should_skip(DaySummaryEntry("summary-id", "article-1", {}, "title")),
+        should_skip(DaySummaryEntry("summary-id", "article-2", {}, "title")),
+        should_skip(DaySummaryEntry("summary-id", "article-3", {}, "title")),
+    )
+    assert skipped == [True, True, False]
+
+    # article ids are only looked up once per summary
+    get_db_mock.return_value.execute.assert_awaited_once_with(mock.ANY, {"summary_id": "summary-id"})
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client")
+@mock.patch("boedb.diario_boe.pipelines.ArticlesLoader", mock.Mock())
+async def test_articles_pipeline_extract_should_skip_with_bloom(get_db_mock):
+    bloom = BloomFilter.from_keys(["article-1"], capacity=10)
+    get_db_mock.return_value.execute = mock.AsyncMock(return_value=[{"article_id": "article-1"}])
+
+    with mock.patch("boedb.diario_boe.pipelines.get_article_ids_bloom", return_value=bloom):
+        pipeline = DiarioBoeArticlesPipeline(mock.Mock())
+        should_skip = pipeline.get_extract_filter()
+
+    assert await should_skip(DaySummaryEntry("summary-2", "article-2", {}, "title")) is False
+    get_db_mock.return_value.execute.assert_not_awaited()
+
+    assert await should_skip(DaySummaryEntry("summary-1", "article-1", {}, "title")) is True
+    get_db_mock.return_value.execute.assert_awaited_once_with(mock.ANY, {"summary_id": "summary-1"})
+
+
+@pytest.fixture
+def reset_article_ids_bloom():
+    if hasattr(DiarioBoeArticlesPipeline, "_article_ids_bloom"):
+        del DiarioBoeArticlesPipeline._article_ids_bloom
+    yield
+    if hasattr(DiarioBoeArticlesPipeline, "_article_ids_bloom"):
+        del DiarioBoeArticlesPipeline._article_ids_bloom
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_FILTER_BLOOM", False)
+async def test_article_ids_bloom_is_disabled_by_default(reset_article_ids_bloom):
+    assert await load_article_ids_bloom() is None
+    assert get_article_ids_bloom() is None
+
+
+def test_get_article_ids_bloom_is_none_until_loaded(reset_article_ids_bloom):
+    assert get_article_ids_bloom() is None
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_FILTER_BLOOM", True)
+async def test_load_article_ids_bloom_returns_singleton(reset_article_ids_bloom):
+    async def iterate(_):
+        for row in [{"article_id": "article-1"}, {"article_id": "article-2"}]:
+            yield row
+
+    db_mock = mock.Mock()
+    db_mock.execute = mock.AsyncMock(return_value=[{"count": 2}])
+    db_mock.iterate = mock.Mock(side_effect=iterate)
+
+    with mock.patch("boedb.diario_boe.pipelines.get_async_db_client", return_value=db_mock):
+        bloom = await load_article_ids_bloom()
+        assert await load_article_ids_bloom() is bloom
+
+    assert get_article_ids_bloom() is bloom
+    assert "article-1" in bloom and "article-2" in bloom
+    db_mock.iterate.assert_called_once()
+
+
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesExtractor", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesTransformer", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesBulkLoader")
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_MODE", "bulk")
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_BULK_SIZE", 40)
+def test_articles_pipeline_inits_bulk_loader(loader_mock):
+    extract_filter = "boedb.diario_boe.pipelines.DiarioBoeArticlesPipeline.get_extract_filter"
+    with mock.patch(extract_filter):
+        pipeline = DiarioBoeArticlesPipeline(mock.Mock())
+
+    assert pipeline.loader is loader_mock.return_value
+    loader_mock.assert_called_once_with(40, cpu_executor=None)
+
+
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesExtractor", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesTransformer", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesUpsertLoader")
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_MODE", "upsert")
+def test_articles_pipeline_inits_upsert_loader(loader_mock):
+    extract_filter = "boedb.diario_boe.pipelines.DiarioBoeArticlesPipeline.get_extract_filter"
+    with mock.patch(extract_filter):
+        pipeline = DiarioBoeArticlesPipeline(mock.Mock())
+
+    assert pipeline.loader is loader_mock.return_value
+
+
+@mock.patch("boedb.diario_boe.pipelines.get_db_client")
+@mock.patch("boedb.diario_boe.pipelines.SummaryExtractor", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.SummaryLoader")
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_MODE", "upsert")
+def test_summary_pipeline_upserts_without_load_filter(loader_mock, get_db_mock):
+    get_db_mock.return_value.execute.return_value = []
+    DiarioBoeSummaryPipeline(datetime(2023, 11, 10), mock.Mock())
+
+    loader_mock.assert_called_once_with(upsert=True)
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client")
+@mock.patch("boedb.diario_boe.pipelines.get_article_ids_bloom", mock.Mock(return_value=None))
+@mock.patch("boedb.diario_boe.pipelines.ArticlesLoader", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesUpsertLoader", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_MODE", "upsert")
+async def test_articles_pipeline_upsert_doesnt_skip_incomplete_articles(get_db_mock):
+    get_db_mock.return_value.execute = mock.AsyncMock(return_value=[])
+    pipeline = DiarioBoeArticlesPipeline(mock.Mock())
+    await pipeline.get_article_ids("summary-id")
+
+    sql = get_db_mock.return_value.execute.call_args.args[0]
+    assert "from es_diario_boe_article_incomplete where summary_id = %(summary_id)s" in sql
+
+
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesExtractor", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesTransformer", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesTransactionLoader")
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_MODE", "transaction")
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_CONCURRENCY", 30)
+def test_articles_pipeline_inits_transaction_loader(loader_mock):
+    extract_filter = "boedb.diario_boe.pipelines.DiarioBoeArticlesPipeline.get_extract_filter"
+    with mock.patch(extract_filter):
+        pipeline = DiarioBoeArticlesPipeline(mock.Mock())
+
+    assert pipeline.loader is loader_mock.return_value
+    loader_mock.assert_called_once_with(30, cpu_executor=None)
+
+
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.ArticlesExtractor")
+@mock.patch("boedb.diario_boe.pipelines.ArticlesTransformer")
+@mock.patch("boedb.diario_boe.pipelines.ArticlesTransactionLoader", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_STAGE_WORKERS", True)
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_MODE", "transaction")
+def test_articles_pipeline_inits_stage_workers(transformer_mock, extractor_mock):
+    extract_filter = "boedb.diario_boe.pipelines.DiarioBoeArticlesPipeline.get_extract_filter"
+    with mock.patch(extract_filter):
+        DiarioBoeArticlesPipeline(mock.Mock())
+
+    assert extractor_mock.call_args.kwargs["workers"] is True
+    assert transformer_mock.call_args.kwargs["workers"] is True
+
+
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_STAGE_WORKERS", True)
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_MODE", "insert")
+def test_articles_pipeline_stage_workers_require_transaction_mode():
+    with pytest.raises(ValueError):
+        DiarioBoeArticlesPipeline(mock.Mock())
+
+
+@pytest.mark.parametrize(
+    "load_mode, loader_class",
+    [
+        ("insert", ArticlesLoader),
+        ("upsert", ArticlesUpsertLoader),
+        ("transaction", ArticlesTransactionLoader),
+        ("bulk", ArticlesBulkLoader),
+    ],
+)
+@mock.patch("boedb.diario_boe.pipelines.get_async_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.load.get_async_db_client", mock.Mock())
+@mock.patch("boedb.diario_boe.pipelines.get_article_ids_bloom", mock.Mock(return_value=None))
+def test_articles_pipeline_executors_share_cpu_executor(load_mode, loader_class):
+    cpu_executor = mock.Mock()
+    with mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_LOAD_MODE", load_mode), mock.patch(
+        "boedb.diario_boe.pipelines.get_cpu_executor", return_value=cpu_executor
+    ):
+        pipeline = DiarioBoeArticlesPipeline(mock.Mock())
+
+    assert type(pipeline.loader) is loader_class
+    for executor in (pipeline.extractor, pipeline.transformer, pipeline.loader):
+        assert executor.cpu_executor is cpu_executor
+
+
+@pytest.fixture
+def reset_cpu_executor():
+    if hasattr(DiarioBoeArticlesPipeline, "_cpu_executor"):
+        del DiarioBoeArticlesPipeline._cpu_executor
+    yield
+    if getattr(DiarioBoeArticlesPipeline, "_cpu_executor", None) is not None:
+        DiarioBoeArticlesPipeline._cpu_executor.shutdown()
+    if hasattr(DiarioBoeArticlesPipeline, "_cpu_executor"):
+        del DiarioBoeArticlesPipeline._cpu_executor
+
+
+@mock.patch("boedb.diario_boe.pipelines.DiarioBoeConfig.ARTICLE_CPU_PROCESSES", 2)
+def test_get_cpu_executor_spawns_workers(reset_cpu_executor):
+    cpu_executor = get_cpu_executor()
+
+    assert get_cpu_executor() is cpu_executor
+    assert cpu_executor._mp_context.get_start_method() == "spawn"
@@ -191,3 +191,23 @@ async def test_article_transformer_transforms_fragment_clean_content():
     prompt_mock.assert_called_once_with(clean_content)
     client_mock.complete.assert_awaited_once_with(test_prompt, max_tokens=8)
     client_mock.get_embeddings.assert_awaited_once_with(clean_content)
+
+
+@pytest.mark.asyncio
+async def test_article_transformer_uses_fragment_clean_content():
+    session_mock = mock.Mock()
+    client_mock = mock.AsyncMock()
+    client_mock.get_embeddings.return_value = [0.1, 0.2]
+
+    fragment = ArticleFragment("article_id", "<p>content</p>", 1, 1, clean_content="content")
+
+    with mock.patch("boedb.diario_boe.transform.OpenAiClient") as OpenAiClientMock, mock.patch(
+        "boedb.diario_boe.transform.HTMLFilter"
+    ) as HTMLFilterMock:
+        OpenAiClientMock.return_value = client_mock
+        transformer = ArticlesTransformer(1, session_mock)
+        transformed = await transformer.process(fragment)
+
+    assert transformed.summary == "content"
+    HTMLFilterMock.clean_html.assert_not_called()
+    client_mock.get_embeddings.assert_awaited_once_with("content")
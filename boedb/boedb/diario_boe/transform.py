@@ -1,5 +1,3 @@
-import time
-
 from boedb.config import DiarioBoeConfig, get_logger
 from boedb.diario_boe.models import Article, ArticleFragment
 from boedb.pipelines.stream import StreamPipelineBaseExecutor
@@ -8,11 +6,11 @@ from boedb.processors.llm import OpenAiClient
 
 
 class ArticlesTransformer(StreamPipelineBaseExecutor):
-    def __init__(self, concurrency, http_session):
+    def __init__(self, concurrency, http_session, cpu_executor=None, workers=False):
         self.logger = get_logger("boedb.diario_boe.article_transformer")
-        super().__init__(concurrency)
+        super().__init__(concurrency, cpu_executor, workers)
 
-        self.llm_client = OpenAiClient(http_session)
+        self.llm_client = OpenAiClient(http_session, batch_embeddings=True)
 
     @staticmethod
     def get_title_summary_prompt(title):
@@ -63,7 +61,7 @@ class ArticlesTransformer(StreamPipelineBaseExecutor):
         ]
 
     async def process(self, item):
-        start_time = time.time()
+        # process latency is recorded per stage by the executor
         self.logger.debug(f"Transforming {item}")
 
         if isinstance(item, Article) and item.title:
@@ -72,8 +70,7 @@ class ArticlesTransformer(StreamPipelineBaseExecutor):
         if isinstance(item, ArticleFragment):
             item = await self.process_fragment(item)
 
-        end_time = time.time() - start_time
-        self.logger.debug(f"Transformed {item} ({end_time:.2f}s)")
+        self.logger.debug(f"Transformed {item}")
         return item
 
     async def process_article(self, item):
@@ -94,7 +91,11 @@ class ArticlesTransformer(StreamPipelineBaseExecutor):
         return item
 
     async def process_fragment(self, item):
-        clean_content = HTMLFilter.clean_html(item.content)
+        # fragments are cleaned on extraction, unless they were built elsewhere
+        if item.clean_content is None:
+            item.clean_content = await self.run_cpu_bound(HTMLFilter.clean_html, item.content)
+
+        clean_content = item.clean_content
         if len(clean_content) > DiarioBoeConfig.CONTENT_SUMMARIZATION_MIN_LENGTH:
             # We want to avoid using LLM tokens for the html tags, and there are
             # certain elements (eg. tables) that won't provide much meaningful content
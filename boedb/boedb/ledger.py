@@ -0,0 +1,84 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+
+class ProgressLedger:
+    """
+    Persisted record of the dates processed by a backfill, so an interrupted backfill
+    can resume where it stopped.
+
+    Every date is stored in a JSON file with its status and stats. The file is
+    rewritten atomically on each update so it's never left half written.
+    """
+
+    DONE = "done"
+    MISSING = "missing"
+    FAILED = "failed"
+    BUSY = "busy"
+    # not found in the archive on an offline run, it might still be published online
+    UNARCHIVED = "unarchived"
+
+    # dates in these states are not processed again
+    COMPLETE = {DONE, MISSING}
+    # summaries are published on their date, so a missing date is only final when it
+    # was checked this long after it, earlier it might just not be published yet
+    MISSING_FINAL_AFTER = timedelta(days=2)
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def get_key(day):
+        if isinstance(day, datetime):
+            day = day.date()
+        return day.isoformat()
+
+    def get(self, day):
+        return self.entries.get(self.get_key(day))
+
+    def is_complete(self, day):
+        entry = self.get(day)
+        if entry is None or entry["status"] not in self.COMPLETE:
+            return False
+        if entry["status"] == self.MISSING:
+            checked = datetime.fromisoformat(entry["updated"]).date()
+            return checked - date.fromisoformat(self.get_key(day)) >= self.MISSING_FINAL_AFTER
+        return True
+
+    def pending(self, days):
+        return [day for day in days if not self.is_complete(day)]
+
+    def mark(self, day, status, **stats):
+        self.entries[self.get_key(day)] = {
+            "status": status,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            **stats,
+        }
+        self.save()
+
+    def save(self):
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+
+def date_range(start, end):
+    """Return every date from `start` to `end`, both included, newest first
+    as it's usually the most relevant data."""
+    start, end = sorted((start, end))
+    if isinstance(start, datetime):
+        start, end = start.date(), end.date()
+    return [date.fromordinal(ordinal) for ordinal in range(end.toordinal(), start.toordinal() - 1, -1)]
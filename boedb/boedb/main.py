@@ -1,42 +1,270 @@
+import argparse
 import asyncio
-from datetime import datetime, timedelta
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
 
-from boedb.client import HttpClient, get_http_client_session
-from boedb.config import get_logger
-from boedb.diario_boe.models import DocumentError
-from boedb.diario_boe.pipelines import DiarioBoeArticlesPipeline, DiarioBoeSummaryPipeline
+from boedb.archive import get_document_archive
+from boedb.client import get_http_client_session
+from boedb.config import DiarioBoeConfig, MetricsConfig, get_logger
+from boedb.db import get_async_db_client
+from boedb.diario_boe.models import DocumentError, get_summary_id
+from boedb.diario_boe.pipelines import (
+    DiarioBoeArticlesPipeline,
+    DiarioBoeSummaryPipeline,
+    get_loaded_summary_query,
+    load_article_ids_bloom,
+)
+from boedb.ledger import ProgressLedger, date_range
+from boedb.metrics import get_metrics
+from boedb.processors.cache import get_llm_cache
 
 
-async def process_diario_boe_for_date(date):
+async def run_diario_boe_pipelines(date, http_session, limiter=None):
+    """Process the summary and articles for `date`, and return the stats of the
+    processed articles, or None if there's no summary for the date."""
     logger = get_logger()
-    logger.info(f"Starting Pipeline for date {date.isoformat()}")
+    offline = DiarioBoeConfig.ARCHIVE_OFFLINE
+    summary_pipeline = DiarioBoeSummaryPipeline(date, http_session, offline=offline)
+    try:
+        summary = await summary_pipeline.run()
+    except DocumentError:
+        logger.warning(f"Summary for {date} not found")
+        return None
+
+    # summary might have been skipped
+    if summary is None:
+        return {"articles": 0, "items": 0}
+
+    logger.info(f"Processed summary {summary.summary_id} ({len(summary.items)} entries)")
+
+    processed = 0
+    article_ids = set()
+    articles_pipeline = DiarioBoeArticlesPipeline(http_session, offline=offline, limiter=limiter)
+    async for item in articles_pipeline.run(summary.items):
+        processed += 1
+        article_ids.add(item.article_id)
+
+    logger.info(f"{len(article_ids)} articles, {processed} items processed")
+    return {"articles": len(article_ids), "items": processed}
+
+
+async def is_summary_loaded(summary_id):
+    return bool(await get_async_db_client().execute(*get_loaded_summary_query(summary_id)))
+
+
+async def backfill_date(date, http_session, limiter=None):
+    """
+    Process `date` and return its ledger status and stats.
+
+    The date is claimed with an advisory lock on its summary id, and skipped if its
+    summary is already complete, so concurrent backfills, even from other processes,
+    don't process the same date twice.
+    """
+    logger = get_logger()
+    summary_id = get_summary_id(date)
+
+    async with get_async_db_client().advisory_lock(summary_id) as claimed:
+        if not claimed:
+            logger.info(f"Skipping {summary_id}, being processed elsewhere")
+            return ProgressLedger.BUSY, {}
+
+        if await is_summary_loaded(summary_id):
+            logger.info(f"Skipping {summary_id}, already loaded")
+            return ProgressLedger.DONE, {"articles": 0, "items": 0}
+
+        logger.info(f"Starting Pipeline for date {date.isoformat()}")
+        try:
+            stats = await run_diario_boe_pipelines(date, http_session, limiter)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            logger.exception(f"Pipeline for date {date.isoformat()} failed")
+            return ProgressLedger.FAILED, {"error": repr(exc)}
+
+    if stats is None:
+        if DiarioBoeConfig.ARCHIVE_OFFLINE:
+            return ProgressLedger.UNARCHIVED, {}
+        return ProgressLedger.MISSING, {}
+    return ProgressLedger.DONE, stats
+
+
+async def backfill_dates(dates, days_concurrency, budget, on_result):
+    """
+    Process `dates` under a single http session, running up to `days_concurrency`
+    dates at once. All dates share a budget of `budget` items being processed at
+    once by their articles pipelines.
+
+    `on_result` is called with every date, its status and stats as it finishes, and
+    metrics are flushed then.
+
+    The bloom filter of loaded articles, if enabled, is built before any date starts,
+    and the db client and document archive are closed once every date finishes.
+    """
+    # workers take the next pending date as soon as they finish one
+    pending_dates = iter(dates)
+    limiter = asyncio.Semaphore(budget)
+
+    async def worker(http_session):
+        for date in pending_dates:
+            status, stats = await backfill_date(date, http_session, limiter)
+            on_result(date, status, stats)
+            get_metrics().flush()
 
     async with get_http_client_session() as http_session:
-        summary_pipeline = DiarioBoeSummaryPipeline(date, http_session)
         try:
-            summary = await summary_pipeline.run()
-        except DocumentError:
-            logger.warning(f"Summary for {date} not found")
-            return
+            await load_article_ids_bloom()
+            await asyncio.gather(*(worker(http_session) for _ in range(days_concurrency)))
+        finally:
+            await get_async_db_client().close()
+            if archive := get_document_archive():
+                archive.close()
+
+
+async def backfill(start_date, end_date, ledger_path, days_concurrency, budget):
+    """
+    Process every date from `start_date` to `end_date`, see `backfill_dates`.
+
+    Progress is recorded in the ledger at `ledger_path`, and dates already complete
+    there are not processed again.
+    """
+    logger = get_logger()
+    ledger = ProgressLedger(ledger_path)
+    dates = ledger.pending(date_range(start_date, end_date))
+    logger.info(f"Backfilling {len(dates)} pending dates from {start_date} to {end_date}")
+
+    def mark(date, status, stats):
+        ledger.mark(date, status, **stats)
+
+    # only single process backfills serve metrics, workers would clash on the port
+    server = None
+    if MetricsConfig.PROMETHEUS_PORT:
+        server = await get_metrics().serve(MetricsConfig.PROMETHEUS_PORT)
+
+    try:
+        await backfill_dates(dates, days_concurrency, budget, mark)
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+        close_llm_cache()
+
+    logger.info(f"Backfill finished: {ledger.summary()}")
+    return ledger
+
+
+def get_shards(dates, shard_days):
+    return [dates[i : i + shard_days] for i in range(0, len(dates), shard_days)]
+
+
+def run_backfill_shard(dates, days_concurrency, budget):
+    """Worker process entry point: backfill `dates` in its own event loop, and return
+    the status and stats of every date by its isoformat."""
+    results = {}
+
+    def collect(date, status, stats):
+        results[date.isoformat()] = {"status": status, **stats}
+
+    try:
+        asyncio.run(backfill_dates(dates, days_concurrency, budget, collect))
+    finally:
+        close_llm_cache()
+    return results
+
+
+def sharded_backfill(start_date, end_date, ledger_path, processes, shard_days, days_concurrency, budget):
+    """
+    Process every date from `start_date` to `end_date` in `processes` worker processes,
+    so CPU-bound parsing and cleaning can use every core.
+
+    The coordinator splits pending dates in shards of `shard_days` and assigns them to
+    workers as they become available. Each worker backfills its shard with up to
+    `days_concurrency` dates and `budget` items at once, see `backfill_dates`.
+    Workers claim every date through its summary, so dates aren't processed twice.
+
+    The coordinator is the only one writing to the ledger at `ledger_path`, as each
+    shard's results are collected.
+    """
+    logger = get_logger()
+    ledger = ProgressLedger(ledger_path)
+    dates = ledger.pending(date_range(start_date, end_date))
+    shards = get_shards(dates, shard_days)
+    logger.info(f"Backfilling {len(dates)} pending dates in {len(shards)} shards, {processes} processes")
+
+    # workers must not inherit the coordinator's db pools, threads or open files
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context) as pool:
+        futures = {
+            pool.submit(run_backfill_shard, shard, days_concurrency, budget): shard for shard in shards
+        }
+        for future in as_completed(futures):
+            shard = futures[future]
+            name = f"{shard[-1].isoformat()}..{shard[0].isoformat()}"
+            try:
+                results = future.result()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logger.error(f"Shard {name} failed: {exc!r}")
+                results = {}
+                for date in shard:
+                    results[date.isoformat()] = {"status": ProgressLedger.FAILED, "error": repr(exc)}
+
+            counts = {}
+            for date in shard:
+                stats = dict(results[date.isoformat()])
+                status = stats.pop("status")
+                ledger.mark(date, status, **stats)
+                counts[status] = counts.get(status, 0) + 1
+            logger.info(f"Shard {name} finished: {counts}")
+
+    logger.info(f"Backfill finished: {ledger.summary()}")
+    return ledger
 
-        # summary might have been skipped
-        if summary is None:
-            return
 
-        logger.info(f"Processed summary {summary.summary_id} ({len(summary.items)} entries)")
+def close_llm_cache():
+    """Log the LLM cache stats and close it, so its pending access times are written."""
+    if llm_cache := get_llm_cache():
+        get_logger().info(f"LLM cache stats: {llm_cache.stats()}")
+        llm_cache.close()
 
-        processed = 0
-        article_ids = set()
-        articles_pipeline = DiarioBoeArticlesPipeline(http_session)
-        async for item in articles_pipeline.run(summary.items):
-            processed += 1
-            article_ids.add(item.article_id)
 
-        logger.info(f"{len(article_ids)} articles, {processed} items processed")
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Load Diario BOE documents for a range of dates")
+    parser.add_argument("start", type=date.fromisoformat, help="first date, as YYYY-MM-DD")
+    parser.add_argument("end", type=date.fromisoformat, nargs="?", help="last date, defaults to start")
+    parser.add_argument(
+        "--ledger", default=DiarioBoeConfig.BACKFILL_LEDGER_PATH, help="progress ledger file to resume from"
+    )
+    parser.add_argument(
+        "--days", type=int, default=DiarioBoeConfig.BACKFILL_DAYS_CONCURRENCY, help="dates processed at once"
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=DiarioBoeConfig.BACKFILL_CONCURRENCY_BUDGET,
+        help="items processed at once across all dates of a process",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=DiarioBoeConfig.BACKFILL_PROCESSES,
+        help="worker processes, each one backfilling its own shards of dates",
+    )
+    parser.add_argument(
+        "--shard-days", type=int, default=DiarioBoeConfig.BACKFILL_SHARD_DAYS, help="dates in each shard"
+    )
+    return parser.parse_args(args)
 
 
 if __name__ == "__main__":
-    target_date = datetime(2023, 11, 2)
-    while target_date >= datetime(2023, 11, 1):
-        asyncio.run(process_diario_boe_for_date(target_date))
-        target_date -= timedelta(days=1)
+    cli_args = parse_args()
+    end = cli_args.end or cli_args.start
+    if cli_args.processes > 1:
+        sharded_backfill(
+            cli_args.start,
+            end,
+            cli_args.ledger,
+            cli_args.processes,
+            cli_args.shard_days,
+            cli_args.days,
+            cli_args.budget,
+        )
+    else:
+        asyncio.run(backfill(cli_args.start, end, cli_args.ledger, cli_args.days, cli_args.budget))
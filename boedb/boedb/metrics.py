@@ -0,0 +1,255 @@
+import asyncio
+import bisect
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from boedb.config import MetricsConfig, get_logger
+
+# seconds, from a fast db statement to a long LLM completion
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def get_metrics():
+    if hasattr(Metrics, "_metrics"):
+        return Metrics._metrics
+
+    sink = None
+    if MetricsConfig.SINK == "memory":
+        sink = InMemorySink()
+    elif MetricsConfig.SINK == "prometheus":
+        sink = PrometheusSink(MetricsConfig.PROMETHEUS_PATH.format(pid=os.getpid()))
+    elif MetricsConfig.SINK:
+        raise ValueError(f"Unknown metrics sink: {MetricsConfig.SINK}")
+
+    Metrics._metrics = Metrics(sink)
+    return Metrics._metrics
+
+
+def get_labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # one count per bucket, plus the values over the last one
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self):
+        """Return pairs of every bucket upper bound and the number of values up to it."""
+        cumulative, total = [], 0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class MetricsSink:
+    """
+    Receives the metrics recorded through `Metrics`. Metrics are identified by
+    their name and labels key, a sorted tuple of label names and values.
+    """
+
+    def inc(self, name, labels, value):
+        raise NotImplementedError
+
+    def set(self, name, labels, value, delta=False):
+        raise NotImplementedError
+
+    def observe(self, name, labels, value):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class InMemorySink(MetricsSink):
+    """
+    Aggregates counters, gauges and histograms in the process, so they can be
+    inspected, eg. to log them or in tests.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started_at = time.monotonic()
+
+    def inc(self, name, labels, value):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, labels, value, delta=False):
+        key = (name, labels)
+        if delta:
+            value += self.gauges.get(key, 0)
+        self.gauges[key] = value
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def get(self, name, **labels):
+        """Return the value of a counter or gauge, 0 if it was never recorded."""
+        key = (name, get_labels_key(labels))
+        return self.counters.get(key, self.gauges.get(key, 0))
+
+    def get_histogram(self, name, **labels):
+        return self.histograms.get((name, get_labels_key(labels)))
+
+    def get_total(self, name):
+        """Return the sum of a counter for every combination of labels."""
+        return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def get_rate(self, name, per=1, **labels):
+        """Return the mean rate of a counter per `per` seconds since the sink was created,
+        for every combination of labels if none are given."""
+        elapsed = time.monotonic() - self.started_at
+        value = self.get(name, **labels) if labels else self.get_total(name)
+        return value / elapsed * per if elapsed else 0
+
+
+class PrometheusSink(InMemorySink):
+    """
+    In-memory sink exposing its metrics in Prometheus text format, written to the file
+    at `path` on every flush and optionally served over http with `serve`.
+    """
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = Path(path) if path else None
+        self.logger = get_logger("boedb.metrics")
+
+    @staticmethod
+    def format_labels(labels, **extra):
+        labels = (*labels, *((name, str(value)) for name, value in extra.items()))
+        if not labels:
+            return ""
+
+        def escape(value):
+            return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+        return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+    @staticmethod
+    def format_value(value):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value) if isinstance(value, float) else str(value)
+
+    def render(self):
+        lines = []
+        for metric_type, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({name for name, _ in metrics}):
+                lines.append(f"# TYPE {name} {metric_type}")
+                for (metric, labels), value in sorted(metrics.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self.format_labels(labels)} {self.format_value(value)}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                for bound, count in histogram.get_cumulative_counts():
+                    bucket_labels = self.format_labels(labels, le=self.format_value(bound))
+                    lines.append(f"{name}_bucket{bucket_labels} {count}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {self.format_value(histogram.sum)}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Rewrite the metrics file atomically, so it's never scraped half written."""
+        if self.path is None:
+            return
+
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+    async def handle_scrape(self, reader, writer):
+        try:
+            # the request is not routed, every path returns the metrics
+            await reader.readuntil(b"\r\n\r\n")
+            body = self.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port, host="0.0.0.0"):
+        """Start serving the metrics on `port` in the running loop, and return the server."""
+        server = await asyncio.start_server(self.handle_scrape, host, port)
+        self.logger.info(f"Serving metrics on {host}:{port}")
+        return server
+
+
+class Metrics:
+    """
+    Records counters, gauges and histograms into a `MetricsSink`. Every method does
+    nothing without a sink, so instrumented code doesn't need to check.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+
+    @property
+    def enabled(self):
+        return self.sink is not None
+
+    def inc(self, name, value=1, **labels):
+        if self.sink is not None:
+            self.sink.inc(name, get_labels_key(labels), value)
+
+    def set(self, name, value, **labels):
+        if self.sink is not None:
+            self.sink.set(name, get_labels_key(labels), value)
+
+    def add(self, name, value, **labels):
+        """Add `value` to a gauge, eg. to track items in flight."""
+        if self.sink is not None:
+            self.sink.set(name, get_labels_key(labels), value, delta=True)
+
+    def observe(self, name, value, **labels):
+        if self.sink is not None:
+            self.sink.observe(name, get_labels_key(labels), value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the seconds spent in the context, even if it fails."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def flush(self):
+        if self.sink is not None:
+            self.sink.flush()
+
+    async def serve(self, port):
+        """Serve the metrics on `port` if the sink can, returning the server or None."""
+        if isinstance(self.sink, PrometheusSink):
+            return await self.sink.serve(port)
+        return None
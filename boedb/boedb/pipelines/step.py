@@ -1,5 +1,6 @@
 import asyncio
 from abc import abstractmethod
+from collections import abc
 
 from boedb.config import get_logger
 from boedb.processors.batch import batched
@@ -24,8 +25,16 @@ class BaseStepLoader:
 
 
 class BatchProcessorMixin:
-    def __init__(self, batch_size):
+    """
+    Processes items concurrently, `batch_size` at a time. By default items are processed
+    in fixed batches, each one starting after the previous one is complete. With
+    `sliding_window`, a new item starts as soon as any other completes, so slow items
+    don't hold the rest back; see `process_in_window`.
+    """
+
+    def __init__(self, batch_size, sliding_window=False):
         self.batch_size = batch_size
+        self.sliding_window = sliding_window
         self.logger = get_logger("boedb.batchprocessor")
 
     async def gather(self):
@@ -35,6 +44,9 @@ class BatchProcessorMixin:
         raise NotImplementedError
 
     async def process_in_batch(self, items=None):
+        if self.sliding_window:
+            return [result async for result in self.process_in_window(items, ordered=True)]
+
         tasks = []
         if items is None:
             items = await self.gather()
@@ -49,6 +61,56 @@ class BatchProcessorMixin:
             self.logger.debug(f"{processed}/{len(items)} items processed")
         return [task.result() for task in tasks]
 
+    async def process_in_window(self, items=None, ordered=False):
+        """
+        Yield the result of every item, keeping `batch_size` items in flight at all times.
+        Results are yielded as they complete, or in the order of `items` if `ordered`.
+
+        `items` can be any iterable or async iterable, eg. a generator, and is consumed
+        as items are needed. If an item fails, the ones in flight are cancelled and the
+        exception is raised.
+        """
+        if items is None:
+            items = await self.gather()
+        is_async = isinstance(items, abc.AsyncIterable)
+        items = aiter(items) if is_async else iter(items)
+
+        in_flight, completed = {}, {}
+        next_index, next_result, processed = 0, 0, 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(in_flight) < self.batch_size:
+                    try:
+                        item = await anext(items) if is_async else next(items)
+                    except (StopIteration, StopAsyncIteration):
+                        exhausted = True
+                        break
+                    in_flight[asyncio.create_task(self.process(item))] = next_index
+                    next_index += 1
+
+                if not in_flight:
+                    break
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = in_flight.pop(task)
+                    completed[index] = task.result()
+                    processed += 1
+
+                    if not ordered:
+                        yield completed.pop(index)
+
+                while ordered and next_result in completed:
+                    yield completed.pop(next_result)
+                    next_result += 1
+
+                self.logger.debug(f"{processed} items processed, {len(in_flight)} in flight")
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
 
 class StepPipeline:
     """
@@ -1,7 +1,9 @@
 import asyncio
-from collections import abc
+import time
+from collections import abc, deque
 
 from boedb.config import get_logger
+from boedb.metrics import get_metrics
 
 
 class AsyncShutdownQueue(asyncio.Queue):
@@ -27,15 +29,109 @@ class AsyncShutdownQueue(asyncio.Queue):
         await self.put(self.QUEUE_END)
 
 
+class TimedShutdownQueue(AsyncShutdownQueue):
+    """
+    Shutdown queue that records when every item was put. The put time of the last item
+    taken is kept in `last_put_at`, to be read right after getting it, before awaiting.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.put_times = deque()
+        self.last_put_at = None
+
+    def _put(self, item):
+        self.put_times.append(time.perf_counter())
+        super()._put(item)
+
+    def _get(self):
+        self.last_put_at = self.put_times.popleft()
+        return super()._get()
+
+
+class TaskScope:
+    """
+    Owns the tasks created through it, so they can be cancelled together without
+    touching any other task running in the event loop.
+    """
+
+    def __init__(self):
+        self.tasks = set()
+
+    def create_task(self, coro, name=None):
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self.discard)
+        return task
+
+    def discard(self, task):
+        self.tasks.discard(task)
+        # exceptions are propagated through the pipeline queues, but results left in them
+        # when a pipeline fails are never awaited, so they're marked as retrieved here
+        if not task.cancelled():
+            task.exception()
+
+    async def cancel(self):
+        """Cancel every pending task and wait for them to finish."""
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class LoopLagStats:
+    """
+    Delay between a process task being scheduled and starting to run, which is the
+    time the event loop spent busy with something else, eg. CPU-bound work.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, lag):
+        self.count += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+
+    def as_dict(self):
+        mean = self.total / self.count if self.count else 0
+        return {"count": self.count, "mean": round(mean, 4), "max": round(self.max, 4)}
+
+
 class StreamPipelineBaseExecutor:
     """
     Each phase takes the task produced by the phase before it, and awaits the result
     before it operates on it.
+
+    An optional `limiter` semaphore can be shared between executors, even from different
+    pipelines, to bound the number of items they process at once.
+
+    An optional `cpu_executor`, eg. a `ProcessPoolExecutor`, runs the CPU-bound parts
+    of `process` declared with `run_cpu_bound`, so they don't block the event loop.
+
+    Process tasks are owned by the executor's `scope`, so they can be cancelled on failure.
+
+    With `workers`, items are processed by a fixed pool of `concurrency` worker coroutines
+    that put plain results in the output queue instead of a task per item, see
+    `process_jobs_in_workers`.
+
+    Items in flight, process latency, loop lag and output queue depth are recorded per
+    stage, named after the executor class, in the process `metrics`.
     """
 
-    def __init__(self, concurrency):
+    limiter = None
+
+    def __init__(self, concurrency, cpu_executor=None, workers=False):
         self.concurrency = concurrency
+        self.cpu_executor = cpu_executor
+        self.workers = workers
         self.output_queue = AsyncShutdownQueue(maxsize=concurrency)
+        self.loop_lag = LoopLagStats()
+        self.scope = TaskScope()
+        self.metrics = get_metrics()
+        self.stage = self.__class__.__name__
 
     def get_output_queue(self):
         return self.output_queue
@@ -47,12 +143,52 @@ class StreamPipelineBaseExecutor:
         # Base implementation provided for dummy executors
         return item
 
+    async def run_cpu_bound(self, fn, *args):
+        """Return `fn(*args)`, run in the `cpu_executor` if there is one. The function,
+        its arguments and result must be picklable to run in a process pool."""
+        if self.cpu_executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, fn, *args)
+
+    async def run_limited(self, coro, scheduled):
+        lag = time.perf_counter() - scheduled
+        self.loop_lag.record(lag)
+        self.metrics.observe("boedb_stage_loop_lag_seconds", lag, stage=self.stage)
+        if self.limiter is None:
+            return await self.run_measured(coro)
+        async with self.limiter:
+            return await self.run_measured(coro)
+
+    async def run_measured(self, coro):
+        self.metrics.add("boedb_stage_in_flight", 1, stage=self.stage)
+        try:
+            with self.metrics.timer("boedb_stage_process_seconds", stage=self.stage):
+                return await coro
+        except Exception:
+            self.metrics.inc("boedb_stage_errors_total", stage=self.stage)
+            raise
+        finally:
+            self.metrics.add("boedb_stage_in_flight", -1, stage=self.stage)
+
+    async def put_result(self, results_queue, result):
+        await results_queue.put(result)
+        self.metrics.set("boedb_stage_queue_depth", results_queue.qsize(), stage=self.stage)
+
+    def create_process_task(self, coro, name):
+        return self.scope.create_task(self.run_limited(coro, time.perf_counter()), name=name)
+
     async def get_jobs_from_iterable(self, iterable, work_queue):
         for item in iterable:
             await work_queue.put(item)
 
         await work_queue.shutdown()
 
+    async def get_jobs_from_async_iterable(self, aiterable, work_queue):
+        async for item in aiterable:
+            await work_queue.put(item)
+
+        await work_queue.shutdown()
+
     async def get_jobs_from_queue(self, entry_queue, work_queue):
         async for item in entry_queue:
             job = item
@@ -60,7 +196,7 @@ class StreamPipelineBaseExecutor:
             # Await the previous phase's process to obtain the work item.
             # The previous process might have failed, in which case we want to
             # propagate the exception all the way into the results queue.
-            if isinstance(item, asyncio.Task):
+            if isinstance(item, asyncio.Future):
                 try:
                     await item
                     job = item.result()
@@ -90,28 +226,171 @@ class StreamPipelineBaseExecutor:
             # run process in the background immediately. Exceptions will be returned as the
             # task result, and not raised here. Result will be collected by the next phase
             # or the pipeline collector.
-            task = asyncio.create_task(self.process(job), name=self.get_task_name(f"process {job}"))
-            await results_queue.put(task)
+            task = self.create_process_task(self.process(job), self.get_task_name(f"process {job}"))
+            await self.put_result(results_queue, task)
             work_queue.task_done()
 
         await results_queue.shutdown()
 
+    async def process_jobs_in_workers(self, work_queue, results_queue):
+        """
+        Process jobs with `concurrency` long-lived workers, each one taking the next job
+        as soon as it's done with the previous one. Results are put in the results queue
+        as they complete, so they might not keep the order of the jobs.
+
+        Failures are put in the results queue, to be propagated by the next phase. Once
+        there's a failure, remaining jobs are discarded.
+
+        The work queue is a `TimedShutdownQueue`, so loop lag is measured from the time a
+        job could have been taken by a worker.
+        """
+        failed = False
+
+        async def worker():
+            nonlocal failed
+            while True:
+                waiting_since = time.perf_counter()
+                job = await work_queue.get()
+                # the job could start once it was put and the worker was free to take it
+                available_at = max(waiting_since, work_queue.last_put_at)
+                if job is work_queue.QUEUE_END:
+                    work_queue.task_done()
+                    break
+
+                if failed:
+                    work_queue.task_done()
+                    continue
+
+                if isinstance(job, Exception):
+                    result = job
+                else:
+                    try:
+                        result = await self.run_limited(self.process(job), available_at)
+                    except Exception as exc:  # pylint: disable=broad-exception-caught
+                        result = exc
+
+                if isinstance(result, Exception):
+                    failed = True
+                await self.put_result(results_queue, result)
+                work_queue.task_done()
+
+            # the queue end is only received by one worker, so it's passed on to the rest
+            await work_queue.shutdown()
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        await results_queue.shutdown()
+
     async def start(self, entry_queue_or_iterable, results_queue):
         # Concurrency is controlled by getting jobs from the entry queue
         # and adding them to this limited queue. It effectively acts as a
         # buffer to limit the number of process tasks launched.
-        work_queue = AsyncShutdownQueue(maxsize=self.concurrency)
+        # workers measure their loop lag since jobs were put in the queue
+        queue_class = TimedShutdownQueue if self.workers else AsyncShutdownQueue
+        work_queue = queue_class(maxsize=self.concurrency)
 
         if isinstance(entry_queue_or_iterable, abc.Iterable):
             jobs_task = self.get_jobs_from_iterable(entry_queue_or_iterable, work_queue)
-        else:
+        elif isinstance(entry_queue_or_iterable, asyncio.Queue):
             jobs_task = self.get_jobs_from_queue(entry_queue_or_iterable, work_queue)
+        else:
+            # items might be streamed as they're produced, eg. summary entries
+            jobs_task = self.get_jobs_from_async_iterable(entry_queue_or_iterable, work_queue)
 
-        process_task = self.process_jobs(work_queue, results_queue)
+        if self.workers:
+            process_task = self.process_jobs_in_workers(work_queue, results_queue)
+        else:
+            process_task = self.process_jobs(work_queue, results_queue)
 
         return await asyncio.gather(jobs_task, process_task, return_exceptions=True)
 
 
+class BatchingStreamExecutor(StreamPipelineBaseExecutor):
+    """
+    Collects items from the work queue into batches of up to `batch_size` items, waiting
+    at most `max_wait` seconds since the first item of a batch, and processes them
+    together with `process_batch`.
+
+    Every item still gets its own result in the output queue, so the next phase
+    is unaware of the batching.
+    """
+
+    def __init__(self, concurrency, batch_size=None, max_wait=1, cpu_executor=None):
+        super().__init__(concurrency, cpu_executor=cpu_executor)
+        self.batch_size = batch_size or concurrency
+        self.max_wait = max_wait
+
+    async def process_batch(self, items):
+        # Base implementation processes every item concurrently; the batch fails if any item fails
+        return await asyncio.gather(*(self.process(item) for item in items))
+
+    async def collect_batches(self, work_queue):
+        """Yield lists of items from `work_queue`. An exception from the previous
+        phase is yielded on its own after the pending batch, and ends the iteration."""
+        loop = asyncio.get_running_loop()
+        batch, deadline = [], None
+        while True:
+            timeout = None
+            if batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    yield batch
+                    batch = []
+                    continue
+
+            try:
+                item = await asyncio.wait_for(work_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                continue
+            work_queue.task_done()
+
+            if item is work_queue.QUEUE_END or isinstance(item, Exception):
+                if batch:
+                    yield batch
+                if isinstance(item, Exception):
+                    yield item
+                return
+
+            batch.append(item)
+            if len(batch) == 1:
+                deadline = loop.time() + self.max_wait
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+
+    @staticmethod
+    def get_batch_item_result(batch_task, index):
+        """Return a future for the result of the item at `index` of the batch."""
+        result = asyncio.get_running_loop().create_future()
+
+        def set_result(task):
+            if result.done():
+                return
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result()[index])
+
+        batch_task.add_done_callback(set_result)
+        return result
+
+    async def process_jobs(self, work_queue, results_queue):
+        async for batch in self.collect_batches(work_queue):
+            # if the previous phase failed, abort the pipeline and propagate the exception
+            if isinstance(batch, Exception):
+                await results_queue.put(batch)
+                await results_queue.shutdown()
+                return
+
+            name = self.get_task_name(f"process batch of {len(batch)}")
+            task = self.create_process_task(self.process_batch(batch), name)
+            for index in range(len(batch)):
+                await self.put_result(results_queue, self.get_batch_item_result(task, index))
+
+        await results_queue.shutdown()
+
+
 class StreamPipeline:
     """
     Orchestrates the ETL pipeline by streaming items through each phase as they
@@ -124,13 +403,23 @@ class StreamPipeline:
     :param extractor: extract items from entry point into output queue
     :param transformer: transform items from entry queue into output queue
     :param loader: load items from entry queue onto results queue
+    :param limiter: optional semaphore to bound items processed at once by all phases
+
+    Every run owns its tasks: if it fails, or stops being consumed, only its phases and
+    their in-flight process tasks are cancelled, so several pipelines can share a loop.
     """
 
-    def __init__(self, extractor, transformer=None, loader=None):
+    def __init__(self, extractor, transformer=None, loader=None, limiter=None):
         self.extractor = extractor
         self.transformer = transformer
         self.loader = loader
         self.logger = get_logger("boedb.streampipeline")
+        self.scope = TaskScope()
+
+        if limiter is not None:
+            for executor in (extractor, transformer, loader):
+                if executor is not None:
+                    executor.limiter = limiter
 
         # queue size limits the number of results to be stored before pipeline is consumed
         self.results_queue = AsyncShutdownQueue(10)
@@ -157,18 +446,29 @@ class StreamPipeline:
     async def run(self, items):
         # Task needs to be run in the background and not awaited here, so the process items can
         # be generated and awaited in the iteration below
-        run_task = asyncio.create_task(self.run_pipeline(items))
+        run_task = self.scope.create_task(self.run_pipeline(items), name="StreamPipeline run")
 
-        async for item in self.results_queue:
-            if isinstance(item, Exception):
-                await self.shutdown_and_cleanup()
-                raise item
+        try:
+            async for item in self.results_queue:
+                if isinstance(item, Exception):
+                    raise item
+
+                # executors with workers produce plain results, instead of tasks
+                if isinstance(item, asyncio.Future):
+                    await item
+                    item = item.result()
+                yield item
+                self.results_queue.task_done()
+
+            await run_task
+        finally:
+            await self.shutdown_and_cleanup()
 
-            await item
-            yield item.result()
-            self.results_queue.task_done()
+        self.logger.debug(f"Loop lag per stage: {self.get_loop_lag()}")
 
-        await run_task
+    def get_loop_lag(self):
+        stages = {"extractor": self.extractor, "transformer": self.transformer, "loader": self.loader}
+        return {name: stage.loop_lag.as_dict() for name, stage in stages.items() if stage is not None}
 
     async def run_and_collect(self, items):
         results = []
@@ -177,19 +477,9 @@ class StreamPipeline:
         return results
 
     async def shutdown_and_cleanup(self):
-        producing_tasks = {
-            "StreamPipeline.run_pipeline",
-            "StreamPipeline.collect_results",
-            "StreamPipelineBaseExecutor.start",
-            "StreamPipelineBaseExecutor.process_jobs",
-            "StreamPipelineBaseExecutor.get_jobs_from_queue",
-        }
-        for task in asyncio.all_tasks():
-            coro = task.get_coro()
-            name = f"{task.get_name()}({coro.__qualname__})"
-            if coro.__qualname__ in producing_tasks:
-                self.logger.debug(f"Cancelling task {name}")
-                task.cancel()
-            elif not coro.__qualname__.startswith("test"):
-                self.logger.debug(f"Waiting to complete task {name}")
-                await task
+        """Cancel this run's phases, then their in-flight process tasks. Nothing is left
+        to cancel when the run completes."""
+        await self.scope.cancel()
+        for executor in (self.extractor, self.transformer, self.loader):
+            if executor is not None:
+                await executor.scope.cancel()
@@ -52,6 +52,77 @@ async def test_batch_processor_raises_if_process_not_implemented():
         await processor.process_in_batch()
 
 
+@pytest.mark.asyncio
+async def test_batch_processor_sliding_window_keeps_batch_size_in_flight():
+    in_flight, max_in_flight = 0, 0
+
+    async def process(item):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        # the first item is slow, but doesn't hold the others back
+        await asyncio.sleep(0.05 if item == 0 else 0.001)
+        in_flight -= 1
+        return item * 10
+
+    processor = BatchProcessorMixin(3, sliding_window=True)
+    processor.process = process
+    processed = await processor.process_in_batch(range(10))
+
+    assert processed == [item * 10 for item in range(10)]
+    assert max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_batch_processor_window_yields_as_completed():
+    async def process(item):
+        await asyncio.sleep(0.01 * item)
+        return item
+
+    processor = BatchProcessorMixin(3)
+    processor.process = process
+    processed = [result async for result in processor.process_in_window([3, 2, 1])]
+    assert processed == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_batch_processor_window_consumes_generators():
+    def generate():
+        yield from range(5)
+
+    async def generate_async():
+        for item in range(5):
+            yield item
+
+    processor = BatchProcessorMixin(2)
+    processor.process = mock.AsyncMock(side_effect=lambda i: i)
+
+    assert [r async for r in processor.process_in_window(generate(), ordered=True)] == list(range(5))
+    assert [r async for r in processor.process_in_window(generate_async(), ordered=True)] == list(range(5))
+
+
+@pytest.mark.asyncio
+async def test_batch_processor_window_cancels_in_flight_on_error():
+    slow = asyncio.Event()
+    process_tasks = []
+
+    async def process(item):
+        process_tasks.append(asyncio.current_task())
+        if item == 0:
+            raise ValueError()
+        await slow.wait()
+
+    processor = BatchProcessorMixin(3)
+    processor.process = process
+
+    with pytest.raises(ValueError):
+        async for _ in processor.process_in_window(range(3)):
+            pass
+
+    assert len(process_tasks) == 3
+    assert all(task.done() for task in process_tasks)
+
+
 @pytest.mark.asyncio
 async def test_pipeline_runs_etl():
     item = mock.Mock()
@@ -1,10 +1,19 @@
 import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from unittest import mock
 
 import pytest
 
-from boedb.pipelines.stream import AsyncShutdownQueue, StreamPipeline, StreamPipelineBaseExecutor
+from boedb.metrics import InMemorySink, Metrics
+from boedb.pipelines.stream import (
+    AsyncShutdownQueue,
+    BatchingStreamExecutor,
+    LoopLagStats,
+    StreamPipeline,
+    StreamPipelineBaseExecutor,
+)
 
 
 @pytest.mark.asyncio
@@ -135,24 +144,54 @@ async def test_stream_pipeline_run_raises_with_exception():
 
 @pytest.mark.asyncio
 @pytest.mark.integration
-async def test_stream_pipeline_waits_for_tasks_on_shutdown():
+async def test_stream_pipeline_cancels_only_its_tasks_on_shutdown():
     error = ValueError()
+    processing = asyncio.Event()
 
     class FailingPhase(StreamPipelineBaseExecutor):
-        async def process(self, _):
-            raise error
+        async def process(self, item):
+            if item == 1:
+                await processing.wait()
+                raise error
+            processing.set()
+            await asyncio.sleep(10)
 
     pipeline = StreamPipeline(
         extractor=StreamPipelineBaseExecutor(1),
-        transformer=FailingPhase(1),
+        transformer=FailingPhase(2),
         loader=StreamPipelineBaseExecutor(1),
     )
 
+    unrelated_task = asyncio.create_task(asyncio.sleep(10))
     with pytest.raises(ValueError):
-        task = asyncio.create_task(asyncio.sleep(0.01))
         await pipeline.run_and_collect([1, 2, 3])
 
-    assert task.done() is True
+    assert not pipeline.scope.tasks
+    assert not pipeline.transformer.scope.tasks
+    assert not unrelated_task.done()
+    unrelated_task.cancel()
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_stream_pipelines_share_loop_when_one_fails():
+    class FailingPhase(StreamPipelineBaseExecutor):
+        async def process(self, _):
+            raise ValueError()
+
+    class SlowPhase(StreamPipelineBaseExecutor):
+        async def process(self, item):
+            await asyncio.sleep(0.01)
+            return item
+
+    failing = StreamPipeline(StreamPipelineBaseExecutor(1), FailingPhase(1), StreamPipelineBaseExecutor(1))
+    working = StreamPipeline(StreamPipelineBaseExecutor(1), SlowPhase(2), StreamPipelineBaseExecutor(1))
+
+    results = await asyncio.gather(
+        failing.run_and_collect([1, 2, 3]), working.run_and_collect([1, 2, 3]), return_exceptions=True
+    )
+    assert isinstance(results[0], ValueError)
+    assert results[1] == [1, 2, 3]
 
 
 @pytest.mark.asyncio
@@ -166,3 +205,304 @@ async def test_stream_pipeline_run_and_collect_ok():
 
     results = await pipeline.run_and_collect([1, 2, 3])
     assert results == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_batching_executor_collects_batches_by_size():
+    queue = AsyncShutdownQueue()
+    for i in range(5):
+        await queue.put(i)
+    await queue.shutdown()
+
+    executor = BatchingStreamExecutor(10, batch_size=2)
+    batches = [batch async for batch in executor.collect_batches(queue)]
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.asyncio
+async def test_batching_executor_collects_batches_by_max_wait():
+    queue = AsyncShutdownQueue()
+    executor = BatchingStreamExecutor(10, max_wait=0.01)
+    batches = executor.collect_batches(queue)
+
+    await queue.put(1)
+    assert await asyncio.wait_for(anext(batches), 1) == [1]
+
+    await queue.put(2)
+    await queue.shutdown()
+    assert await anext(batches) == [2]
+
+
+@pytest.mark.asyncio
+async def test_batching_executor_yields_exception_after_batch():
+    error = ValueError()
+    queue = AsyncShutdownQueue()
+    await queue.put(1)
+    await queue.put(error)
+
+    executor = BatchingStreamExecutor(10)
+    batches = [batch async for batch in executor.collect_batches(queue)]
+    assert batches == [[1], error]
+
+
+@pytest.mark.asyncio
+async def test_batching_executor_returns_result_per_item():
+    work_queue, results_queue = AsyncShutdownQueue(), AsyncShutdownQueue()
+    for i in range(3):
+        await work_queue.put(i)
+    await work_queue.shutdown()
+
+    executor = BatchingStreamExecutor(10)
+    executor.process_batch = mock.AsyncMock(side_effect=lambda items: [i * 10 for i in items])
+    await executor.process_jobs(work_queue, results_queue)
+
+    results = [await result async for result in results_queue]
+    assert results == [0, 10, 20]
+    executor.process_batch.assert_awaited_once_with([0, 1, 2])
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_stream_pipeline_run_with_batching_executor():
+    batch_sizes = []
+
+    class BatchingPhase(BatchingStreamExecutor):
+        async def process_batch(self, items):
+            batch_sizes.append(len(items))
+            return [item * 10 for item in items]
+
+    pipeline = StreamPipeline(
+        extractor=StreamPipelineBaseExecutor(1),
+        transformer=BatchingPhase(10, batch_size=2, max_wait=0.01),
+        loader=StreamPipelineBaseExecutor(1),
+    )
+
+    results = await pipeline.run_and_collect([1, 2, 3])
+    assert results == [10, 20, 30]
+    assert sum(batch_sizes) == 3
+    assert max(batch_sizes) <= 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_stream_pipeline_run_raises_with_batch_exception():
+    class FailingPhase(BatchingStreamExecutor):
+        async def process_batch(self, items):
+            raise ValueError()
+
+    pipeline = StreamPipeline(
+        extractor=StreamPipelineBaseExecutor(1),
+        transformer=FailingPhase(2),
+        loader=StreamPipelineBaseExecutor(1),
+    )
+
+    with pytest.raises(ValueError):
+        await pipeline.run_and_collect([1, 2, 3])
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_stream_pipeline_run_from_async_iterable():
+    async def produce():
+        for i in range(3):
+            yield i
+
+    pipeline = StreamPipeline(
+        extractor=StreamPipelineBaseExecutor(1),
+        transformer=StreamPipelineBaseExecutor(1),
+        loader=StreamPipelineBaseExecutor(1),
+    )
+
+    results = await pipeline.run_and_collect(produce())
+    assert results == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_stream_pipelines_share_limiter():
+    in_flight = 0
+    max_in_flight = 0
+
+    class TrackingPhase(StreamPipelineBaseExecutor):
+        async def process(self, item):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+            return item
+
+    limiter = asyncio.Semaphore(2)
+
+    def get_pipeline():
+        return StreamPipeline(
+            extractor=TrackingPhase(5),
+            transformer=TrackingPhase(5),
+            loader=TrackingPhase(5),
+            limiter=limiter,
+        )
+
+    results = await asyncio.gather(
+        get_pipeline().run_and_collect(range(10)),
+        get_pipeline().run_and_collect(range(10)),
+    )
+    assert results == [list(range(10)), list(range(10))]
+    assert max_in_flight <= 2
+
+
+def test_loop_lag_stats_summarizes_lags():
+    stats = LoopLagStats()
+    assert stats.as_dict() == {"count": 0, "mean": 0, "max": 0}
+
+    stats.record(0.1)
+    stats.record(0.3)
+    assert stats.as_dict() == {"count": 2, "mean": 0.2, "max": 0.3}
+
+
+@pytest.mark.asyncio
+async def test_executor_runs_cpu_bound_inline_without_executor():
+    executor = StreamPipelineBaseExecutor(1)
+    assert await executor.run_cpu_bound(sum, [1, 2]) == 3
+
+
+@pytest.mark.asyncio
+async def test_executor_runs_cpu_bound_in_process_pool():
+    with ProcessPoolExecutor(1) as cpu_executor:
+        executor = StreamPipelineBaseExecutor(1, cpu_executor=cpu_executor)
+        assert await executor.run_cpu_bound(sum, [1, 2]) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_stream_pipeline_records_loop_lag_per_stage():
+    pipeline = StreamPipeline(
+        extractor=StreamPipelineBaseExecutor(1),
+        transformer=StreamPipelineBaseExecutor(1),
+        loader=StreamPipelineBaseExecutor(1),
+    )
+
+    await pipeline.run_and_collect([1, 2, 3])
+    loop_lag = pipeline.get_loop_lag()
+    assert set(loop_lag) == {"extractor", "transformer", "loader"}
+    assert loop_lag["transformer"]["count"] == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_stream_pipeline_run_with_worker_executors():
+    class SlowFirstPhase(StreamPipelineBaseExecutor):
+        async def process(self, item):
+            await asyncio.sleep(0.02 if item == 1 else 0)
+            return item * 10
+
+    pipeline = StreamPipeline(
+        extractor=StreamPipelineBaseExecutor(2, workers=True),
+        transformer=SlowFirstPhase(2, workers=True),
+        loader=StreamPipelineBaseExecutor(2, workers=True),
+    )
+
+    results = await pipeline.run_and_collect([1, 2, 3])
+    # results are produced as they complete
+    assert results == [20, 30, 10]
+
+
+@pytest.mark.asyncio
+async def test_worker_executor_puts_plain_results():
+    executor = StreamPipelineBaseExecutor(2, workers=True)
+    executor.process = mock.AsyncMock(side_effect=lambda i: i * 10)
+    results_queue = AsyncShutdownQueue()
+
+    await executor.start([1, 2, 3], results_queue)
+
+    assert sorted([result async for result in results_queue]) == [10, 20, 30]
+    assert executor.process.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_worker_executor_propagates_exceptions_and_discards_jobs():
+    error = ValueError()
+    executor = StreamPipelineBaseExecutor(1, workers=True)
+    executor.process = mock.AsyncMock(side_effect=[error, 2, 3])
+    results_queue = AsyncShutdownQueue()
+
+    await executor.start([1, 2, 3], results_queue)
+
+    assert [result async for result in results_queue] == [error]
+    executor.process.assert_awaited_once_with(1)
+
+
+@pytest.mark.asyncio
+async def test_worker_executor_discards_jobs_after_failure_in_any_worker():
+    error = ValueError()
+
+    async def process(item):
+        # the second job is taken before the first one fails, and completes after it
+        await asyncio.sleep({1: 0.01, 2: 0.03}.get(item, 0))
+        if item == 1:
+            raise error
+        return item
+
+    async def items():
+        for item in range(1, 10):
+            yield item
+            await asyncio.sleep(0.005)
+
+    executor = StreamPipelineBaseExecutor(2, workers=True)
+    executor.process = mock.AsyncMock(side_effect=process)
+    results_queue = AsyncShutdownQueue()
+
+    await executor.start(items(), results_queue)
+
+    assert [result async for result in results_queue] == [error, 2]
+    assert [call.args[0] for call in executor.process.await_args_list] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_worker_executor_records_loop_lag_since_jobs_are_put():
+    async def items():
+        # let the worker start waiting for jobs
+        await asyncio.sleep(0.01)
+        yield 1
+        # blocks the loop after the job is put, before the worker can take it
+        time.sleep(0.05)
+        yield 2
+
+    executor = StreamPipelineBaseExecutor(1, workers=True)
+    await executor.start(items(), AsyncShutdownQueue())
+
+    assert executor.loop_lag.count == 2
+    assert executor.loop_lag.max >= 0.05
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_stream_pipeline_run_raises_with_worker_exception():
+    class FailingPhase(StreamPipelineBaseExecutor):
+        async def process(self, _):
+            raise ValueError()
+
+    pipeline = StreamPipeline(
+        extractor=StreamPipelineBaseExecutor(1, workers=True),
+        transformer=FailingPhase(2, workers=True),
+        loader=StreamPipelineBaseExecutor(1, workers=True),
+    )
+
+    with pytest.raises(ValueError):
+        await pipeline.run_and_collect([1, 2, 3])
+
+
+@pytest.mark.asyncio
+async def test_executor_records_stage_metrics():
+    sink = InMemorySink()
+    executor = StreamPipelineBaseExecutor(2, workers=True)
+    executor.metrics = Metrics(sink)
+    executor.process = mock.AsyncMock(side_effect=[1, ValueError()])
+    results_queue = AsyncShutdownQueue()
+
+    await executor.start([1, 2], results_queue)
+
+    stage = "StreamPipelineBaseExecutor"
+    assert sink.get_histogram("boedb_stage_process_seconds", stage=stage).count == 2
+    assert sink.get("boedb_stage_errors_total", stage=stage) == 1
+    assert sink.get("boedb_stage_in_flight", stage=stage) == 0
+    assert sink.get("boedb_stage_queue_depth", stage=stage) == 2
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+from boedb.config import OpenAiConfig, get_logger
+
+
+def get_llm_cache():
+    if hasattr(LLMCache, "_cache"):
+        return LLMCache._cache
+
+    cache = None
+    if OpenAiConfig.CACHE_PATH:
+        cache = LLMCache(OpenAiConfig.CACHE_PATH, OpenAiConfig.CACHE_MAX_SIZE)
+    LLMCache._cache = cache
+    return cache
+
+
+class LLMCache:
+    """
+    Persistent content-addressed cache for LLM results, stored in a SQLite file.
+
+    Entries are keyed by a hash of the model, input and max tokens of the request.
+    Once stored values exceed `max_size` bytes, the least recently used entries are
+    evicted down to `evict_ratio` of the max size.
+
+    Lookups are on the event loop, so they only read: access times of hits are kept
+    in memory, and written along with the next value stored, before evicting, or
+    once `touch_batch_size` are pending.
+    """
+
+    def __init__(self, path, max_size, evict_ratio=0.9, touch_batch_size=100):
+        self.path = path
+        self.max_size = max_size
+        self.evict_ratio = evict_ratio
+        self.touch_batch_size = touch_batch_size
+        self.touched = {}
+        self.hits = 0
+        self.misses = 0
+        self.logger = get_logger("boedb.llm_cache")
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("pragma journal_mode = wal")
+        self.conn.execute("pragma synchronous = normal")
+        self.conn.execute(
+            """
+            create table if not exists llm_cache (
+                key text primary key,
+                value text not null,
+                size integer not null,
+                accessed real not null
+            )
+            """
+        )
+        self.conn.execute("create index if not exists llm_cache_accessed_idx on llm_cache(accessed)")
+        self.conn.commit()
+        self.size = self.conn.execute("select coalesce(sum(size), 0) from llm_cache").fetchone()[0]
+
+    @staticmethod
+    def get_key(model, data, max_tokens=None):
+        content = json.dumps([model, data, max_tokens], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("select value from llm_cache where key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.touched[key] = time.time()
+        if len(self.touched) >= self.touch_batch_size:
+            self.write_touched()
+            self.conn.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def write_touched(self):
+        """Write the pending access times, to be committed by the caller."""
+        if self.touched:
+            self.conn.executemany(
+                "update llm_cache set accessed = ? where key = ?",
+                [(accessed, key) for key, accessed in self.touched.items()],
+            )
+            self.touched.clear()
+
+    def set(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data)
+
+        # written first, so they don't override the access time of the value stored
+        self.write_touched()
+        row = self.conn.execute("select size from llm_cache where key = ?", (key,)).fetchone()
+        self.conn.execute(
+            "insert or replace into llm_cache (key, value, size, accessed) values (?, ?, ?, ?)",
+            (key, data, size, time.time()),
+        )
+        self.conn.commit()
+        self.size += size - (row[0] if row else 0)
+
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        target_size = self.max_size * self.evict_ratio
+        evicted = []
+        self.write_touched()
+        # entries are read as they're needed, not the whole cache
+        cursor = self.conn.execute("select key, size from llm_cache order by accessed")
+        for key, size in cursor:
+            if self.size <= target_size:
+                break
+            evicted.append((key,))
+            self.size -= size
+        cursor.close()
+
+        self.conn.executemany("delete from llm_cache where key = ?", evicted)
+        self.conn.commit()
+        self.logger.debug(f"Evicted {len(evicted)} entries ({self.size} bytes cached)")
+
+    def stats(self):
+        entries = self.conn.execute("select count(*) from llm_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "size": self.size}
+
+    def close(self):
+        self.write_touched()
+        self.conn.commit()
+        self.conn.close()
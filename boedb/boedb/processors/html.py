@@ -1,5 +1,15 @@
+import re
+from html import unescape
 from html.parser import HTMLParser
 
+# start and end tags, with quoted attribute values that might contain `>`
+TAG_RE = re.compile(r"""<(/?)([a-zA-Z][^\t\n\r\f />\x00]*)((?:[^>"']|"[^"]*"|'[^']*')*)>""")
+TAG_OPEN_RE = re.compile(r"</?[a-zA-Z]")
+
+# markup the tokenizer doesn't handle: comments, declarations, processing instructions,
+# bogus end tags like `</ x>`, and elements whose content is not parsed as html
+PARSER_ONLY_RE = re.compile(r"<[!?]|</(?![a-zA-Z])|<(?:script|style|textarea|title)\b", re.IGNORECASE)
+
 
 class HTMLFilter(HTMLParser):
     """
@@ -7,6 +17,10 @@ class HTMLFilter(HTMLParser):
       - `REMOVE_TAGS` are removed from the content entirely
       - `INDENT_TAGS` have an indented hyphen appended
       - `PARAGRAPH_TAGS` add a breakline
+
+    Text is collected in a list and joined once, so cleaning is linear in the size of
+    the document. Documents with just tags and text, like BOE's, are tokenized with a
+    regex instead of going through `HTMLParser`, see `feed_tokens`.
     """
 
     REMOVE_TAGS = {"table", "tr", "td"}
@@ -15,20 +29,24 @@ class HTMLFilter(HTMLParser):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.text = ""
+        self.parts = []
         self.indent = 0
         self.remove_elems = 0
 
+    @property
+    def text(self):
+        return "".join(self.parts)
+
     def handle_starttag(self, tag, attrs):
         if tag in HTMLFilter.REMOVE_TAGS:
             self.remove_elems += 1
 
         if tag in HTMLFilter.INDENT_TAGS:
             self.indent += 1
-            self.text += f"\n{'  ' * self.indent}- "
+            self.parts.append(f"\n{'  ' * self.indent}- ")
 
         if tag in HTMLFilter.PARAGRAPH_TAGS:
-            self.text += "\n"
+            self.parts.append("\n")
 
     def handle_endtag(self, tag):
         if tag in HTMLFilter.REMOVE_TAGS:
@@ -39,10 +57,51 @@ class HTMLFilter(HTMLParser):
 
     def handle_data(self, data):
         if not self.remove_elems:
-            self.text += data
+            self.parts.append(data)
+
+    @staticmethod
+    def can_tokenize(html):
+        """Return whether `html` only has markup `feed_tokens` handles the same as `HTMLParser`:
+        every tag must be matched by the tokenizer, otherwise it's malformed."""
+        if PARSER_ONLY_RE.search(html):
+            return False
+        return len(TAG_OPEN_RE.findall(html)) == len(TAG_RE.findall(html))
+
+    def feed_tokens(self, html):
+        """Feed `html` to the handlers, tokenized with `TAG_RE`. Attributes are not parsed,
+        as no handler uses them."""
+        pos = 0
+        for match in TAG_RE.finditer(html):
+            if match.start() > pos:
+                data = html[pos : match.start()]
+                self.handle_data(unescape(data) if "&" in data else data)
+            pos = match.end()
+
+            is_end, tag, attrs = match.groups()
+            tag = tag.lower()
+            if is_end:
+                self.handle_endtag(tag)
+                continue
+
+            self.handle_starttag(tag, [])
+            if attrs.endswith("/"):
+                self.handle_endtag(tag)
+
+        if pos < len(html):
+            data = html[pos:]
+            self.handle_data(unescape(data) if "&" in data else data)
 
     @classmethod
     def clean_html(cls, html):
         html_filter = cls()
-        html_filter.feed(html)
+        if cls.can_tokenize(html):
+            html_filter.feed_tokens(html)
+        else:
+            html_filter.feed(html)
         return html_filter.text.strip()
+
+    @classmethod
+    def clean_html_many(cls, htmls):
+        """Return the clean text of every document in `htmls`, so a batch of documents can be
+        cleaned in a single call, eg. in a process pool."""
+        return [cls.clean_html(html) for html in htmls]
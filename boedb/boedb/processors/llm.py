@@ -1,28 +1,250 @@
 import asyncio
+import base64
 import logging
+import re
+import sys
 import time
+from array import array
 
 from boedb.client import HttpClient
 from boedb.config import OpenAiConfig
+from boedb.metrics import get_metrics
+from boedb.processors.cache import get_llm_cache
 
 COMPLETION_MODEL_NAME = "gpt-3.5-turbo-16k"
 EMEDDINGS_MODEL_NAME = "text-embedding-ada-002"
 BASE_URL = "https://api.openai.com/v1"
 
 
+def estimate_tokens(text):
+    # spanish text averages over 3 characters per token, so this errs on the safe side
+    return len(text) // 3 + 1
+
+
+def estimate_prompt_tokens(prompt, max_tokens=None):
+    # completion tokens count against the limit as requested, not as generated
+    return sum(estimate_tokens(message["content"]) for message in prompt) + (max_tokens or 0)
+
+
+def parse_reset_time(time_str):
+    """Return the seconds in a rate limit reset period, such as `1m30s` or `250ms`."""
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    periods = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", time_str or "")
+    return sum(float(amount) * units[unit] for amount, unit in periods)
+
+
+def decode_embedding(value):
+    """Return an embedding as a compact float32 `array`, from either the base64 encoded
+    little endian floats requested from the API and cached, or a list of floats."""
+    if isinstance(value, str):
+        embedding = array("f", base64.b64decode(value))
+        if sys.byteorder == "big":
+            embedding.byteswap()
+        return embedding
+    return array("f", value)
+
+
+def encode_embedding(embedding):
+    """Return an embedding as base64 encoded little endian floats, as the API sends them."""
+    if sys.byteorder == "big":
+        embedding = array("f", embedding)
+        embedding.byteswap()
+    return base64.b64encode(embedding).decode("ascii")
+
+
+RATE_LIMITERS = {}
+
+
+def get_rate_limiter(model):
+    if model not in RATE_LIMITERS:
+        RATE_LIMITERS[model] = RateLimiter(model)
+    return RATE_LIMITERS[model]
+
+
+class TokenBucket:
+    """
+    Bucket continuously refilled up to its `capacity` at `rate` units per second.
+    Capacity is unknown until the first update, and until then nothing is limited.
+    A capacity of 0 means there's no limit, and nothing is limited either.
+    """
+
+    def __init__(self):
+        self.capacity = None
+        self.rate = None
+        self.level = None
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_wait_time(self, amount):
+        self.refill()
+        if self.capacity is None:
+            return 0
+
+        # a single request larger than the bucket can only wait for it to be full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        if self.capacity is not None:
+            self.level -= amount
+
+    def update(self, capacity, remaining, reset_seconds):
+        self.refill()
+        if capacity <= 0:
+            # an empty bucket never refills, its wait time would divide by a zero rate
+            self.capacity = self.rate = self.level = None
+            return
+
+        self.capacity = capacity
+        self.level = remaining
+        # the bucket is full again after the reset period
+        if reset_seconds > 0 and remaining < capacity:
+            self.rate = (capacity - remaining) / reset_seconds
+        else:
+            self.rate = capacity / 60
+
+
+class RateLimiter:
+    """
+    Admits requests to a model only while its request and token limits have room
+    for them, so they wait here instead of failing with 429 and backing off.
+
+    Limits are tracked from the `x-ratelimit-*` headers of every response.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.logger = logging.getLogger("boedb.openai")
+
+    async def acquire(self, tokens):
+        while wait_time := max(self.requests.get_wait_time(1), self.tokens.get_wait_time(tokens)):
+            self.logger.debug(f"Waiting {wait_time:.2f}s for {self.model} rate limit ({tokens} tokens)")
+            await asyncio.sleep(wait_time)
+
+        self.requests.consume(1)
+        self.tokens.consume(tokens)
+
+    def update(self, response):
+        headers = response.headers
+        for bucket, limit_type in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = headers.get(f"x-ratelimit-limit-{limit_type}")
+            remaining = headers.get(f"x-ratelimit-remaining-{limit_type}")
+            if limit is None or remaining is None:
+                continue
+
+            reset = parse_reset_time(headers.get(f"x-ratelimit-reset-{limit_type}"))
+            bucket.update(int(limit), int(remaining), reset)
+
+
+class EmbeddingsAccumulator:
+    """
+    Coalesces concurrent embeddings requests into a single batched request, sent when
+    it reaches `max_inputs` texts or `max_tokens` estimated tokens, or `max_wait`
+    seconds after its first text was added.
+    """
+
+    def __init__(self, client, max_inputs, max_tokens, max_wait):
+        self.client = client
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait
+
+        self.pending = []
+        self.pending_tokens = 0
+        self.flush_timer = None
+        self.flush_tasks = set()
+
+    async def get_embeddings(self, text):
+        tokens = estimate_tokens(text)
+        if self.pending and self.pending_tokens + tokens > self.max_tokens:
+            self.flush()
+
+        loop = asyncio.get_running_loop()
+        embeddings = loop.create_future()
+        self.pending.append((text, embeddings))
+        self.pending_tokens += tokens
+
+        if len(self.pending) >= self.max_inputs:
+            self.flush()
+        elif self.flush_timer is None:
+            self.flush_timer = loop.call_later(self.max_wait, self.flush)
+
+        return await embeddings
+
+    def flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+
+        batch, self.pending, self.pending_tokens = self.pending, [], 0
+        if batch:
+            task = asyncio.create_task(self.send(batch))
+            self.flush_tasks.add(task)
+            task.add_done_callback(self.flush_tasks.discard)
+
+    async def send(self, batch):
+        try:
+            results = await self.client.get_embeddings_many([text for text, _ in batch])
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            for _, embeddings in batch:
+                if not embeddings.done():
+                    embeddings.set_exception(exc)
+            return
+
+        for (_, embeddings), result in zip(batch, results):
+            if not embeddings.done():
+                embeddings.set_result(result)
+
+
 class OpenAiClient:
-    def __init__(self, http_session):
+    def __init__(self, http_session, batch_embeddings=False):
         headers = {"Authorization": f"Bearer {OpenAiConfig.API_KEY}"}
         self.client = HttpClient(
             http_session, BASE_URL, headers=headers, timeout=OpenAiConfig.REQUEST_TIMEOUT
         )
         self.logger = logging.getLogger("boedb.openai")
         self.total_tokens = 0
+        self.cache = get_llm_cache()
+        self.metrics = get_metrics()
+
+        self.embeddings_accumulator = None
+        if batch_embeddings:
+            self.embeddings_accumulator = EmbeddingsAccumulator(
+                self,
+                OpenAiConfig.EMBEDDINGS_BATCH_SIZE,
+                OpenAiConfig.EMBEDDINGS_BATCH_MAX_TOKENS,
+                OpenAiConfig.EMBEDDINGS_BATCH_MAX_WAIT,
+            )
+
+    async def post(self, endpoint, payload, rate_limiter=None, tokens=0):
+        if rate_limiter is None:
+            return await self.client.post(endpoint, payload)
 
-    async def post(self, endpoint, payload):
-        return await self.client.post(endpoint, payload)
+        await rate_limiter.acquire(tokens)
+        return await self.client.post(endpoint, payload, response_hook=rate_limiter.update)
+
+    def record_usage(self, model, data):
+        tokens = data["usage"]["total_tokens"]
+        self.total_tokens += tokens
+        self.metrics.inc("boedb_llm_tokens_total", tokens, model=model)
+        return tokens
 
     async def complete(self, prompt, max_tokens=None):
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.get_key(COMPLETION_MODEL_NAME, prompt, max_tokens)
+            if (completion := self.cache.get(cache_key)) is not None:
+                return completion
+
         endpoint = f"{BASE_URL}/chat/completions"
         payload = {
             "model": COMPLETION_MODEL_NAME,
@@ -30,27 +252,83 @@ class OpenAiClient:
             "max_tokens": max_tokens,
         }
 
-        data = await self.post(endpoint, payload)
+        rate_limiter = get_rate_limiter(COMPLETION_MODEL_NAME)
+        tokens = estimate_prompt_tokens(prompt, max_tokens)
+        data = await self.post(endpoint, payload, rate_limiter, tokens)
 
-        tokens = data["usage"]["total_tokens"]
-        self.total_tokens += tokens
+        tokens = self.record_usage(COMPLETION_MODEL_NAME, data)
         self.logger.debug(f"Used {tokens} tokens ({self.total_tokens} this run).")
 
         if choices := data.get("choices"):
-            return choices[0]["message"]["content"].strip('"')
+            completion = choices[0]["message"]["content"].strip('"')
+            if cache_key is not None:
+                self.cache.set(cache_key, completion)
+            return completion
 
     async def get_embeddings(self, text):
+        if self.embeddings_accumulator is not None:
+            return await self.embeddings_accumulator.get_embeddings(text)
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.get_key(EMEDDINGS_MODEL_NAME, text)
+            if (embeddings := self.cache.get(cache_key)) is not None:
+                return decode_embedding(embeddings)
+
+        # base64 encoded floats are decoded straight into a float32 array,
+        # instead of a list of python floats
         endpoint = f"{BASE_URL}/embeddings"
         payload = {
             "input": text,
             "model": EMEDDINGS_MODEL_NAME,
+            "encoding_format": "base64",
         }
 
-        data = await self.post(endpoint, payload)
+        rate_limiter = get_rate_limiter(EMEDDINGS_MODEL_NAME)
+        data = await self.post(endpoint, payload, rate_limiter, estimate_tokens(text))
 
-        tokens = data["usage"]["total_tokens"]
-        self.total_tokens += tokens
+        tokens = self.record_usage(EMEDDINGS_MODEL_NAME, data)
         self.logger.debug(f"Used {tokens} tokens ({self.total_tokens} this run).")
 
         if data := data.get("data"):
-            return data[0]["embedding"]
+            embeddings = decode_embedding(data[0]["embedding"])
+            if cache_key is not None:
+                self.cache.set(cache_key, encode_embedding(embeddings))
+            return embeddings
+
+    async def get_embeddings_many(self, texts):
+        texts = list(texts)
+        embeddings = [None] * len(texts)
+        cache_keys = [None] * len(texts)
+        if self.cache is not None:
+            for idx, text in enumerate(texts):
+                cache_keys[idx] = self.cache.get_key(EMEDDINGS_MODEL_NAME, text)
+                if (cached := self.cache.get(cache_keys[idx])) is not None:
+                    embeddings[idx] = decode_embedding(cached)
+
+        # only request the texts missing from cache
+        missing = [idx for idx, emb in enumerate(embeddings) if emb is None]
+        if not missing:
+            return embeddings
+
+        endpoint = f"{BASE_URL}/embeddings"
+        payload = {
+            "input": [texts[idx] for idx in missing],
+            "model": EMEDDINGS_MODEL_NAME,
+            "encoding_format": "base64",
+        }
+
+        rate_limiter = get_rate_limiter(EMEDDINGS_MODEL_NAME)
+        tokens = sum(estimate_tokens(text) for text in payload["input"])
+        data = await self.post(endpoint, payload, rate_limiter, tokens)
+
+        tokens = self.record_usage(EMEDDINGS_MODEL_NAME, data)
+        self.logger.debug(f"Used {tokens} tokens for {len(missing)} inputs ({self.total_tokens} this run).")
+
+        # results are not guaranteed to be in input order
+        results = sorted(data.get("data") or [], key=lambda result: result["index"])
+        for idx, result in zip(missing, results):
+            embeddings[idx] = decode_embedding(result["embedding"])
+            if cache_keys[idx] is not None:
+                self.cache.set(cache_keys[idx], encode_embedding(embeddings[idx]))
+        return embeddings
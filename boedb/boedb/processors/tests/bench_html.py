@@ -0,0 +1,84 @@
+"""
+Benchmark `HTMLFilter` against the previous implementation, which grew its text by
+concatenation and always went through `HTMLParser`, on the articles in the fixtures.
+
+    python -m boedb.processors.tests.bench_html [repeat]
+"""
+import sys
+import timeit
+from html.parser import HTMLParser
+from pathlib import Path
+from xml.etree import ElementTree
+
+from boedb.processors.html import HTMLFilter
+from boedb.processors.xml import node_text_content
+
+FIXTURES_PATH = Path(__file__).parent.parent.parent / "diario_boe" / "tests" / "fixtures"
+
+
+class ConcatHTMLFilter(HTMLParser):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.text = ""
+        self.indent = 0
+        self.remove_elems = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTMLFilter.REMOVE_TAGS:
+            self.remove_elems += 1
+
+        if tag in HTMLFilter.INDENT_TAGS:
+            self.indent += 1
+            self.text += f"\n{'  ' * self.indent}- "
+
+        if tag in HTMLFilter.PARAGRAPH_TAGS:
+            self.text += "\n"
+
+    def handle_endtag(self, tag):
+        if tag in HTMLFilter.REMOVE_TAGS:
+            self.remove_elems -= 1
+
+        if tag in HTMLFilter.INDENT_TAGS:
+            self.indent -= 1
+
+    def handle_data(self, data):
+        if not self.remove_elems:
+            self.text += data
+
+    @classmethod
+    def clean_html(cls, html):
+        html_filter = cls()
+        html_filter.feed(html)
+        return html_filter.text.strip()
+
+
+def parser_clean_html(html):
+    html_filter = HTMLFilter()
+    html_filter.feed(html)
+    return html_filter.text.strip()
+
+
+def get_fixture_articles():
+    for path in sorted(FIXTURES_PATH.glob("BOE-[AB]-*.xml")):
+        root = ElementTree.parse(path).getroot()
+        yield path.stem, node_text_content(root.find("./texto"))
+
+
+def main(repeat=20):
+    cleaners = {
+        "concat parser": ConcatHTMLFilter.clean_html,
+        "buffered parser": parser_clean_html,
+        "tokenizer": HTMLFilter.clean_html,
+    }
+
+    for name, html in get_fixture_articles():
+        expected = ConcatHTMLFilter.clean_html(html)
+        print(f"{name} ({len(html) // 1024}KB)")
+        for cleaner_name, cleaner in cleaners.items():
+            assert cleaner(html) == expected, f"{cleaner_name} output differs"
+            seconds = min(timeit.repeat(lambda c=cleaner: c(html), number=1, repeat=repeat))
+            print(f"  {cleaner_name:<16} {seconds * 1000:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
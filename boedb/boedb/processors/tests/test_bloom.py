@@ -0,0 +1,22 @@
+from boedb.processors.bloom import BloomFilter
+
+
+def test_bloom_filter_finds_added_keys():
+    keys = [f"BOE-A-2023-{i}" for i in range(1000)]
+    bloom = BloomFilter.from_keys(keys, capacity=len(keys))
+
+    assert all(key in bloom for key in keys)
+    assert len(bloom) == 1000
+
+
+def test_bloom_filter_false_positives_within_error_rate():
+    bloom = BloomFilter.from_keys((f"BOE-A-2023-{i}" for i in range(1000)), capacity=1000, error_rate=0.01)
+
+    false_positives = sum(f"BOE-B-2023-{i}" in bloom for i in range(10000))
+    assert false_positives < 10000 * 0.02
+
+
+def test_bloom_filter_size_depends_on_capacity():
+    bloom = BloomFilter(capacity=1_000_000, error_rate=0.001)
+    assert len(bloom.bits) < 2 * 1024**2
+    assert bloom.n_hashes == 10
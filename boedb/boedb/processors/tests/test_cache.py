@@ -0,0 +1,108 @@
+import sqlite3
+from unittest import mock
+
+import pytest
+
+from boedb.processors.cache import LLMCache, get_llm_cache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMCache(tmp_path / "cache.sqlite3", max_size=1000)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def reset_llm_cache():
+    if hasattr(LLMCache, "_cache"):
+        del LLMCache._cache
+    yield
+    if hasattr(LLMCache, "_cache"):
+        del LLMCache._cache
+
+
+@mock.patch("boedb.processors.cache.OpenAiConfig.CACHE_PATH", None)
+def test_get_llm_cache_is_disabled_without_path(reset_llm_cache):
+    assert get_llm_cache() is None
+
+
+def test_get_llm_cache_returns_singleton(reset_llm_cache, tmp_path):
+    with mock.patch("boedb.processors.cache.OpenAiConfig.CACHE_PATH", tmp_path / "cache.sqlite3"):
+        ins1 = get_llm_cache()
+        ins2 = get_llm_cache()
+
+    assert isinstance(ins1, LLMCache)
+    assert ins1 is ins2
+    ins1.close()
+
+
+def test_llm_cache_key_depends_on_all_inputs():
+    key = LLMCache.get_key("model", "input", 10)
+    assert key == LLMCache.get_key("model", "input", 10)
+    assert key != LLMCache.get_key("model2", "input", 10)
+    assert key != LLMCache.get_key("model", "input2", 10)
+    assert key != LLMCache.get_key("model", "input", 11)
+
+
+def test_llm_cache_gets_set_values(cache):
+    key = cache.get_key("model", [{"role": "user", "content": "prompt"}], 10)
+    assert cache.get(key) is None
+
+    cache.set(key, [0.1, 0.2])
+    assert cache.get(key) == [0.1, 0.2]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_llm_cache_persists_values(tmp_path):
+    key = LLMCache.get_key("model", "input")
+    cache = LLMCache(tmp_path / "cache.sqlite3", max_size=1000)
+    cache.set(key, "completion")
+    cache.close()
+
+    cache = LLMCache(tmp_path / "cache.sqlite3", max_size=1000)
+    assert cache.get(key) == "completion"
+    assert cache.size == len('"completion"')
+    cache.close()
+
+
+def test_llm_cache_evicts_least_recently_used(cache):
+    keys = [cache.get_key("model", str(i)) for i in range(3)]
+    cache.set(keys[0], "x" * 400)
+    cache.set(keys[1], "x" * 400)
+    cache.get(keys[0])
+    cache.set(keys[2], "x" * 400)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.stats()["entries"] == 2
+    assert cache.size <= cache.max_size
+
+
+def test_llm_cache_writes_access_times_in_batches(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    keys = [LLMCache.get_key("model", str(i)) for i in range(3)]
+    cache = LLMCache(path, max_size=1000, touch_batch_size=2)
+    for key in keys:
+        cache.set(key, "value")
+
+    def get_accessed():
+        reader = sqlite3.connect(path)
+        rows = dict(reader.execute("select key, accessed from llm_cache").fetchall())
+        reader.close()
+        return rows
+
+    stored = get_accessed()
+    cache.get(keys[0])
+    # hits don't write until a batch of access times is pending
+    assert not cache.conn.in_transaction
+    assert get_accessed() == stored
+
+    cache.get(keys[1])
+    accessed = get_accessed()
+    assert accessed[keys[0]] > stored[keys[0]] and accessed[keys[1]] > stored[keys[1]]
+
+    cache.get(keys[2])
+    cache.close()
+    assert get_accessed()[keys[2]] > stored[keys[2]]
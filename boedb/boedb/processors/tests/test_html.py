@@ -46,3 +46,42 @@ def test_htmlfilter_indents_lists():
     text = HTMLFilter.clean_html(content)
     assert "  - item1" in text
     assert "    - item2.1" in text
+
+
+def parser_clean_html(html):
+    html_filter = HTMLFilter()
+    html_filter.feed(html)
+    return html_filter.text.strip()
+
+
+def test_htmlfilter_tokenizer_matches_parser():
+    content = """
+        <P class="parrafo">a &amp; b &lt;c&gt; d < e</P>
+        <p title="x > y">content<br/>line</p>
+        <table><tr><td class='t'>cell</td></tr></table>
+        <ul><li>item</li></ul>tail &aacute;
+    """
+
+    assert HTMLFilter.can_tokenize(content)
+    text = HTMLFilter.clean_html(content)
+    assert text == parser_clean_html(content)
+    assert "a & b <c> d < e" in text
+    assert "content\nline" in text
+
+
+def test_htmlfilter_falls_back_to_parser():
+    assert not HTMLFilter.can_tokenize("<p>content<!-- <table> --></p>")
+    assert not HTMLFilter.can_tokenize("<style>p { color: red }</style><p>content</p>")
+    assert not HTMLFilter.can_tokenize('<p>content</p><p class="unclosed>')
+    assert not HTMLFilter.can_tokenize("<p>content</ p></p>")
+
+    content = "<p>content<!-- <p>comment</p> --></p>"
+    assert HTMLFilter.clean_html(content) == "content"
+
+    content = "<p>content</ p> and more</p>"
+    assert HTMLFilter.clean_html(content) == parser_clean_html(content)
+
+
+def test_htmlfilter_cleans_many():
+    contents = ["<p>content1</p>", "<table>table</table><p>content2</p>"]
+    assert HTMLFilter.clean_html_many(contents) == ["content1", "content2"]
@@ -1,3 +1,7 @@
+import asyncio
+import base64
+import struct
+from array import array
 from unittest import mock
 
 import pytest
@@ -5,7 +9,17 @@ from aioresponses import aioresponses
 
 from boedb.client import get_http_client_session
 from boedb.config import OpenAiConfig
-from boedb.processors.llm import OpenAiClient
+from boedb.processors.cache import LLMCache
+from boedb.processors.llm import (
+    EmbeddingsAccumulator,
+    OpenAiClient,
+    RateLimiter,
+    TokenBucket,
+    decode_embedding,
+    encode_embedding,
+    estimate_prompt_tokens,
+    parse_reset_time,
+)
 
 
 @pytest.mark.asyncio
@@ -33,7 +47,7 @@ async def test_open_ai_client_post(HttpClientMock, api_key, http_session_mock):
 async def test_open_ai_client_completes_returns_completion(api_key):
     endpoint = "https://api.openai.com/v1/chat/completions"
     test_completion = "test completion"
-    test_response = {"choices": [{"message": {"content": test_completion}}]}
+    test_response = {"choices": [{"message": {"content": test_completion}}], "usage": {"total_tokens": 1}}
     test_prompt = [{"role": "user", "content": "test prompt"}]
     test_max_tokens = 100
     payload = {
@@ -51,7 +65,7 @@ async def test_open_ai_client_completes_returns_completion(api_key):
             completion = await client.complete(test_prompt, max_tokens=test_max_tokens)
 
     assert completion == test_completion
-    client_post_mock.assert_awaited_once_with(endpoint, payload)
+    client_post_mock.assert_awaited_once_with(endpoint, payload, mock.ANY, mock.ANY)
 
 
 @pytest.mark.asyncio
@@ -59,11 +73,13 @@ async def test_open_ai_client_completes_returns_completion(api_key):
 async def test_open_ai_client_get_embeddings(api_key):
     endpoint = "https://api.openai.com/v1/embeddings"
     test_input = "text"
-    test_embeddings = [0.1, 0.2, 0.3]
-    test_response = {"data": [{"embedding": test_embeddings}]}
+    test_embeddings = [0.5, 0.25, 0.125]
+    encoded_embeddings = base64.b64encode(struct.pack("<3f", *test_embeddings)).decode()
+    test_response = {"data": [{"embedding": encoded_embeddings}], "usage": {"total_tokens": 1}}
     payload = {
         "input": test_input,
         "model": "text-embedding-ada-002",
+        "encoding_format": "base64",
     }
 
     http_session = get_http_client_session()
@@ -74,5 +90,240 @@ async def test_open_ai_client_get_embeddings(api_key):
             mock_server.post(endpoint, status=201, payload=test_response)
             embeddings = await client.get_embeddings(test_input)
 
-    assert embeddings == test_embeddings
-    client_post_mock.assert_awaited_once_with(endpoint, payload)
+    assert embeddings == array("f", test_embeddings)
+    client_post_mock.assert_awaited_once_with(endpoint, payload, mock.ANY, mock.ANY)
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.config.OpenAiConfig.API_KEY")
+async def test_open_ai_client_get_embeddings_many(api_key):
+    endpoint = "https://api.openai.com/v1/embeddings"
+    test_input = ["text1", "text2"]
+    test_response = {
+        "data": [{"index": 1, "embedding": [0.25]}, {"index": 0, "embedding": [0.5]}],
+        "usage": {"total_tokens": 4},
+    }
+    payload = {
+        "input": test_input,
+        "model": "text-embedding-ada-002",
+        "encoding_format": "base64",
+    }
+
+    async with get_http_client_session() as http_session:
+        client = OpenAiClient(http_session=http_session)
+
+        with aioresponses() as mock_server:
+            with mock.patch.object(client, "post", wraps=client.post) as client_post_mock:
+                mock_server.post(endpoint, status=200, payload=test_response)
+                embeddings = await client.get_embeddings_many(test_input)
+
+    assert embeddings == [array("f", [0.5]), array("f", [0.25])]
+    assert client.total_tokens == 4
+    client_post_mock.assert_awaited_once_with(endpoint, payload, mock.ANY, mock.ANY)
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.config.OpenAiConfig.API_KEY")
+async def test_open_ai_client_batches_embeddings(api_key, http_session_mock):
+    client = OpenAiClient(http_session=http_session_mock, batch_embeddings=True)
+    with mock.patch.object(client, "get_embeddings_many") as many_mock:
+        many_mock.return_value = [[0.1], [0.2]]
+        embeddings = await asyncio.gather(client.get_embeddings("text1"), client.get_embeddings("text2"))
+
+    assert embeddings == [[0.1], [0.2]]
+    many_mock.assert_awaited_once_with(["text1", "text2"])
+
+
+@pytest.mark.asyncio
+async def test_embeddings_accumulator_flushes_on_max_inputs():
+    client = mock.AsyncMock()
+    client.get_embeddings_many.side_effect = lambda texts: [[len(t)] for t in texts]
+    accumulator = EmbeddingsAccumulator(client, max_inputs=2, max_tokens=1000, max_wait=10)
+
+    texts = ["a", "bb"]
+    embeddings = await asyncio.wait_for(asyncio.gather(*(accumulator.get_embeddings(t) for t in texts)), 1)
+
+    assert embeddings == [[1], [2]]
+    client.get_embeddings_many.assert_awaited_once_with(["a", "bb"])
+
+
+@pytest.mark.asyncio
+async def test_embeddings_accumulator_flushes_on_max_tokens():
+    client = mock.AsyncMock()
+    client.get_embeddings_many.side_effect = lambda texts: [[len(t)] for t in texts]
+    accumulator = EmbeddingsAccumulator(client, max_inputs=10, max_tokens=5, max_wait=0.01)
+
+    texts = ["a" * 9, "b" * 9]
+    embeddings = await asyncio.gather(*(accumulator.get_embeddings(t) for t in texts))
+
+    assert embeddings == [[9], [9]]
+    client.get_embeddings_many.assert_has_awaits([mock.call([texts[0]]), mock.call([texts[1]])])
+
+
+@pytest.mark.asyncio
+async def test_embeddings_accumulator_propagates_errors():
+    client = mock.AsyncMock()
+    client.get_embeddings_many.side_effect = ValueError()
+    accumulator = EmbeddingsAccumulator(client, max_inputs=10, max_tokens=1000, max_wait=0.01)
+
+    with pytest.raises(ValueError):
+        await accumulator.get_embeddings("text")
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.config.OpenAiConfig.API_KEY")
+async def test_open_ai_client_completes_from_cache(api_key, http_session_mock, tmp_path):
+    prompt = [{"role": "user", "content": "test prompt"}]
+    cache = LLMCache(tmp_path / "cache.sqlite3", max_size=1000)
+    cache.set(cache.get_key("gpt-3.5-turbo-16k", prompt, 10), "cached completion")
+
+    with mock.patch("boedb.processors.llm.get_llm_cache", return_value=cache):
+        client = OpenAiClient(http_session=http_session_mock)
+    with mock.patch.object(client, "post") as post_mock:
+        completion = await client.complete(prompt, max_tokens=10)
+
+    assert completion == "cached completion"
+    post_mock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.config.OpenAiConfig.API_KEY")
+async def test_open_ai_client_caches_completion(api_key, http_session_mock, tmp_path):
+    prompt = [{"role": "user", "content": "test prompt"}]
+    response = {"choices": [{"message": {"content": "completion"}}], "usage": {"total_tokens": 1}}
+    cache = LLMCache(tmp_path / "cache.sqlite3", max_size=1000)
+
+    with mock.patch("boedb.processors.llm.get_llm_cache", return_value=cache):
+        client = OpenAiClient(http_session=http_session_mock)
+    with mock.patch.object(client, "post", return_value=response) as post_mock:
+        await client.complete(prompt, max_tokens=10)
+        completion = await client.complete(prompt, max_tokens=10)
+
+    assert completion == "completion"
+    post_mock.assert_awaited_once()
+    assert cache.stats()["entries"] == 1
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.config.OpenAiConfig.API_KEY")
+async def test_open_ai_client_get_embeddings_many_requests_cache_misses(api_key, http_session_mock, tmp_path):
+    cache = LLMCache(tmp_path / "cache.sqlite3", max_size=1000)
+    cache.set(cache.get_key("text-embedding-ada-002", "cached"), [0.5])
+    response = {"data": [{"index": 0, "embedding": [0.25]}], "usage": {"total_tokens": 1}}
+
+    with mock.patch("boedb.processors.llm.get_llm_cache", return_value=cache):
+        client = OpenAiClient(http_session=http_session_mock)
+    with mock.patch.object(client, "post", return_value=response) as post_mock:
+        embeddings = await client.get_embeddings_many(["cached", "missing"])
+
+    assert embeddings == [array("f", [0.5]), array("f", [0.25])]
+    assert post_mock.await_args.args[1]["input"] == ["missing"]
+    cached = cache.get(cache.get_key("text-embedding-ada-002", "missing"))
+    assert decode_embedding(cached) == array("f", [0.25])
+
+
+def test_embedding_encoding_roundtrip():
+    embedding = array("f", [0.5, -1.5, 3.0])
+    encoded = encode_embedding(embedding)
+
+    assert base64.b64decode(encoded) == struct.pack("<3f", 0.5, -1.5, 3.0)
+    assert decode_embedding(encoded) == embedding
+    assert decode_embedding([0.5, -1.5, 3.0]) == embedding
+
+
+def test_parse_reset_time():
+    assert parse_reset_time("250ms") == 0.25
+    assert parse_reset_time("1.5s") == 1.5
+    assert parse_reset_time("6m0s") == 360
+    assert parse_reset_time("1h2m3s") == 3723
+    assert parse_reset_time(None) == 0
+
+
+def test_estimate_prompt_tokens_includes_max_tokens():
+    prompt = [{"role": "system", "content": "x" * 30}, {"role": "user", "content": "x" * 60}]
+    assert estimate_prompt_tokens(prompt) == 11 + 21
+    assert estimate_prompt_tokens(prompt, 100) == 11 + 21 + 100
+
+
+def test_token_bucket_does_not_limit_before_update():
+    bucket = TokenBucket()
+    bucket.consume(1000)
+    assert bucket.get_wait_time(1000) == 0
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket()
+    bucket.update(capacity=100, remaining=10, reset_seconds=9)
+
+    assert bucket.rate == 10
+    assert bucket.get_wait_time(10) == 0
+    bucket.consume(10)
+    assert bucket.get_wait_time(20) == pytest.approx(2, abs=0.01)
+    assert bucket.get_wait_time(1000) == pytest.approx(10, abs=0.01)
+
+
+def test_token_bucket_does_not_limit_with_zero_capacity():
+    bucket = TokenBucket()
+    bucket.update(capacity=100, remaining=0, reset_seconds=10)
+    bucket.update(capacity=0, remaining=0, reset_seconds=0)
+
+    bucket.consume(1000)
+    assert bucket.get_wait_time(1000) == 0
+
+
+@pytest.mark.asyncio
+@mock.patch("asyncio.sleep")
+async def test_rate_limiter_admits_with_remaining_limits(sleep_mock):
+    limiter = RateLimiter("model")
+    response = mock.Mock(
+        headers={
+            "x-ratelimit-limit-requests": "100",
+            "x-ratelimit-remaining-requests": "99",
+            "x-ratelimit-reset-requests": "600ms",
+            "x-ratelimit-limit-tokens": "1000",
+            "x-ratelimit-remaining-tokens": "500",
+            "x-ratelimit-reset-tokens": "30s",
+        }
+    )
+    limiter.update(response)
+    await limiter.acquire(100)
+
+    sleep_mock.assert_not_awaited()
+    assert limiter.requests.level == pytest.approx(98, abs=0.1)
+    assert limiter.tokens.level == pytest.approx(400, abs=0.1)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_waits_for_token_limit():
+    limiter = RateLimiter("model")
+    response = mock.Mock(
+        headers={
+            "x-ratelimit-limit-tokens": "1000",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "1s",
+        }
+    )
+    limiter.update(response)
+
+    with mock.patch("asyncio.sleep") as sleep_mock:
+        sleep_mock.side_effect = lambda wait: limiter.tokens.update(1000, 1000, 0)
+        await limiter.acquire(100)
+
+    assert sleep_mock.await_args.args[0] == pytest.approx(0.1, abs=0.01)
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.config.OpenAiConfig.API_KEY")
+async def test_open_ai_client_post_updates_rate_limiter(api_key):
+    endpoint = "https://api.openai.com/v1/embeddings"
+    headers = {"x-ratelimit-limit-requests": "10", "x-ratelimit-remaining-requests": "5"}
+    limiter = RateLimiter("model")
+
+    async with get_http_client_session() as http_session:
+        client = OpenAiClient(http_session=http_session)
+        with aioresponses() as mock_server:
+            mock_server.post(endpoint, status=200, payload={}, headers=headers)
+            await client.post(endpoint, {}, limiter, 10)
+
+    assert limiter.requests.capacity == 10
+    assert limiter.requests.level == pytest.approx(5, abs=0.1)
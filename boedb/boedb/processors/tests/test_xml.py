@@ -48,6 +48,14 @@ def test_node_children_to_dict_returns_empty_dict():
     assert data == {}
 
 
+def test_node_children_to_dict_joins_text_and_tails():
+    root = ElementTree.fromstring('<xml><meta a="1"> start <b>bold</b> end <c/></meta><empty/></xml>')
+    assert node_children_to_dict(root) == {
+        "meta": {"@a": "1", "b": "bold", "c": None, "#text": "start  end"},
+        "empty": None,
+    }
+
+
 def test_node_text_content_returns_all_children():
     xml = ElementTree.fromstring("<xml><one>data1</one><two>data2</two></xml>")
     text = node_text_content(xml)
@@ -1,11 +1,35 @@
 from xml.etree import ElementTree
 
-import xmltodict
+
+def node_to_dict(node):
+    """Convert `node` to the same structure xmltodict would build: attributes under
+    `@name` keys, text under `#text`, repeated children as lists, and just the text
+    (or None) for nodes without attributes or children."""
+    item = {f"@{name}": value for name, value in node.attrib.items()}
+    text = [node.text] if node.text else []
+
+    for child in node:
+        value = node_to_dict(child)
+        if child.tag not in item:
+            item[child.tag] = value
+        elif isinstance(item[child.tag], list):
+            item[child.tag].append(value)
+        else:
+            item[child.tag] = [item[child.tag], value]
+        if child.tail:
+            text.append(child.tail)
+
+    text = "".join(text).strip() or None
+    if not item:
+        return text
+    if text:
+        item["#text"] = text
+    return item
 
 
 def node_children_to_dict(root):
     """Return all child nodes and their text as a dictionary."""
-    return xmltodict.parse(ElementTree.tostring(root))[root.tag] or {}
+    return node_to_dict(root) or {}
 
 
 def node_text_content(root):
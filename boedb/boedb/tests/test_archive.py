@@ -0,0 +1,74 @@
+from unittest import mock
+
+import pytest
+
+from boedb.archive import DocumentArchive, get_document_archive
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = DocumentArchive(tmp_path / "archive")
+    yield archive
+    archive.close()
+
+
+@pytest.fixture
+def reset_document_archive():
+    if hasattr(DocumentArchive, "_archive"):
+        del DocumentArchive._archive
+    yield
+    if hasattr(DocumentArchive, "_archive"):
+        del DocumentArchive._archive
+
+
+@mock.patch("boedb.archive.DiarioBoeConfig.ARCHIVE_PATH", None)
+def test_get_document_archive_is_disabled_without_path(reset_document_archive):
+    assert get_document_archive() is None
+
+
+def test_get_document_archive_returns_singleton(reset_document_archive, tmp_path):
+    with mock.patch("boedb.archive.DiarioBoeConfig.ARCHIVE_PATH", tmp_path / "archive"):
+        archive = get_document_archive()
+
+    assert isinstance(archive, DocumentArchive)
+    assert get_document_archive() is archive
+    archive.close()
+
+
+def test_archive_stores_and_returns_documents(archive):
+    archive.put("BOE-A-1", b"<xml>one</xml>")
+
+    assert "BOE-A-1" in archive
+    assert "BOE-A-2" not in archive
+    assert archive.get("BOE-A-1") == b"<xml>one</xml>"
+    assert archive.get("BOE-A-2") is None
+
+
+def test_archive_compresses_documents(archive):
+    data = b"<xml>" + b"<p>text</p>" * 1000 + b"</xml>"
+    digest = archive.put("BOE-A-1", data)
+
+    assert archive.get_object_path(digest).stat().st_size < len(data) / 10
+
+
+def test_archive_stores_same_content_once(archive):
+    digest_1 = archive.put("BOE-A-1", b"<xml>same</xml>")
+    digest_2 = archive.put("BOE-A-2", b"<xml>same</xml>")
+
+    assert digest_1 == digest_2
+    assert len(list((archive.path / "objects").glob("*/*"))) == 1
+    assert archive.get("BOE-A-2") == b"<xml>same</xml>"
+
+
+def test_archive_index_is_reloaded(tmp_path):
+    archive = DocumentArchive(tmp_path / "archive")
+    archive.put("BOE-A-1", b"<xml>old</xml>")
+    archive.put("BOE-A-1", b"<xml>new</xml>")
+    archive.put("BOE-S-1", b"<xml>summary</xml>")
+    archive.close()
+
+    archive = DocumentArchive(tmp_path / "archive")
+    assert len(archive) == 2
+    assert archive.ids("BOE-A") == ["BOE-A-1"]
+    assert archive.get("BOE-A-1") == b"<xml>new</xml>"
+    archive.close()
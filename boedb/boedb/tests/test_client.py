@@ -4,7 +4,14 @@ import aiohttp
 import pytest
 from aioresponses import aioresponses
 
-from boedb.client import HttpClient, HttpRetryManager, get_http_client_session
+from boedb.client import (
+    HttpClient,
+    HttpRetryManager,
+    JsonCodec,
+    get_http_client_session,
+    get_json_codec,
+)
+from boedb.metrics import InMemorySink, Metrics
 
 
 @pytest.mark.asyncio
@@ -168,3 +175,119 @@ async def test_http_client_handles_request_retry():
 
         request_calls, *_ = list(mock_server.requests.values())
         assert len(request_calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_http_client_calls_response_hook():
+    test_url = "https://test.com"
+    response_hook = mock.Mock()
+    with aioresponses() as mock_server:
+        mock_server.get(test_url, status=200, body="ok", headers={"x-test": "value"})
+
+        async with get_http_client_session() as session:
+            client = HttpClient(session, retry_manager=False)
+            await client.get(test_url, parse_response=False, response_hook=response_hook)
+
+    response = response_hook.call_args.args[0]
+    assert response.headers["x-test"] == "value"
+
+
+@pytest.mark.asyncio
+async def test_http_client_streams_response_chunks():
+    test_url = "https://test.com"
+    with aioresponses() as mock_server:
+        mock_server.get(test_url, status=200, body=b"0123456789")
+
+        async with get_http_client_session() as session:
+            client = HttpClient(session, retry_manager=False)
+            chunks = [chunk async for chunk in client.get_stream(test_url, chunk_size=4)]
+
+    assert b"".join(chunks) == b"0123456789"
+
+
+@pytest.mark.asyncio
+async def test_http_client_retries_stream_request():
+    test_url = "https://test.com"
+    retry_mock = mock.AsyncMock()
+    retry_mock.retry_wait.return_value = True
+
+    with aioresponses() as mock_server:
+        mock_server.get(test_url, status=429, body="error")
+        mock_server.get(test_url, status=200, body=b"data")
+
+        async with get_http_client_session() as session:
+            client = HttpClient(session, retry_manager=retry_mock)
+            chunks = [chunk async for chunk in client.get_stream(test_url)]
+
+    assert chunks == [b"data"]
+    retry_mock.retry_wait.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_http_client_stream_raises_response_error():
+    test_url = "https://test.com"
+    with aioresponses() as mock_server:
+        mock_server.get(test_url, status=404, body="error")
+
+        async with get_http_client_session() as session:
+            client = HttpClient(session, retry_manager=False)
+            with pytest.raises(aiohttp.ClientError):
+                [chunk async for chunk in client.get_stream(test_url)]
+
+
+@pytest.mark.asyncio
+async def test_http_client_records_status_and_retry_metrics():
+    test_url = "https://test.com"
+    sink = InMemorySink()
+    retry_mock = mock.AsyncMock()
+    retry_mock.retry_wait.side_effect = [True]
+
+    with aioresponses() as mock_server:
+        mock_server.get(test_url, status=429, body="error")
+        mock_server.get(test_url, status=200, body="ok")
+
+        async with get_http_client_session() as session:
+            client = HttpClient(session, retry_manager=retry_mock)
+            client.metrics = Metrics(sink)
+            await client.get(test_url, parse_response=False)
+
+    assert sink.get("boedb_http_requests_total", method="get", status=429) == 1
+    assert sink.get("boedb_http_requests_total", method="get", status=200) == 1
+    assert sink.get("boedb_http_retries_total", method="get") == 1
+    assert sink.get_histogram("boedb_http_request_seconds", method="get").count == 2
+
+
+@pytest.mark.parametrize("library", ["orjson", "ujson", "json"])
+def test_json_codec_roundtrip(library):
+    pytest.importorskip(library)
+    codec = JsonCodec(library)
+    data = {"título": "Artículo", "n": [1, 2.5, None]}
+
+    assert codec.loads(codec.dumps(data)) == data
+    assert codec.loads(codec.dumps_bytes(data)) == data
+    assert isinstance(codec.dumps(data), str)
+    assert codec.dumps_bytes(data).decode() == codec.dumps(data)
+
+
+def test_json_codec_auto_falls_back_to_stdlib():
+    with mock.patch("importlib.util.find_spec", side_effect=lambda name: name == "json"):
+        codec = JsonCodec("auto")
+    assert codec.library == "json"
+
+
+def test_json_codec_rejects_unknown_library():
+    with pytest.raises(ValueError):
+        JsonCodec("simplejson")
+
+
+@mock.patch("boedb.client.HttpConfig.JSON_CODEC", "json")
+def test_get_json_codec_returns_singleton():
+    if hasattr(JsonCodec, "_codec"):
+        del JsonCodec._codec
+
+    ins1 = get_json_codec()
+    ins2 = get_json_codec()
+    del JsonCodec._codec
+
+    assert ins1 is ins2
+    assert ins1.library == "json"
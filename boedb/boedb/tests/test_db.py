@@ -1,10 +1,19 @@
+from array import array
 from datetime import datetime
 from unittest import mock
 
 import psycopg
 import pytest
 
-from boedb.db import PostgresClient, get_db_client
+from boedb.db import (
+    AsyncPostgresClient,
+    PostgresClient,
+    VectorBinaryDumper,
+    get_async_db_client,
+    get_db_client,
+    get_upsert_sql,
+    register_vector,
+)
 
 
 @mock.patch("boedb.config.DBConfig.DSN", "dsn")
@@ -145,6 +154,263 @@ def test_postgres_client_inserts_many_without_columns():
     assert result is None
 
 
+def test_get_upsert_sql_updates_columns_on_conflict():
+    row_dict = {"id": 1, "sequence": 2, "content": "text"}
+    sql, values = get_upsert_sql("test", [row_dict], ("id", "sequence"), ("content",))
+
+    assert sql == (
+        r"INSERT INTO test (content, id, sequence) VALUES (%s, %s, %s)"
+        " ON CONFLICT (id, sequence) DO UPDATE SET content = EXCLUDED.content"
+    )
+    assert values == [("text", 1, 2)]
+
+
+def test_get_upsert_sql_does_nothing_without_update_columns():
+    sql, _ = get_upsert_sql("test", [{"id": 1}], ("id",))
+    assert sql == r"INSERT INTO test (id) VALUES (%s) ON CONFLICT (id) DO NOTHING"
+
+
+def test_postgres_client_upserts_many():
+    row_dict = {"id": 1, "content": "text"}
+    with mock.patch("boedb.db.PostgresClient.execute_many") as execute_many_mock:
+        client = PostgresClient("dsn")
+        client.upsert_many("test", [row_dict, row_dict], ("id",), ("content",))
+
+    upsert_stm = (
+        r"INSERT INTO test (content, id) VALUES (%s, %s)"
+        " ON CONFLICT (id) DO UPDATE SET content = EXCLUDED.content"
+    )
+    execute_many_mock.assert_called_once_with(upsert_stm, [("text", 1), ("text", 1)])
+
+
+@mock.patch("boedb.config.DBConfig.DSN", "dsn")
+def test_get_async_db_client_returns_singleton():
+    with mock.patch("boedb.db.AsyncPostgresClient", wraps=AsyncPostgresClient) as ClientMock:
+        ins1 = get_async_db_client()
+        ins2 = get_async_db_client()
+
+    assert ins1 is ins2
+    ClientMock.assert_called_once_with("dsn", max_size=mock.ANY)
+
+
+@pytest.fixture
+def async_pool_mock():
+    conn_mock = mock.MagicMock()
+    cursor_mock = mock.AsyncMock()
+    with mock.patch("boedb.db.AsyncConnectionPool") as PoolMock:
+        pool = PoolMock.return_value
+        pool.open = mock.AsyncMock()
+        pool.close = mock.AsyncMock()
+        pool.connection.return_value.__aenter__.return_value = conn_mock
+        conn_mock.cursor.return_value.__aenter__.return_value = cursor_mock
+        yield PoolMock, cursor_mock
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_opens_pool_lazily(async_pool_mock):
+    PoolMock, _ = async_pool_mock
+    client = AsyncPostgresClient("dsn", max_size=10)
+    PoolMock.assert_not_called()
+
+    pool = await client.get_pool()
+    assert pool is await client.get_pool()
+    PoolMock.assert_called_once_with("dsn", max_size=10, configure=register_vector, open=False)
+    pool.open.assert_awaited_once()
+
+    await client.close()
+    pool.close.assert_awaited_once()
+    assert client.pool is None
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_executes_sql_with_result(async_pool_mock):
+    _, cursor_mock = async_pool_mock
+    cursor_mock.rownumber = 0
+    cursor_mock.fetchall.return_value = [1, 2, 3]
+
+    sql = r"select * from test where id = %s"
+    client = AsyncPostgresClient("dsn")
+    rows = await client.execute(sql, (1,))
+
+    cursor_mock.execute.assert_awaited_once_with(sql, (1,))
+    assert rows == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_iterates_server_side_cursor(async_pool_mock):
+    test_rows = [{"id": 1}, {"id": 2}]
+    _, cursor_mock = async_pool_mock
+    cursor_mock.__aiter__.return_value = test_rows
+
+    sql = "select id from test"
+    client = AsyncPostgresClient("dsn")
+    rows = [row async for row in client.iterate(sql, size=1)]
+
+    conn_mock = client.pool.connection.return_value.__aenter__.return_value
+    conn_mock.cursor.assert_called_once_with(name="boedb_iterate", row_factory=psycopg.rows.dict_row)
+    cursor_mock.execute.assert_awaited_once_with(sql, None)
+    assert cursor_mock.itersize == 1
+    assert rows == test_rows
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_executes_many_without_result(async_pool_mock):
+    _, cursor_mock = async_pool_mock
+    cursor_mock.rownumber = None
+
+    sql = r"delete from test where id = %s"
+    client = AsyncPostgresClient("dsn")
+    result = await client.execute_many(sql, [(1,), (2,)])
+
+    cursor_mock.executemany.assert_awaited_once_with(sql, [(1,), (2,)])
+    assert result is None
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_inserts_many_with_columns():
+    table = "test_table"
+    row_dict = {"column1": "value1", "column2": "value2"}
+    columns = ["column1", "column2", "column3"]
+
+    with mock.patch("boedb.db.AsyncPostgresClient.execute_many") as execute_mock:
+        execute_mock.return_value = None
+        client = AsyncPostgresClient("dsn")
+        result = await client.insert_many(table, [row_dict, row_dict], columns)
+
+    insert_stm = r"INSERT INTO test_table (column1, column2, column3) VALUES (%s, %s, %s)"
+    values = ("value1", "value2", None)
+    execute_mock.assert_awaited_once_with(insert_stm, [values, values])
+    assert result is None
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_inserts_row():
+    table = "test_table"
+    row_dict = {"column1": "value1"}
+    with mock.patch("boedb.db.AsyncPostgresClient.insert_many") as insert_many_mock:
+        client = AsyncPostgresClient("dsn")
+        await client.insert(table, row_dict)
+
+    insert_many_mock.assert_awaited_once_with(table, [row_dict], None)
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_upserts_row():
+    row_dict = {"id": 1, "content": "text"}
+    with mock.patch("boedb.db.AsyncPostgresClient.execute_many") as execute_many_mock:
+        client = AsyncPostgresClient("dsn")
+        await client.upsert("test", row_dict, ("id",), ("content",), ("id", "content"))
+
+    upsert_stm = (
+        r"INSERT INTO test (id, content) VALUES (%s, %s)"
+        " ON CONFLICT (id) DO UPDATE SET content = EXCLUDED.content"
+    )
+    execute_many_mock.assert_awaited_once_with(upsert_stm, [(1, "text")])
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_executes_transaction_in_pipeline(async_pool_mock):
+    PoolMock, cursor_mock = async_pool_mock
+    conn_mock = PoolMock.return_value.connection.return_value.__aenter__.return_value
+
+    client = AsyncPostgresClient("dsn")
+    await client.execute_transaction([("insert a", [(1,)]), ("insert b", [(2,), (3,)])])
+
+    conn_mock.pipeline.assert_called_once()
+    conn_mock.transaction.assert_called_once()
+    cursor_mock.executemany.assert_has_awaits(
+        [mock.call("insert a", [(1,)]), mock.call("insert b", [(2,), (3,)])]
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_copies_many(async_pool_mock):
+    _, cursor_mock = async_pool_mock
+    copy_mock = mock.AsyncMock()
+    copy_mock.set_types = mock.Mock()
+    cursor_mock.copy = mock.MagicMock()
+    cursor_mock.copy.return_value.__aenter__.return_value = copy_mock
+
+    row_dicts = [{"id": 1, "embedding": [0.1]}, {"id": 2}]
+    client = AsyncPostgresClient("dsn")
+    await client.copy_many("test", row_dicts, ("id", "embedding"), ("int4", "vector"))
+
+    cursor_mock.copy.assert_called_once_with("COPY test (id, embedding) FROM STDIN (FORMAT BINARY)")
+    copy_mock.set_types.assert_called_once_with(("int4", "vector"))
+    copy_mock.write_row.assert_has_awaits([mock.call((1, [0.1])), mock.call((2, None))])
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_advisory_lock_releases_lock(async_pool_mock):
+    PoolMock, _ = async_pool_mock
+    conn_mock = PoolMock.return_value.connection.return_value.__aenter__.return_value
+    conn_mock.execute = mock.AsyncMock()
+    conn_mock.commit = mock.AsyncMock()
+    conn_mock.execute.return_value.fetchone = mock.AsyncMock(return_value=(True,))
+
+    client = AsyncPostgresClient("dsn")
+    async with client.advisory_lock("key") as locked:
+        assert locked is True
+
+    conn_mock.execute.assert_has_awaits(
+        [
+            mock.call("select pg_try_advisory_lock(hashtext(%s))", ("key",)),
+            mock.call("select pg_advisory_unlock(hashtext(%s))", ("key",)),
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_postgres_client_advisory_lock_not_taken(async_pool_mock):
+    PoolMock, _ = async_pool_mock
+    conn_mock = PoolMock.return_value.connection.return_value.__aenter__.return_value
+    conn_mock.execute = mock.AsyncMock()
+    conn_mock.commit = mock.AsyncMock()
+    conn_mock.execute.return_value.fetchone = mock.AsyncMock(return_value=(False,))
+
+    client = AsyncPostgresClient("dsn")
+    async with client.advisory_lock("key") as locked:
+        assert locked is False
+
+    conn_mock.execute.assert_awaited_once()
+
+
+def test_vector_binary_dumper_dumps_pgvector_format():
+    dumped = VectorBinaryDumper(list).dump([1.0, -0.5])
+    assert dumped == b"\x00\x02\x00\x00\x3f\x80\x00\x00\xbf\x00\x00\x00"
+
+
+def test_vector_binary_dumper_dumps_float32_array_buffer():
+    embedding = array("f", [1.0, -0.5])
+    dumped = VectorBinaryDumper(array).dump(embedding)
+
+    assert bytes(dumped) == b"\x00\x02\x00\x00\x3f\x80\x00\x00\xbf\x00\x00\x00"
+    assert embedding == array("f", [1.0, -0.5])
+
+
+@pytest.mark.asyncio
+async def test_register_vector_registers_binary_dumper():
+    conn = mock.Mock()
+    info = mock.Mock(oid=12345)
+    with mock.patch("boedb.db.TypeInfo.fetch", mock.AsyncMock(return_value=info)):
+        await register_vector(conn)
+
+    info.register.assert_called_once_with(conn)
+    (_, dumper), (cls, array_dumper) = [c.args for c in conn.adapters.register_dumper.call_args_list]
+    assert issubclass(dumper, VectorBinaryDumper)
+    assert dumper.oid == 12345
+    assert cls is array and array_dumper is dumper
+
+
+@pytest.mark.asyncio
+async def test_register_vector_skips_missing_extension():
+    conn = mock.Mock()
+    with mock.patch("boedb.db.TypeInfo.fetch", mock.AsyncMock(return_value=None)):
+        await register_vector(conn)
+
+    conn.adapters.register_dumper.assert_not_called()
+
+
 @pytest.fixture
 def test_db_cursor():
     with psycopg.connect("user=test dbname=test") as conn:
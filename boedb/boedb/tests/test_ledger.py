@@ -0,0 +1,59 @@
+import json
+from datetime import date, datetime, timedelta
+
+from boedb.ledger import ProgressLedger, date_range
+
+
+def test_date_range_is_inclusive_and_newest_first():
+    assert date_range(date(2023, 11, 1), date(2023, 11, 3)) == [
+        date(2023, 11, 3),
+        date(2023, 11, 2),
+        date(2023, 11, 1),
+    ]
+
+
+def test_date_range_accepts_reversed_datetimes():
+    assert date_range(datetime(2023, 11, 2), datetime(2023, 11, 1)) == [date(2023, 11, 2), date(2023, 11, 1)]
+
+
+def test_ledger_persists_marks(tmp_path):
+    path = tmp_path / "ledger.json"
+    ledger = ProgressLedger(path)
+    ledger.mark(date(2023, 11, 1), ProgressLedger.DONE, articles=3, items=5)
+
+    entries = json.loads(path.read_text(encoding="utf-8"))
+    assert entries["2023-11-01"]["status"] == ProgressLedger.DONE
+    assert entries["2023-11-01"]["articles"] == 3
+
+    reloaded = ProgressLedger(path)
+    assert reloaded.get(date(2023, 11, 1))["items"] == 5
+
+
+def test_ledger_pending_skips_complete_dates(tmp_path):
+    ledger = ProgressLedger(tmp_path / "ledger.json")
+    ledger.mark(date(2023, 11, 1), ProgressLedger.DONE)
+    ledger.mark(date(2023, 11, 2), ProgressLedger.MISSING)
+    ledger.mark(date(2023, 11, 3), ProgressLedger.FAILED, error="ValueError()")
+
+    days = date_range(date(2023, 11, 1), date(2023, 11, 4))
+    assert ledger.pending(days) == [date(2023, 11, 4), date(2023, 11, 3)]
+
+
+def test_ledger_pending_rechecks_dates_missing_before_publication(tmp_path):
+    ledger = ProgressLedger(tmp_path / "ledger.json")
+    ledger.mark(date.today(), ProgressLedger.MISSING)
+    ledger.mark(date.today() + timedelta(days=1), ProgressLedger.MISSING)
+    ledger.mark(date(2023, 11, 1), ProgressLedger.MISSING)
+    ledger.entries["2023-11-02"] = {"status": ProgressLedger.MISSING, "updated": "2023-11-02T09:00:00"}
+
+    days = [date.today() + timedelta(days=1), date.today(), date(2023, 11, 2), date(2023, 11, 1)]
+    assert ledger.pending(days) == days[:3]
+
+
+def test_ledger_summary_counts_statuses(tmp_path):
+    ledger = ProgressLedger(tmp_path / "ledger.json")
+    ledger.mark(date(2023, 11, 1), ProgressLedger.DONE)
+    ledger.mark(date(2023, 11, 2), ProgressLedger.DONE)
+    ledger.mark(date(2023, 11, 3), ProgressLedger.FAILED)
+
+    assert ledger.summary() == {"done": 2, "failed": 1}
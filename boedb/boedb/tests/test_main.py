@@ -0,0 +1,143 @@
+from contextlib import asynccontextmanager
+from datetime import date
+from unittest import mock
+
+import pytest
+
+from boedb.ledger import ProgressLedger
+from boedb.main import backfill_date, backfill_dates, get_shards, run_backfill_shard
+
+
+def get_db_client_mock(claimed=True, loaded=False):
+    @asynccontextmanager
+    async def advisory_lock(key):
+        yield claimed
+
+    client = mock.Mock(advisory_lock=advisory_lock)
+    client.execute = mock.AsyncMock(return_value=[{"summary_id": "BOE-S-20231101"}] if loaded else [])
+    return client
+
+
+def test_get_shards_splits_dates_in_order():
+    dates = [date(2023, 11, day) for day in range(5, 0, -1)]
+    assert get_shards(dates, 2) == [dates[0:2], dates[2:4], dates[4:5]]
+
+
+@pytest.mark.asyncio
+async def test_backfill_date_skips_date_claimed_elsewhere():
+    with (
+        mock.patch("boedb.main.get_async_db_client", return_value=get_db_client_mock(claimed=False)),
+        mock.patch("boedb.main.run_diario_boe_pipelines") as run_mock,
+    ):
+        result = await backfill_date(date(2023, 11, 1), None)
+
+    assert result == (ProgressLedger.BUSY, {})
+    run_mock.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_backfill_date_skips_loaded_summary():
+    with (
+        mock.patch("boedb.main.get_async_db_client", return_value=get_db_client_mock(loaded=True)),
+        mock.patch("boedb.main.run_diario_boe_pipelines") as run_mock,
+    ):
+        status, _ = await backfill_date(date(2023, 11, 1), None)
+
+    assert status == ProgressLedger.DONE
+    run_mock.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_backfill_date_returns_stats():
+    stats = {"articles": 1, "items": 2}
+    with (
+        mock.patch("boedb.main.get_async_db_client", return_value=get_db_client_mock()),
+        mock.patch("boedb.main.run_diario_boe_pipelines", return_value=stats),
+    ):
+        result = await backfill_date(date(2023, 11, 1), None)
+
+    assert result == (ProgressLedger.DONE, stats)
+
+
+@pytest.mark.asyncio
+async def test_backfill_date_returns_missing_summary():
+    with (
+        mock.patch("boedb.main.get_async_db_client", return_value=get_db_client_mock()),
+        mock.patch("boedb.main.run_diario_boe_pipelines", return_value=None),
+    ):
+        result = await backfill_date(date(2023, 11, 1), None)
+
+    assert result == (ProgressLedger.MISSING, {})
+
+
+@pytest.mark.asyncio
+@mock.patch("boedb.main.DiarioBoeConfig.ARCHIVE_OFFLINE", True)
+async def test_backfill_date_doesnt_complete_summary_missing_from_archive():
+    with (
+        mock.patch("boedb.main.get_async_db_client", return_value=get_db_client_mock()),
+        mock.patch("boedb.main.run_diario_boe_pipelines", return_value=None),
+    ):
+        result = await backfill_date(date(2023, 11, 1), None)
+
+    assert result == (ProgressLedger.UNARCHIVED, {})
+    assert ProgressLedger.UNARCHIVED not in ProgressLedger.COMPLETE
+
+
+@pytest.mark.asyncio
+async def test_backfill_date_returns_failure():
+    with (
+        mock.patch("boedb.main.get_async_db_client", return_value=get_db_client_mock()),
+        mock.patch("boedb.main.run_diario_boe_pipelines", side_effect=ValueError()),
+    ):
+        result = await backfill_date(date(2023, 11, 1), None)
+
+    assert result == (ProgressLedger.FAILED, {"error": "ValueError()"})
+
+
+@pytest.mark.asyncio
+async def test_backfill_dates_loads_bloom_before_any_date():
+    calls = []
+
+    async def load_article_ids_bloom():
+        calls.append("bloom")
+
+    async def backfill_date(day, http_session, limiter):
+        calls.append(day)
+        return ProgressLedger.DONE, {}
+
+    @asynccontextmanager
+    async def get_http_client_session():
+        yield mock.Mock()
+
+    dates = [date(2023, 11, 2), date(2023, 11, 1)]
+    archive = mock.Mock()
+    with (
+        mock.patch("boedb.main.get_async_db_client", return_value=mock.AsyncMock()),
+        mock.patch("boedb.main.get_document_archive", return_value=archive),
+        mock.patch("boedb.main.get_http_client_session", get_http_client_session),
+        mock.patch("boedb.main.load_article_ids_bloom", load_article_ids_bloom),
+        mock.patch("boedb.main.backfill_date", backfill_date),
+    ):
+        await backfill_dates(dates, 2, 1, mock.Mock())
+
+    assert calls == ["bloom", *dates]
+    archive.close.assert_called_once_with()
+
+
+def test_run_backfill_shard_collects_results():
+    async def backfill_dates(dates, days_concurrency, budget, on_result):
+        for day in dates:
+            on_result(day, ProgressLedger.DONE, {"articles": 1})
+
+    llm_cache = mock.Mock()
+    with (
+        mock.patch("boedb.main.backfill_dates", backfill_dates),
+        mock.patch("boedb.main.get_llm_cache", return_value=llm_cache),
+    ):
+        results = run_backfill_shard([date(2023, 11, 2), date(2023, 11, 1)], 1, 1)
+
+    assert results == {
+        "2023-11-02": {"status": ProgressLedger.DONE, "articles": 1},
+        "2023-11-01": {"status": ProgressLedger.DONE, "articles": 1},
+    }
+    llm_cache.close.assert_called_once_with()
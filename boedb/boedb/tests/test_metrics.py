@@ -0,0 +1,153 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from boedb.metrics import InMemorySink, Metrics, PrometheusSink, get_metrics
+
+
+@pytest.fixture
+def reset_metrics():
+    if hasattr(Metrics, "_metrics"):
+        del Metrics._metrics
+    yield
+    if hasattr(Metrics, "_metrics"):
+        del Metrics._metrics
+
+
+@mock.patch("boedb.metrics.MetricsConfig.SINK", "memory")
+def test_get_metrics_returns_singleton(reset_metrics):
+    ins1 = get_metrics()
+    ins2 = get_metrics()
+
+    assert isinstance(ins1.sink, InMemorySink)
+    assert ins1 is ins2
+
+
+@mock.patch("boedb.metrics.MetricsConfig.SINK", "")
+def test_get_metrics_is_disabled_without_sink(reset_metrics):
+    assert not get_metrics().enabled
+
+
+@mock.patch("boedb.metrics.MetricsConfig.SINK", "statsd")
+def test_get_metrics_rejects_unknown_sink(reset_metrics):
+    with pytest.raises(ValueError):
+        get_metrics()
+
+
+@mock.patch("boedb.metrics.MetricsConfig.SINK", "prometheus")
+def test_get_metrics_writes_prometheus_file_per_process(reset_metrics):
+    with mock.patch("boedb.metrics.os.getpid", return_value=123):
+        metrics = get_metrics()
+
+    assert metrics.sink.path.name == "boedb-metrics-123.prom"
+
+
+def test_metrics_without_sink_do_nothing():
+    metrics = Metrics()
+    metrics.inc("requests")
+    metrics.observe("latency", 1)
+    with metrics.timer("latency"):
+        pass
+    metrics.flush()
+    assert not metrics.enabled
+
+
+def test_in_memory_sink_aggregates_by_labels():
+    sink = InMemorySink()
+    metrics = Metrics(sink)
+
+    metrics.inc("requests", status=200)
+    metrics.inc("requests", 2, status=200)
+    metrics.inc("requests", status=429)
+    metrics.add("in_flight", 2, stage="load")
+    metrics.add("in_flight", -1, stage="load")
+    metrics.set("depth", 5)
+
+    assert sink.get("requests", status=200) == 3
+    assert sink.get("requests", status="429") == 1
+    assert sink.get_total("requests") == 4
+    assert sink.get("in_flight", stage="load") == 1
+    assert sink.get("depth") == 5
+    assert sink.get("missing") == 0
+
+
+def test_in_memory_sink_histogram_buckets():
+    sink = InMemorySink()
+    metrics = Metrics(sink)
+    for value in (0.001, 0.2, 0.2, 1000):
+        metrics.observe("latency", value, stage="load")
+
+    histogram = sink.get_histogram("latency", stage="load")
+    counts = dict(histogram.get_cumulative_counts())
+    assert histogram.count == 4
+    assert counts[0.005] == 1
+    assert counts[0.25] == 3
+    assert counts[300] == 3
+    assert counts[float("inf")] == 4
+
+
+def test_in_memory_sink_get_rate():
+    sink = InMemorySink()
+    Metrics(sink).inc("tokens", 120, model="a")
+    Metrics(sink).inc("tokens", 60, model="b")
+
+    with mock.patch("time.monotonic", return_value=sink.started_at + 60):
+        assert sink.get_rate("tokens", per=60) == 180
+        assert sink.get_rate("tokens", model="b") == 1
+
+
+def test_metrics_timer_observes_failures():
+    sink = InMemorySink()
+    metrics = Metrics(sink)
+    with pytest.raises(ValueError):
+        with metrics.timer("latency"):
+            raise ValueError()
+
+    assert sink.get_histogram("latency").count == 1
+
+
+def test_prometheus_sink_renders_text_format():
+    sink = PrometheusSink()
+    metrics = Metrics(sink)
+    metrics.inc("boedb_http_requests_total", method="get", status=200)
+    metrics.set("boedb_stage_queue_depth", 3, stage='Say "hi"')
+    metrics.observe("boedb_db_query_seconds", 0.5, operation="copy")
+
+    lines = sink.render().splitlines()
+    assert "# TYPE boedb_http_requests_total counter" in lines
+    assert 'boedb_http_requests_total{method="get",status="200"} 1' in lines
+    assert 'boedb_stage_queue_depth{stage="Say \\"hi\\""} 3' in lines
+    assert "# TYPE boedb_db_query_seconds histogram" in lines
+    assert 'boedb_db_query_seconds_bucket{operation="copy",le="0.25"} 0' in lines
+    assert 'boedb_db_query_seconds_bucket{operation="copy",le="+Inf"} 1' in lines
+    assert 'boedb_db_query_seconds_sum{operation="copy"} 0.5' in lines
+    assert 'boedb_db_query_seconds_count{operation="copy"} 1' in lines
+
+
+def test_prometheus_sink_flushes_to_file(tmp_path):
+    path = tmp_path / "metrics.prom"
+    sink = PrometheusSink(path)
+    Metrics(sink).inc("boedb_db_rows_total", 10, operation="copy")
+    sink.flush()
+
+    assert path.read_text(encoding="utf-8") == sink.render()
+    assert list(tmp_path.iterdir()) == [path]
+
+
+@pytest.mark.asyncio
+async def test_prometheus_sink_serves_metrics():
+    sink = PrometheusSink()
+    Metrics(sink).inc("boedb_llm_tokens_total", 10, model="gpt")
+    server = await Metrics(sink).serve(0)
+    port = server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert response.endswith(sink.render().encode())